@@ -0,0 +1,149 @@
+"""Resolución offline de ciudades a códigos IATA con el listado de datos/aeropuertos.csv.
+
+El índice se carga una vez por proceso y responde en microsegundos: coincidencia exacta
+sobre nombres normalizados (sin tildes ni mayúsculas) y, si no, búsqueda difusa por
+trigramas confirmada con distancia de edición. La difusa es estricta (misma inicial, una
+errata por debajo de 8 letras, nunca contra nombres de país) y, si el nomenclátor conoce un
+lugar con ese nombre, descarta los aeropuertos a más de MAX_KM_DIFUSO de él: 'Soria' no
+es una errata de 'Sofia'.
+"""
+import csv
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+RUTA_DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "aeropuertos.csv")
+
+Aeropuerto = namedtuple("Aeropuerto", "iata ciudad pais lat lon")
+MAX_KM_DIFUSO = 300
+
+def normalizar(texto):
+    """'  Córdoba (Argentina) ' -> 'cordoba argentina'"""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", texto).split())
+
+def trigramas(texto):
+    relleno = f"  {texto} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+def distancia_edicion(a, b):
+    if len(a) < len(b): a, b = b, a
+    previa = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + (ca != cb)))
+        previa = actual
+    return previa[-1]
+
+def tolerancia(texto):
+    """Erratas admitidas según la longitud del nombre buscado."""
+    return 0 if len(texto) < 4 else 1 if len(texto) < 8 else 2 if len(texto) <= 10 else 3
+
+
+class IndiceAeropuertos:
+    def __init__(self, aeropuertos):
+        self.aeropuertos = list(aeropuertos)
+        self.paises = {normalizar(a.pais) for a in self.aeropuertos}
+        self._codigos = {a.iata: i for i, a in enumerate(self.aeropuertos)}
+        self._exacto = {}   # nombre normalizado -> [índices], los nombres de ciudad antes que los alias
+        self._nombres = []  # (nombre normalizado, índice) para la búsqueda difusa
+        self._trigramas = {}
+        for i, a in enumerate(self.aeropuertos): self._registrar(a.ciudad, i)
+        self._difuso = lru_cache(maxsize=4096)(self._difuso) # Misma errata, misma respuesta y sin recalcular
+
+    def _registrar(self, nombre, i, difuso=True):
+        """Añade un nombre (ciudad o alias) que apunta al aeropuerto i. Con difuso=False solo vale escrito tal cual."""
+        n = normalizar(nombre)
+        if not n: return
+        destinos = self._exacto.setdefault(n, [])
+        if i in destinos: return
+        destinos.append(i)
+        if not difuso: return
+        self._nombres.append((n, i))
+        for t in trigramas(n): self._trigramas.setdefault(t, []).append(len(self._nombres) - 1)
+
+    @classmethod
+    def desde_csv(cls, ruta=RUTA_DATOS):
+        with open(ruta, encoding="utf-8", newline="") as f:
+            filas = list(csv.DictReader(f))
+        aeropuertos = [Aeropuerto(r["iata"], r["ciudad"], r["pais"], float(r["lat"]), float(r["lon"])) for r in filas]
+        indice = cls(aeropuertos)
+        for i, r in enumerate(filas): # Alias después de todas las ciudades: 'Lagos' es antes Nigeria que un alias
+            for n in filter(None, r["alias"].split("|")): indice._registrar(n, i, difuso=not indice.es_pais(n, r["pais"]))
+        return indice
+
+    def es_pais(self, alias, pais):
+        """Alias que en realidad nombran el país ('Ruanda', 'Rwanda'): con una errata, 'Ronda' acabaría en Kigali."""
+        n = normalizar(alias)
+        return n in self.paises or distancia_edicion(n, normalizar(pais)) <= 2
+
+    def _difuso(self, n, pais=None):
+        if len(n) < 4: return None
+        propios = trigramas(n)
+        # Cada errata rompe como mucho 3 trigramas: quien comparta menos no puede estar a tiro
+        minimo = len(propios) - 3 * tolerancia(n)
+        votos = Counter(k for t in propios for k in self._trigramas.get(t, ()))
+        mejor = None
+        for k, v in votos.most_common(25):
+            if v < minimo: break
+            nombre, i = self._nombres[k]
+            if nombre[0] != n[0] or abs(len(nombre) - len(n)) > tolerancia(nombre): continue
+            if pais and normalizar(self.aeropuertos[i].pais) != pais: continue
+            d = distancia_edicion(n, nombre)
+            if d <= min(tolerancia(nombre), tolerancia(n)) and (mejor is None or (d, k) < mejor[:2]): mejor = (d, k, i)
+        return self.aeropuertos[mejor[2]] if mejor else None
+
+    def buscar(self, texto, difuso=True):
+        """Aeropuerto que sirve a `texto` ('Roma', 'Cordoba, Argentina', 'Bilbo'...) o None. Con difuso=False, solo lo exacto."""
+        n = normalizar(texto)
+        if not n: return None
+        if n in self._exacto: return self.aeropuertos[self._exacto[n][0]]
+        partes = re.match(r"^(.*?)\s*[,(]\s*([^)]*)\)?\s*$", texto or "")
+        if partes:
+            lugar, pais = normalizar(partes.group(1)), normalizar(partes.group(2))
+            if pais in self.paises:
+                candidatos = [i for i in self._exacto.get(lugar, ()) if normalizar(self.aeropuertos[i].pais) == pais]
+                if candidatos: return self.aeropuertos[candidatos[0]]
+                return self._difuso(lugar, pais) if difuso else None
+            if lugar in self._exacto: return self.aeropuertos[self._exacto[lugar][0]]
+            n = lugar
+        for parte in re.split(r"\s*[-/]\s*", texto): # 'Donostia-San Sebastián', 'Bruselas / Brujas'
+            if normalizar(parte) in self._exacto: return self.aeropuertos[self._exacto[normalizar(parte)][0]]
+        if len(n) == 3 and n.upper() in self._codigos: return self.aeropuertos[self._codigos[n.upper()]]
+        return self._difuso(n) if difuso else None
+
+    def resolver(self, ciudades, difuso=True):
+        """Resuelve todas las paradas de una pasada: {ciudad: IATA o None}."""
+        resultado = {}
+        for c in ciudades:
+            a = self.buscar(c, difuso=False)
+            if a is None and difuso:
+                a = self.buscar(c)
+                if a and lejos_del_lugar(c, a): a = None
+            resultado[c] = a.iata if a else None
+        return resultado
+
+
+def lejos_del_lugar(texto, aeropuerto):
+    """Si el nomenclátor sitúa `texto` a más de MAX_KM_DIFUSO del aeropuerto que ha dado la búsqueda difusa."""
+    from geo import distancia_km, obtener_nomenclator # geo importa este módulo
+    sitio = obtener_nomenclator().buscar(texto)
+    return bool(sitio) and distancia_km((sitio.lat, sitio.lon), (aeropuerto.lat, aeropuerto.lon)) > MAX_KM_DIFUSO
+
+
+_indice = None
+_cerrojo = threading.Lock()
+
+def obtener_indice():
+    global _indice
+    with _cerrojo:
+        if _indice is None: _indice = IndiceAeropuertos.desde_csv()
+        return _indice
+
+def resolver_iatas(ciudades, difuso=True):
+    return obtener_indice().resolver(ciudades, difuso)
@@ -0,0 +1,118 @@
+"""Trabajo especulativo mientras el usuario aún rellena la barra lateral.
+
+Cuando origen, paradas, fechas y pasajeros llevan un rato sin cambiar, un hilo de fondo
+resuelve los aeropuertos solo en local (índice y nomenclátor: lo que aún se está escribiendo,
+como "Bil" o "Bilb", no gasta cuota de Gemini ni se queda en su caché) y, si los dos extremos
+tienen código, lanza la búsqueda de vuelos de esas fechas por la misma caché que usa
+"Planificar": al pulsarlo, los vuelos ya están en disco o, si aún está en curso, se espera a
+esa misma llamada en vez de repetirla.
+
+- Cada sesión tiene un número de generación: si sus datos cambian, lo pendiente de la
+  anterior se descarta y lo que estaba en marcha no empieza ningún paso más. La búsqueda de
+  Amadeus que ya había salido no se corta: termina, gasta su cupo y su respuesta queda en la caché.
+- Amadeus nunca tiene más de una búsqueda anticipada a la vez en todo el proceso.
+
+TRAVELGENIUS_ANTICIPO=0 lo apaga; TRAVELGENIUS_ANTICIPO_ESPERA son los segundos sin cambios
+antes de empezar.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from geo import tramos_ruta
+from metricas import contar, medir
+from motor import buscar_vuelos_amadeus_cache, obtener_iatas, puntos_ruta
+
+ACTIVO = os.getenv("TRAVELGENIUS_ANTICIPO", "1") == "1"
+ESPERA = float(os.getenv("TRAVELGENIUS_ANTICIPO_ESPERA", "2"))
+CADUCIDAD = 3600 # Una sesión que no pasa por anticipar() en este tiempo se da por cerrada
+
+
+def huella(p):
+    """Lo que cambia el trabajo anticipado: los filtros, el estilo o la mascota no lo invalidan."""
+    return p.origen, tuple(p.paradas), p.ciudad_1, p.f_ida, p.f_vta, p.pasajeros_api
+
+
+class Anticipador:
+    """Un hilo por proceso y, por sesión, solo la última petición que se le ha pasado. Streamlit no
+    avisa al cerrar una sesión: las que llevan CADUCIDAD segundos sin pasar por aquí se olvidan."""
+
+    def __init__(self, espera=ESPERA, caducidad=CADUCIDAD):
+        self.espera, self.caducidad = espera, caducidad
+        self._pendientes = {} # sesión -> (listo_en, generación, petición)
+        self._generaciones = OrderedDict() # sesión -> (generación, huella, visto), de la menos a la más reciente
+        self._cond = threading.Condition()
+        self._hilo = None
+
+    def anticipar(self, sesion, p):
+        """Apunta `p` para la sesión; si es lo mismo que ya tenía, no hace nada."""
+        ahora = time.monotonic()
+        with self._cond:
+            generacion, anterior, _ = self._generaciones.get(sesion, (0, None, ahora))
+            self._generaciones[sesion] = (generacion, anterior, ahora)
+            self._generaciones.move_to_end(sesion)
+            self._caducar(ahora)
+            if huella(p) == anterior: return
+            if sesion in self._pendientes: contar("anticipo", resultado="reemplazado") # Ni llegó a empezar
+            self._generaciones[sesion] = (generacion + 1, huella(p), ahora)
+            self._pendientes[sesion] = (ahora + self.espera, generacion + 1, p)
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name="anticipo", daemon=True)
+                self._hilo.start()
+            self._cond.notify_all()
+
+    def _caducar(self, ahora):
+        while self._generaciones:
+            sesion, (_, _, visto) = next(iter(self._generaciones.items()))
+            if visto > ahora - self.caducidad: break
+            del self._generaciones[sesion]
+            self._pendientes.pop(sesion, None)
+
+    def vigente(self, sesion, generacion):
+        with self._cond: return self._generaciones.get(sesion, (None,))[0] == generacion
+
+    def _siguiente(self):
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                listos = [(listo, s) for s, (listo, _, _) in self._pendientes.items() if listo <= ahora]
+                if listos:
+                    sesion = min(listos)[1]
+                    _, generacion, p = self._pendientes.pop(sesion)
+                    return sesion, generacion, p
+                self._cond.wait(min((listo for listo, _, _ in self._pendientes.values()), default=ahora + 60) - ahora)
+
+    def _bucle(self):
+        while True:
+            sesion, generacion, p = self._siguiente()
+            try:
+                with medir("anticipo"): hecho = calentar(p, lambda: self.vigente(sesion, generacion))
+                contar("anticipo", resultado="hecho" if hecho else "cancelado")
+            except Exception:
+                contar("anticipo", resultado="error") # Es solo especulación: "Planificar" lo reintentará
+
+
+def calentar(p, vigente=lambda: True):
+    """Aeropuertos y vuelos de `p` a la caché. Devuelve False si `vigente()` deja de cumplirse por el camino."""
+    iatas = obtener_iatas([p.origen, p.ciudad_1], ia=False) # Sin código en local no se calienta nada
+    iata_o, iata_d = iatas[p.origen], iatas[p.ciudad_1]
+    if not (iata_o and iata_d and p.f_ida and p.f_vta) or iata_o == iata_d: return True
+    if tramos_ruta(p.paradas, puntos_ruta(p.paradas, ia=False))[0].volar is False: return True # No se enseñarán vuelos
+    if not vigente(): return False
+    buscar_vuelos_amadeus_cache(iata_o, iata_d, p.f_ida, p.f_vta, *p.pasajeros_api)
+    return True
+
+
+_anticipador = None
+_cerrojo = threading.Lock()
+
+def obtener_anticipador():
+    global _anticipador
+    with _cerrojo:
+        if _anticipador is None: _anticipador = Anticipador()
+        return _anticipador
+
+def anticipar(sesion, p):
+    """Lo que llama la interfaz en cada ejecución con lo que haya en la barra lateral."""
+    if ACTIVO: obtener_anticipador().anticipar(sesion, p)
@@ -0,0 +1,44 @@
+"""Tiempo hasta el primer render de viaje.py en un intérprete recién arrancado.
+
+    python benchmarks/arranque.py [repeticiones]
+
+Cada repetición es un proceso nuevo (como una réplica que acaba de escalar) que pinta la
+página inicial con el AppTest de Streamlit. Además del tiempo, comprueba qué SDK pesados
+se han llegado a importar: en el primer render no debería aparecer ninguno.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PESADOS = ("amadeus", "google.generativeai", "pydeck")
+
+MEDIR = f"""
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file({os.path.join(RAIZ, "viaje.py")!r}, default_timeout=120).run()
+t2 = time.perf_counter()
+print(json.dumps({{"streamlit": t1 - t0, "render": t2 - t1, "errores": len(at.exception),
+                  "pesados": [m for m in {PESADOS!r} if m in sys.modules]}}))
+"""
+
+def medir():
+    salida = subprocess.run([sys.executable, "-c", MEDIR], cwd=RAIZ, capture_output=True, text=True, check=True).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    medidas = [medir() for _ in range(repeticiones)]
+    render = sorted(m["render"] for m in medidas)
+    print(f"importar streamlit: {statistics.median(m['streamlit'] for m in medidas) * 1000:.0f} ms (mediana)")
+    print(f"primer render:      {statistics.median(render) * 1000:.0f} ms (mediana), {render[0] * 1000:.0f}-{render[-1] * 1000:.0f} ms")
+    pesados = sorted({p for m in medidas for p in m["pesados"]})
+    print(f"SDK importados:     {', '.join(pesados) or 'ninguno'}")
+    if any(m["errores"] for m in medidas): print("⚠️ El script lanzó excepciones durante el render")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Latencia, llamadas externas y caché de un plan completo, sin red.
+
+    python benchmarks/planificacion.py [-n 5] [--escala 0.1] [--prob-429 0.05] [--json salida.json] [--referencia base.json]
+
+Cada escenario (Ciudad Única y Roadtrip, con fechas exactas, puente y mes flexible) pasa
+por el mismo camino que la interfaz y lote.py: motor.planificar con vuelos y guía y, en los
+modos de mes, el calendario de precios. Gemini y Amadeus son los dobles de simulados.py,
+y la caché en disco es un fichero temporal. Se mide dos veces: en frío (caché vacía antes
+de cada plan) y en caliente (misma petición ya cacheada). Con --sesiones N, cada repetición
+lanza N veces el mismo plan a la vez, como varias sesiones pidiendo el mismo puente; las
+llamadas se cuentan entonces por repetición, no por sesión. La columna del semáforo dice de
+dónde salió cada uno: del histórico de precios, de los umbrales de la IA o de una pregunta
+suelta. El histórico no se borra entre pasadas en frío, así que se va llenando como en uso real.
+
+"en serie" es el máximo de llamadas externas que no se solaparon entre sí: si un cambio
+mete un prompt que espera a otro, sube aunque la latencia total apenas se note. Con
+--referencia se compara con un --json anterior y se sale con 1 si hay más llamadas, más
+llamadas en serie o una mediana peor que la tolerancia.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import simulados
+
+def escenarios():
+    hoy = date.today()
+    mes = (hoy.month + 1) % 12 + 1 # Dentro de dos meses: siempre hay fechas futuras
+    ida = hoy + timedelta(days=45)
+    exactas = {"ida": ida.isoformat(), "vuelta": (ida + timedelta(days=5)).isoformat()}
+    puente = {"mes": mes, "dias": 4, "modo": "puente", "semana": 2}
+    flexible = {"mes": mes, "dias": 7, "modo": "flexible", "inicio": 10}
+    coche = {"transporte": "🚗 Coche Propio / Alquiler", "vehiculo": "🚗 Coche (Combustión/Híbrido)", "modelo_coche": "6.5 L/100km"}
+    return {
+        "ciudad-exactas": {"origen": "Bilbao", "destino": "Roma", **exactas},
+        "ciudad-puente": {"origen": "Bilbao", "destino": "París", **puente},
+        "ciudad-flexible": {"origen": "Madrid", "destino": "Londres", "edades_ninos": [8], **flexible},
+        "roadtrip-exactas": {"origen": "Bilbao", "destinos": ["Burdeos", "París", "Bruselas"], **coche, **exactas},
+        "roadtrip-puente": {"origen": "Madrid", "destinos": ["Roma", "Florencia", "Venecia"], **puente},
+        "roadtrip-flexible": {"origen": "Barcelona", "destinos": ["Praga", "Viena", "Budapest"], "mascota": True, **coche, **flexible},
+    }
+
+def percentil(valores, q):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, math.ceil(q * len(ordenados)) - 1))]
+
+def un_plan(motor, datos):
+    """Lo que hace la interfaz al pulsar Planificar, pedir la guía y abrir el calendario."""
+    p = motor.Peticion.desde_dict(datos)
+    plan = motor.planificar(p, ("vuelos", "guia"))
+    if "modo" in datos and plan.get("iata_origen") and plan.get("iata_destino") and "vuelos" in plan:
+        pares = motor.pares_fechas_mes(datos["mes"], datos["dias"], datos["modo"])
+        motor.buscar_calendario_precios(plan["iata_origen"], plan["iata_destino"], pares, *p.pasajeros_api)
+    return plan
+
+def fuentes_semaforo():
+    from metricas import registro # Después de preparar el entorno, como el motor
+    return {dict(e)["fuente"]: n for (nombre, e), n in registro.instantanea()["contadores"].items() if nombre == "semaforo"}
+
+def medir(motor, cache, registro, datos, repeticiones, frio, sesiones=1):
+    tiempos, llamadas, errores = [], [], 0
+    antes = {e: dict(v) for e, v in (("aciertos", cache.aciertos), ("fallos", cache.fallos))}
+    semaforo_antes = fuentes_semaforo()
+    for _ in range(repeticiones):
+        if frio: cache.limpiar()
+        marca = len(registro.llamadas)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sesiones) as pool:
+            for futuro in [pool.submit(un_plan, motor, datos) for _ in range(sesiones)]:
+                if futuro.exception(): errores += 1
+        tiempos.append(time.perf_counter() - t0)
+        llamadas.append(registro.desde(marca))
+    por_servicio = lambda servicio: [[ll for ll in lote if ll.servicio == servicio] for lote in llamadas]
+    aciertos = {e: cache.aciertos[e] - antes["aciertos"].get(e, 0) for e in cache.aciertos}
+    fallos = {e: cache.fallos[e] - antes["fallos"].get(e, 0) for e in cache.fallos}
+    semaforo = {f: n - semaforo_antes.get(f, 0) for f, n in fuentes_semaforo().items() if n > semaforo_antes.get(f, 0)}
+    return {
+        "n": repeticiones, "errores": errores,
+        "p50": percentil(tiempos, 0.5), "p90": percentil(tiempos, 0.9), "p99": percentil(tiempos, 0.99), "max": max(tiempos),
+        "gemini": statistics.mean(map(len, por_servicio("gemini"))),
+        "amadeus": statistics.mean(map(len, por_servicio("amadeus"))),
+        "429": sum(ll.estado == 429 for lote in llamadas for ll in lote),
+        "en_serie": max(simulados.en_serie(lote) for lote in llamadas),
+        "cache": {e: aciertos.get(e, 0) / (aciertos.get(e, 0) + fallos.get(e, 0))
+                  for e in sorted(set(aciertos) | set(fallos)) if aciertos.get(e, 0) + fallos.get(e, 0)},
+        "semaforo": semaforo,
+    }
+
+def regresiones(resultados, referencia, tolerancia):
+    avisos = []
+    for clave, r in resultados.items():
+        base = referencia.get(clave)
+        if not base: continue
+        for campo in ("gemini", "amadeus", "en_serie"):
+            if r[campo] > base[campo] + 1e-9: avisos.append(f"{clave}: {campo} {base[campo]:g} -> {r[campo]:g}")
+        if r["p50"] > base["p50"] * (1 + tolerancia) + 0.05: avisos.append(f"{clave}: p50 {base['p50']:.2f}s -> {r['p50']:.2f}s")
+    return avisos
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del motor de planificación con Gemini y Amadeus simulados.")
+    parser.add_argument("-n", "--repeticiones", type=int, default=5)
+    parser.add_argument("-e", "--escenarios", help="Lista separada por comas (por defecto, todos)")
+    parser.add_argument("--escala", type=float, default=0.1, help="Multiplica todas las latencias simuladas (1 = tiempos reales)")
+    parser.add_argument("--gemini-ms", type=float, default=600, help="Latencia hasta el primer token")
+    parser.add_argument("--amadeus-ms", type=float, default=1200)
+    parser.add_argument("--prob-429", type=float, default=0.0, help="Probabilidad de 429 en cada llamada a Gemini")
+    parser.add_argument("--prob-429-amadeus", type=float, default=0.0)
+    parser.add_argument("--rpm-gemini", type=int, help="Cuota del servidor simulado: 429 a partir de N llamadas por minuto")
+    parser.add_argument("--rpm", type=int, default=100000, help="GEMINI_RPM del limitador local (por defecto, sin freno)")
+    parser.add_argument("--sesiones", type=int, default=1, help="Planes idénticos a la vez en cada repetición")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--json", help="Guarda los resultados para usarlos luego como --referencia")
+    parser.add_argument("--referencia", help="Resultados anteriores con los que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Cuánto puede empeorar la mediana (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    # Antes de importar el motor: la caché y el limitador leen el entorno al crearse
+    directorio = tempfile.mkdtemp(prefix="travelgenius-bench-")
+    os.environ["TRAVELGENIUS_CACHE"] = os.path.join(directorio, "cache.sqlite3")
+    os.environ["GEMINI_RPM"] = str(args.rpm)
+    os.environ.pop("GEMINI_MODEL", None)
+    registro = simulados.Registro()
+    gemini = simulados.GeminiFalso(registro, latencia=args.gemini_ms / 1000 * args.escala, por_token=0.004 * args.escala,
+                                   prob_429=args.prob_429, rpm=args.rpm_gemini, reintento=max(0.1, args.escala), semilla=args.semilla)
+    amadeus = simulados.AmadeusFalso(registro, latencia=args.amadeus_ms / 1000 * args.escala,
+                                     prob_429=args.prob_429_amadeus, semilla=args.semilla)
+    simulados.instalar(gemini, amadeus)
+
+    import geo
+    import motor
+    from aeropuertos import obtener_indice
+    from cache_disco import obtener_cache
+    obtener_indice(), geo.obtener_nomenclator() # Se cargan una vez por proceso: fuera de la medida
+    cache = obtener_cache()
+
+    todos = escenarios()
+    elegidos = args.escenarios.split(",") if args.escenarios else list(todos)
+    resultados = {}
+    print(f"{'escenario':<18} {'pasada':<8} {'p50':>7} {'p90':>7} {'p99':>7} {'gemini':>7} {'amadeus':>8} {'429':>4} {'serie':>6}  caché")
+    for nombre in elegidos:
+        for pasada in ("frio", "caliente"):
+            r = medir(motor, cache, registro, todos[nombre], args.repeticiones, frio=pasada == "frio", sesiones=args.sesiones)
+            resultados[f"{nombre}/{pasada}"] = r
+            cache_txt = " ".join(f"{e} {v:.0%}" for e, v in r["cache"].items())
+            cache_txt += "  semáforo " + (" ".join(f"{f} {n}" for f, n in sorted(r["semaforo"].items())) or "-")
+            print(f"{nombre:<18} {pasada:<8} {r['p50']:>6.2f}s {r['p90']:>6.2f}s {r['p99']:>6.2f}s {r['gemini']:>7.1f} {r['amadeus']:>8.1f} "
+                  f"{r['429']:>4} {r['en_serie']:>6}  {cache_txt}" + (f"  ⚠️ {r['errores']} errores" if r["errores"] else ""))
+    print(f"\nLatencias simuladas x{args.escala:g}. list_models: {gemini.listados} llamada(s) en todo el proceso.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(resultados, f, indent=2)
+    if args.referencia:
+        with open(args.referencia, encoding="utf-8") as f: avisos = regresiones(resultados, json.load(f), args.tolerancia)
+        for a in avisos: print(f"⚠️ {a}")
+        if avisos: return 1
+        print("✅ Sin regresiones respecto a la referencia.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""Dobles locales de Gemini y Amadeus para medir el motor sin red.
+
+instalar() deja en sys.modules un `google.generativeai` y un `amadeus` de mentira con la
+misma forma que usa motor.py (GenerativeModel.generate_content con y sin stream,
+list_models, Client.shopping.flight_offers_search.get). Los dos tardan lo que se les
+diga, pueden devolver 429 al azar o al pasarse de una cuota por minuto, y anotan cada
+llamada (inicio, fin, resultado) para contarlas después.
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+import types
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+Llamada = namedtuple("Llamada", "servicio inicio fin estado")
+
+
+class Registro:
+    """Llamadas de los dos servicios, compartidas por todos los hilos."""
+
+    def __init__(self):
+        self.llamadas = []
+        self._cerrojo = threading.Lock()
+
+    def anotar(self, servicio, inicio, estado):
+        with self._cerrojo: self.llamadas.append(Llamada(servicio, inicio, time.perf_counter(), estado))
+
+    def desde(self, marca):
+        """Llamadas hechas a partir de la posición `marca` (len(registro.llamadas) antes de empezar)."""
+        with self._cerrojo: return self.llamadas[marca:]
+
+
+def en_serie(llamadas):
+    """Cuántas llamadas hubo que esperar una detrás de otra: el máximo de intervalos que no se
+    solapan. Un prompt nuevo que no va en paralelo con nada lo sube en uno."""
+    cuenta, fin = 0, float("-inf")
+    for ll in sorted(llamadas, key=lambda ll: ll.fin):
+        if ll.inicio >= fin: cuenta, fin = cuenta + 1, ll.fin
+    return cuenta
+
+
+class Servicio:
+    """Latencia, fallos inyectados y cuota por minuto comunes a los dos dobles."""
+
+    def __init__(self, nombre, registro, latencia, prob_429=0.0, rpm=None, reintento=1.0, semilla=0):
+        self.nombre, self.registro, self.latencia = nombre, registro, latencia
+        self.prob_429, self.rpm, self.reintento = prob_429, rpm, reintento
+        self._azar = random.Random(f"{nombre}-{semilla}")
+        self._ventana = [] # instantes de las llamadas aceptadas en el último minuto
+        self._cerrojo = threading.Lock()
+
+    def entrar(self):
+        """Decide si la llamada pasa; si no, la anota y lanza el 429 que daría la API."""
+        inicio = time.perf_counter()
+        with self._cerrojo:
+            self._ventana = [t for t in self._ventana if t > inicio - 60]
+            if self.rpm is not None and len(self._ventana) >= self.rpm:
+                motivo = f"retry_delay {{ seconds: {max(1, int(self._ventana[0] + 60 - inicio) + 1)} }}"
+            elif self._azar.random() < self.prob_429:
+                motivo = f"retry_delay {{ seconds: {self.reintento:g} }}"
+            else:
+                self._ventana.append(inicio)
+                return inicio, self._azar.uniform(0.8, 1.2)
+        time.sleep(self.latencia * 0.1) # Un 429 también tarda algo en llegar
+        self.registro.anotar(self.nombre, inicio, 429)
+        raise Cuota429(f"429 Resource has been exhausted (e.g. check quota). {motivo}")
+
+
+class Cuota429(Exception):
+    pass
+
+
+# --- GEMINI ---
+class Respuesta:
+    def __init__(self, texto): self.text = texto
+
+
+def coordenadas_falsas(lugar):
+    return [40 + zlib.crc32(lugar.encode()) % 1000 / 100, -3 + zlib.crc32(lugar.encode()) % 700 / 100]
+
+def respuesta_arranque(prompt):
+    """El JSON del prompt de arranque, con solo las claves que pide."""
+    datos = {}
+    for linea in prompt.splitlines():
+        clave = re.match(r'- "(\w+)"', linea)
+        if not clave: continue
+        lista = re.findall(r"'([^']+)'", linea.rsplit(":", 1)[-1])
+        if clave.group(1) == "iatas": datos["iatas"] = {l: (re.sub(r"[^A-Za-z]", "", l).upper() + "XXX")[:3] for l in lista}
+        elif clave.group(1) == "coordenadas": datos["coordenadas"] = {l: coordenadas_falsas(l) for l in lista}
+        elif clave.group(1) == "transporte": datos["transporte"] = {"vuelos": True, "explicacion": "Son más de 600 km: lo razonable es volar."}
+        elif clave.group(1) == "precios": datos["precios"] = {"chollo": 70, "caro": 190}
+    return "```json\n" + json.dumps(datos, ensure_ascii=False) + "\n```"
+
+def respuesta_gemini(prompt, palabras):
+    """Algo con la forma que espera cada llamada del motor."""
+    if "objeto JSON con estas claves" in prompt: return respuesta_arranque(prompt)
+    lista = re.findall(r"'([^']+)'", prompt.split(":", 1)[-1])
+    if "código IATA" in prompt: return json.dumps({l: (re.sub(r"[^A-Za-z]", "", l).upper() + "XXX")[:3] for l in lista})
+    if "coordenadas" in prompt: return json.dumps({l: coordenadas_falsas(l) for l in lista})
+
+    if "VUELOS_NO" in prompt: return "VUELOS_SI. Hay más de 600 km y lo razonable es volar."
+    if "Chollo" in prompt: return "🟡 Normal: precio en la media para esa ruta y mes."
+    if "array JSON" in prompt: return json.dumps(["Documentación", "Cargador", "Adaptador", "Botiquín", "Chubasquero", "Gafas de sol",
+                                                  "Crema solar", "Calzado cómodo", "Power bank", "Mochila pequeña"], ensure_ascii=False)
+    if "puntos imperdibles" in prompt:
+        return json.dumps([{"nombre": f"Punto {i}", "lat": 41.9 + i / 100, "lon": 12.5 + i / 100, "tipo": "monumento"} for i in range(15)])
+    parrafo = "Lorem ipsum dolor sit amet, itinerario con paradas, horarios y consejos prácticos. "
+    return "### Plan\n" + " ".join(parrafo.split() * (palabras // len(parrafo.split()) + 1))[: palabras * 6]
+
+
+class ModeloFalso:
+    def __init__(self, gemini, nombre):
+        self.gemini, self.model_name = gemini, nombre
+
+    def generate_content(self, prompt, stream=False, **_):
+        servicio = self.gemini.servicio
+        inicio, ruido = servicio.entrar()
+        texto = respuesta_gemini(prompt, self.gemini.palabras)
+        por_token = self.gemini.por_token * ruido
+        time.sleep(servicio.latencia * ruido) # Hasta el primer token
+        if not stream:
+            time.sleep(por_token * len(texto) / 4)
+            servicio.registro.anotar(servicio.nombre, inicio, 200)
+            return Respuesta(texto)
+
+        def trozos():
+            for i in range(0, len(texto), 80):
+                time.sleep(por_token * 20)
+                yield Respuesta(texto[i:i + 80])
+            servicio.registro.anotar(servicio.nombre, inicio, 200)
+        return trozos()
+
+
+class GeminiFalso:
+    def __init__(self, registro, latencia=0.6, por_token=0.004, palabras=500, **servicio):
+        self.servicio = Servicio("gemini", registro, latencia, **servicio)
+        self.por_token, self.palabras = por_token, palabras
+        self.listados = 0
+
+    def modulo(self):
+        genai = types.ModuleType("google.generativeai")
+        genai.configure = lambda **_: None
+        genai.GenerativeModel = lambda nombre, **_: ModeloFalso(self, nombre)
+
+        def list_models():
+            self.listados += 1
+            return [types.SimpleNamespace(name="models/gemini-falso", supported_generation_methods=["generateContent"])]
+        genai.list_models = list_models
+        return genai
+
+
+# --- AMADEUS ---
+AEROLINEAS = {"IB": "IBERIA", "VY": "VUELING AIRLINES", "UX": "AIR EUROPA", "FR": "RYANAIR", "AF": "AIR FRANCE",
+              "KL": "KLM", "LH": "LUFTHANSA", "AZ": "ITA AIRWAYS", "TP": "TAP PORTUGAL", "U2": "EASYJET"}
+ESCALAS = ("MAD", "BCN", "CDG", "AMS", "FRA", "LIS", "FCO")
+
+
+def ofertas_amadeus(params, cuantas):
+    """Ofertas deterministas para la misma búsqueda, con la forma de flight_offers_search."""
+    azar = random.Random(zlib.crc32(json.dumps(params, sort_keys=True).encode()))
+    origen, destino = params["originLocationCode"], params["destinationLocationCode"]
+    pasajeros = params["adults"] + params.get("children", 0) + params.get("infants", 0)
+    base = azar.uniform(40, 220)
+
+    def itinerario(de, a, dia):
+        salida = datetime.fromisoformat(dia) + timedelta(hours=azar.randint(5, 22), minutes=azar.choice((0, 15, 30, 45)))
+        aerolinea = azar.choice(list(AEROLINEAS))
+        escala = azar.choice([e for e in ESCALAS if e not in (de, a)]) if azar.random() < 0.4 else None
+        saltos = [(de, escala), (escala, a)] if escala else [(de, a)]
+        segmentos, hora = [], salida
+        for i, (o, d) in enumerate(saltos):
+            llegada = hora + timedelta(minutes=azar.randint(60, 180))
+            segmentos.append({"departure": {"iataCode": o, "at": hora.isoformat(timespec="seconds")},
+                              "arrival": {"iataCode": d, "at": llegada.isoformat(timespec="seconds")},
+                              "carrierCode": aerolinea, "number": str(azar.randint(100, 9999)), "numberOfStops": 0, "id": str(i + 1)})
+            hora = llegada + timedelta(minutes=azar.randint(50, 240))
+        return aerolinea, {"duration": "PT0H", "segments": segmentos}
+
+    ofertas = []
+    for i in range(cuantas):
+        aerolinea, ida = itinerario(origen, destino, params["departureDate"])
+        itinerarios = [ida] + ([itinerario(destino, origen, params["returnDate"])[1]] if params.get("returnDate") else [])
+        total = base * azar.uniform(0.7, 2.5) * pasajeros * (1.8 if params.get("returnDate") else 1)
+        maletas = 0 if aerolinea in ("FR", "VY", "U2") else azar.choice((0, 1))
+        ofertas.append({"type": "flight-offer", "id": str(i + 1), "source": "GDS", "itineraries": itinerarios,
+                        "price": {"currency": "EUR", "total": f"{total:.2f}", "base": f"{total * 0.8:.2f}"},
+                        "validatingAirlineCodes": [aerolinea],
+                        "travelerPricings": [{"travelerId": "1", "fareOption": "STANDARD",
+                                              "fareDetailsBySegment": [{"segmentId": "1", "cabin": "ECONOMY", "includedCheckedBags": {"quantity": maletas}}]}]})
+    return {"meta": {"count": len(ofertas)}, "data": ofertas, "dictionaries": {"carriers": AEROLINEAS}}
+
+
+class BusquedaFalsa:
+    def __init__(self, amadeus): self.amadeus = amadeus
+
+    def get(self, **params):
+        servicio = self.amadeus.servicio
+        inicio, ruido = servicio.entrar()
+        resultado = ofertas_amadeus(params, min(params.get("max", 250), self.amadeus.ofertas))
+        time.sleep(servicio.latencia * ruido)
+        servicio.registro.anotar(servicio.nombre, inicio, 200)
+        return types.SimpleNamespace(result=resultado, data=resultado["data"])
+
+
+class AmadeusFalso:
+    def __init__(self, registro, latencia=1.2, ofertas=60, **servicio):
+        self.servicio = Servicio("amadeus", registro, latencia, **servicio)
+        self.ofertas = ofertas
+
+    def modulo(self):
+        amadeus = types.ModuleType("amadeus")
+        amadeus.Client = lambda **_: types.SimpleNamespace(shopping=types.SimpleNamespace(flight_offers_search=BusquedaFalsa(self)))
+        return amadeus
+
+
+def instalar(gemini, amadeus):
+    """Sustituye los SDK antes de que motor.py los importe (lo hace la primera vez que los usa)."""
+    try: import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = sys.modules["google.generativeai"] = gemini.modulo()
+    sys.modules["amadeus"] = amadeus.modulo()
@@ -0,0 +1,214 @@
+"""Caché persistente en SQLite para las respuestas de Gemini y Amadeus.
+
+A diferencia de st.cache_data, sobrevive a reinicios y despliegues y la comparten todos los
+procesos (y réplicas con el mismo volumen) que apunten al mismo fichero. Cada espacio de
+nombres tiene su propio TTL y el conjunto se poda por LRU cuando supera el número de
+entradas o el tamaño configurados.
+
+Además, dentro de un proceso, las llamadas idénticas que llegan mientras otra está en
+curso no salen a la API: esperan su resultado (o su excepción) en vez de repetirla.
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from metricas import contar
+
+RUTA_CACHE = os.getenv("TRAVELGENIUS_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "travelgenius.sqlite3"))
+
+# Segundos de vida por espacio de nombres
+TTL_ESPACIOS = {"gemini": 7 * 86400, "iata": 30 * 86400, "geo": 30 * 86400, "amadeus": 3600, "modelos": 86400}
+TTL_DEFECTO = 86400
+# Lo más que espera una llamada a otra idéntica que ya está en curso
+ESPERA_AGRUPADA = float(os.getenv("TRAVELGENIUS_ESPERA_AGRUPADA", "300"))
+
+def normalizar_texto(texto):
+    return " ".join(texto.split())
+
+def clave_cache(*partes):
+    """Huella estable de los argumentos: los textos se comparan sin espacios sobrantes."""
+    def limpiar(x):
+        if isinstance(x, str): return normalizar_texto(x)
+        if isinstance(x, (list, tuple)): return [limpiar(y) for y in x]
+        if isinstance(x, dict): return {str(k): limpiar(v) for k, v in sorted(x.items())}
+        return x
+    serial = json.dumps(limpiar(list(partes)), sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(serial.encode("utf-8")).hexdigest()
+
+
+class CacheDisco:
+    def __init__(self, ruta=RUTA_CACHE, max_entradas=20000, max_bytes=256 * 1024 * 1024):
+        if ruta != ":memory:": os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self.ruta, self.max_entradas, self.max_bytes = ruta, max_entradas, max_bytes
+        self.pid = os.getpid() # Una conexión SQLite no sirve tras un fork
+        self.aciertos, self.fallos = Counter(), Counter()
+        self._cerrojo = threading.Lock()
+        self._escrituras = 0
+        self._con = sqlite3.connect(ruta, timeout=30, check_same_thread=False, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute("""CREATE TABLE IF NOT EXISTS cache (
+            espacio TEXT NOT NULL, clave TEXT NOT NULL, valor TEXT NOT NULL,
+            expira REAL NOT NULL, usado REAL NOT NULL, bytes INTEGER NOT NULL,
+            PRIMARY KEY (espacio, clave))""")
+        self._con.execute("CREATE INDEX IF NOT EXISTS cache_usado ON cache (usado)")
+
+    def obtener(self, espacio, clave, anotar=True):
+        """Devuelve (True, valor) si hay una entrada viva y (False, None) si no. Con anotar=False no cuenta en las estadísticas."""
+        ahora = time.time()
+        with self._cerrojo:
+            fila = self._con.execute("SELECT valor, expira, usado FROM cache WHERE espacio=? AND clave=?", (espacio, clave)).fetchone()
+            if not fila or fila[1] < ahora:
+                if anotar:
+                    self.fallos[espacio] += 1
+                    contar("cache", espacio=espacio, resultado="fallo")
+                return False, None
+            if anotar:
+                self.aciertos[espacio] += 1
+                contar("cache", espacio=espacio, resultado="acierto")
+            if ahora - fila[2] > 60: # Solo se reescribe la marca LRU si ha envejecido algo
+                self._con.execute("UPDATE cache SET usado=? WHERE espacio=? AND clave=?", (ahora, espacio, clave))
+        return True, json.loads(fila[0])
+
+    def guardar(self, espacio, clave, valor, ttl=None):
+        ttl = TTL_ESPACIOS.get(espacio, TTL_DEFECTO) if ttl is None else ttl
+        serial = json.dumps(valor, ensure_ascii=False)
+        ahora = time.time()
+        with self._cerrojo:
+            self._con.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                              (espacio, clave, serial, ahora + ttl, ahora, len(serial.encode("utf-8"))))
+            self._escrituras += 1
+            if self._escrituras % 50 == 1: self._podar(ahora)
+
+    def _podar(self, ahora):
+        self._con.execute("DELETE FROM cache WHERE expira < ?", (ahora,))
+        entradas, total = self._con.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM cache").fetchone()
+        if entradas > self.max_entradas:
+            self._con.execute("DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY usado LIMIT ?)", (entradas - self.max_entradas,))
+        while total > self.max_bytes:
+            # Se libera por tandas del 10% más antiguo hasta caber en el presupuesto
+            self._con.execute("DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY usado LIMIT ?)", (max(1, entradas // 10),))
+            entradas, total = self._con.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM cache").fetchone()
+
+    def estadisticas(self):
+        """{espacio: {aciertos, fallos, entradas, bytes}} de este proceso y del fichero."""
+        with self._cerrojo:
+            filas = self._con.execute("SELECT espacio, COUNT(*), SUM(bytes) FROM cache GROUP BY espacio").fetchall()
+        tamaños = {e: (n, b) for e, n, b in filas}
+        espacios = set(tamaños) | set(self.aciertos) | set(self.fallos)
+        return {e: {"aciertos": self.aciertos[e], "fallos": self.fallos[e],
+                    "entradas": tamaños.get(e, (0, 0))[0], "bytes": tamaños.get(e, (0, 0))[1]} for e in sorted(espacios)}
+
+    def limpiar(self, espacio=None):
+        with self._cerrojo:
+            if espacio: self._con.execute("DELETE FROM cache WHERE espacio=?", (espacio,))
+            else: self._con.execute("DELETE FROM cache")
+
+
+class Abandonada(Exception):
+    """La llamada que iba primero se cortó sin resultado (p. ej. un streaming interrumpido por un rerun)."""
+
+
+class EnCurso:
+    """Una sola ejecución a la vez por clave: quien llega primero la hace y el resto espera su Future."""
+
+    def __init__(self):
+        self._futuros = {}
+        self._cerrojo = threading.Lock()
+
+    def reclamar(self, clave):
+        """(futuro, True) si le toca ejecutar a quien llama; (futuro de la que ya está en curso, False) si no."""
+        with self._cerrojo:
+            if clave in self._futuros: return self._futuros[clave], False
+            futuro = self._futuros[clave] = Future()
+            return futuro, True
+
+    def en_marcha(self, clave):
+        """Futuro de la llamada con esa clave que está en curso, o None (sin reclamarla)."""
+        with self._cerrojo: return self._futuros.get(clave)
+
+    def resolver(self, clave, futuro, resultado=None, error=None):
+        with self._cerrojo: self._futuros.pop(clave, None)
+        if error is None: futuro.set_result(resultado)
+        else: futuro.set_exception(error)
+
+    def esperar(self, futuro, espera=ESPERA_AGRUPADA):
+        try: return futuro.result(espera)
+        except TimeoutError: raise TimeoutError(f"Sin respuesta de la llamada idéntica en curso tras {espera:g}s") from None
+
+    def ejecutar(self, clave, funcion, espera=ESPERA_AGRUPADA):
+        """Resultado de funcion(), compartido con todas las llamadas con la misma clave que lleguen mientras tanto.
+        Las excepciones (y el TimeoutError de quien se cansa de esperar) llegan a cada una de ellas. Lo que no
+        es Exception (el RerunException o StopException de Streamlit, un KeyboardInterrupt) solo lo recibe
+        quien iba primero: el resto recibe Abandonada y vuelve a intentarlo por su cuenta."""
+        while True:
+            futuro, primero = self.reclamar(clave)
+            if not primero:
+                contar("agrupadas", espacio=clave[0])
+                try: return self.esperar(futuro, espera)
+                except Abandonada: continue # Se vuelve a intentar, ahora quizá como primera
+            try: resultado = funcion()
+            except Exception as e:
+                self.resolver(clave, futuro, error=e)
+                raise
+            except BaseException as e:
+                self.resolver(clave, futuro, error=Abandonada(repr(e)))
+                raise
+            self.resolver(clave, futuro, resultado)
+            return resultado
+
+
+en_curso = EnCurso()
+_cache = None
+_cerrojo = threading.Lock()
+
+def obtener_cache():
+    """Caché única por proceso (se reabre tras un fork: las conexiones SQLite no se heredan)."""
+    global _cache
+    with _cerrojo:
+        if _cache is None or _cache.pid != os.getpid():
+            _cache = CacheDisco()
+        return _cache
+
+def cacheado(espacio, ttl=None, guardar_si=lambda valor: valor is not None, si_no_llega=None):
+    """Decorador: memoriza en disco el resultado según los argumentos (los que empiezan por '_' no cuentan).
+    Los fallos de caché simultáneos con los mismos argumentos se agrupan en una sola llamada. Si quien
+    espera a otra idéntica se cansa (TimeoutError), devuelve si_no_llega(error) en vez de lanzarlo."""
+    def decorador(funcion):
+        def clave(*args, **kwargs):
+            return clave_cache(funcion.__name__, args, {k: v for k, v in kwargs.items() if not k.startswith("_")})
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            cache, k = obtener_cache(), clave(*args, **kwargs)
+            hay, valor = cache.obtener(espacio, k)
+            if hay: return valor
+            def calcular():
+                hay, valor = cache.obtener(espacio, k, anotar=False) # La anterior puede haber terminado justo ahora
+                if hay: return valor
+                valor = funcion(*args, **kwargs)
+                if guardar_si(valor): cache.guardar(espacio, k, valor, ttl)
+                return valor
+            try: return en_curso.ejecutar((espacio, k), calcular)
+            except TimeoutError as e:
+                if si_no_llega is None: raise
+                return si_no_llega(e)
+        def guardado(*args, **kwargs):
+            """(True, valor) si ya está en disco o lo trae una llamada idéntica en curso; (False, None) si no. Nunca calcula."""
+            cache, k = obtener_cache(), clave(*args, **kwargs)
+            hay, valor = cache.obtener(espacio, k, anotar=False)
+            if hay: return True, valor
+            futuro = en_curso.en_marcha((espacio, k))
+            if futuro is None: return False, None
+            try: valor = en_curso.esperar(futuro)
+            except Exception: return False, None # Abandonada, fallida o demasiado lenta: quien pregunta sigue por su camino
+            return (True, valor) if guardar_si(valor) else (False, None)
+        # Para quien necesite leer o rellenar la misma entrada por otro camino (p. ej. en streaming)
+        envoltura.espacio, envoltura.clave, envoltura.guardado = espacio, clave, guardado
+        return envoltura
+    return decorador
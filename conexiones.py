@@ -0,0 +1,68 @@
+"""Conexiones HTTPS reutilizables para el cliente de Amadeus.
+
+El SDK hace cada llamada con urllib.request.urlopen, que abre una conexión nueva (TLS
+incluido) por petición. Acepta cualquier `http` compatible con urlopen: este guarda las
+conexiones keep-alive libres por host, compartidas por todo el proceso, así que ni las
+búsquedas en paralelo ni las de hilos que se crean y se tiran (cada calendario, cada
+anticipo) repiten el saludo.
+"""
+import http.client
+import threading
+import urllib.parse
+from urllib.error import URLError
+
+MAX_LIBRES = 8 # Conexiones ociosas que se guardan por host
+
+_libres = {}
+_cerrojo = threading.Lock()
+
+
+class RespuestaPool:
+    """Lo que el parser del SDK lee de http.client.HTTPResponse, con el cuerpo ya consumido
+    para poder devolver la conexión al pool al momento."""
+
+    def __init__(self, respuesta):
+        self.status = self.code = respuesta.status
+        self.reason = respuesta.reason
+        self.headers = respuesta.msg
+        self._cuerpo = respuesta.read()
+
+    def getcode(self): return self.status
+    def info(self): return self.headers
+    def getheaders(self): return list(self.headers.items())
+    def read(self): return self._cuerpo
+
+
+def _conexion(esquema, host, timeout, nueva=False):
+    """Una conexión libre de ese host (la última devuelta, la más probable de seguir viva) o una nueva."""
+    with _cerrojo:
+        libres = _libres.get((esquema, host))
+        if libres and not nueva: return libres.pop()
+    clase = http.client.HTTPSConnection if esquema == "https" else http.client.HTTPConnection
+    return clase(host, timeout=timeout)
+
+def _devolver(esquema, host, con):
+    with _cerrojo:
+        libres = _libres.setdefault((esquema, host), [])
+        if len(libres) < MAX_LIBRES:
+            libres.append(con)
+            return
+    con.close()
+
+def abrir_con_pool(peticion, timeout=30):
+    """Sustituto de urlopen para `Client(http=...)`."""
+    url = urllib.parse.urlsplit(peticion.full_url)
+    ruta = url.path + (f"?{url.query}" if url.query else "")
+    for intento in range(2):
+        con = _conexion(url.scheme, url.netloc, timeout, nueva=intento > 0)
+        try:
+            con.request(peticion.get_method(), ruta, body=peticion.data, headers=dict(peticion.header_items()))
+            respuesta = RespuestaPool(con.getresponse())
+        except (http.client.HTTPException, OSError) as e:
+            # El servidor puede haber cerrado una conexión ociosa: se abre otra y se reintenta una vez
+            con.close()
+            if intento: raise URLError(e)
+            continue
+        if respuesta.headers.get("Connection", "").lower() == "close": con.close()
+        else: _devolver(url.scheme, url.netloc, con)
+        return respuesta
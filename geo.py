@@ -0,0 +1,199 @@
+"""Geocodificación offline con el nomenclátor de datos/ciudades.tsv.
+
+Las coordenadas viven en arrays de NumPy y los nombres (normalizados igual que en
+aeropuertos.py) apuntan a sus filas. Para las consultas de "lo más cercano a" hay un árbol
+k-d sobre vectores unitarios en 3D: la distancia en línea recta entre dos de ellos crece con
+la de círculo máximo, así que no hay que preocuparse del antimeridiano ni de los polos.
+
+TRAVELGENIUS_NOMENCLATOR puede apuntar a un volcado de GeoNames (cities15000.txt y
+similares) para cubrir más lugares que el fichero incluido.
+"""
+import csv
+import heapq
+import math
+import os
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from aeropuertos import normalizar, obtener_indice
+
+RUTA_DATOS = os.getenv("TRAVELGENIUS_NOMENCLATOR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "ciudades.tsv"))
+RADIO_TIERRA = 6371.0088 # km
+FACTOR_CARRETERA = 1.25 # Lo que se alarga de media la carretera respecto a la línea recta
+UMBRAL_VUELO_KM = 600   # En línea recta, como lo cuenta el diagnóstico: por encima, el salto se plantea en avión
+
+Lugar = namedtuple("Lugar", "nombre pais lat lon poblacion")
+Tramo = namedtuple("Tramo", "origen destino km km_carretera volar")
+
+def a_vectores(lat, lon):
+    """Grados -> vectores unitarios (n, 3)."""
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def cuerda_a_km(cuerda):
+    return 2 * RADIO_TIERRA * math.asin(min(1.0, cuerda / 2))
+
+def distancia_km(a, b):
+    """Distancia de círculo máximo (haversine) entre dos puntos (lat, lon)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA * math.asin(min(1.0, math.sqrt(h)))
+
+def tramos_ruta(paradas, puntos, umbral=UMBRAL_VUELO_KM, factor=FACTOR_CARRETERA):
+    """Clasifica cada salto entre paradas consecutivas. `puntos` es {parada: (lat, lon) o None};
+    los tramos con algún extremo sin coordenadas quedan con km y volar a None. El umbral se
+    compara con la distancia en línea recta; la de carretera es solo una estimación para los textos."""
+    resultado = []
+    for origen, destino in zip(paradas, paradas[1:]):
+        if not (puntos.get(origen) and puntos.get(destino)):
+            resultado.append(Tramo(origen, destino, None, None, None))
+            continue
+        km = distancia_km(puntos[origen], puntos[destino])
+        resultado.append(Tramo(origen, destino, km, km * factor, km > umbral))
+    return resultado
+
+
+class ArbolKD:
+    """Árbol k-d implícito: cada tramo [ini, fin) de `orden` se parte por la mediana del eje de
+    más recorrido, que queda en el centro del tramo. Los tramos pequeños se recorren enteros."""
+    HOJA = 8
+
+    def __init__(self, puntos):
+        self.puntos = np.asarray(puntos, dtype=np.float64)
+        self.orden = np.arange(len(self.puntos))
+        self.ejes = np.zeros(len(self.puntos), dtype=np.int8)
+        pila = [(0, len(self.puntos))]
+        while pila:
+            ini, fin = pila.pop()
+            if fin - ini <= self.HOJA: continue
+            tramo = self.puntos[self.orden[ini:fin]]
+            eje = int(np.argmax(tramo.max(axis=0) - tramo.min(axis=0)))
+            medio = (fin - ini) // 2
+            self.orden[ini:fin] = self.orden[ini:fin][np.argpartition(tramo[:, eje], medio)]
+            self.ejes[ini + medio] = eje
+            pila += [(ini, ini + medio), (ini + medio + 1, fin)]
+
+    def cercanos(self, punto, k=1):
+        """[(distancia, índice)] de los k puntos más próximos a `punto`, de menor a mayor."""
+        punto = np.asarray(punto, dtype=np.float64)
+        mejores = [] # montículo de (-d², índice) con los k mejores hasta ahora
+
+        def anotar(d2, i):
+            if len(mejores) < k: heapq.heappush(mejores, (-d2, i))
+            elif d2 < -mejores[0][0]: heapq.heapreplace(mejores, (-d2, i))
+
+        def visitar(ini, fin):
+            if fin - ini <= self.HOJA:
+                indices = self.orden[ini:fin]
+                for d2, i in zip(((self.puntos[indices] - punto) ** 2).sum(axis=1), indices): anotar(float(d2), int(i))
+                return
+            medio = ini + (fin - ini) // 2
+            i, eje = int(self.orden[medio]), self.ejes[medio]
+            anotar(float(((self.puntos[i] - punto) ** 2).sum()), i)
+            delta = punto[eje] - self.puntos[i, eje]
+            cerca, lejos = ((ini, medio), (medio + 1, fin)) if delta < 0 else ((medio + 1, fin), (ini, medio))
+            visitar(*cerca)
+            # Solo se baja por el otro lado si el plano de corte está más cerca que el peor de los k
+            if len(mejores) < k or delta * delta < -mejores[0][0]: visitar(*lejos)
+
+        visitar(0, len(self.puntos))
+        return sorted((math.sqrt(-d2), i) for d2, i in mejores)
+
+
+class Nomenclator:
+    def __init__(self, nombres, paises, lat, lon, poblacion, alias=()):
+        self.nombres = list(nombres)
+        self.paises = np.array(paises, dtype="U2")
+        self.lat, self.lon = np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64)
+        self.poblacion = np.array(poblacion, dtype=np.int64)
+        self._exacto = {} # nombre normalizado -> [índices]: nombres propios antes que alias y, entre ellos, más habitantes antes
+        for nombres_grupo in (((n,) for n in self.nombres), alias):
+            for i, varios in enumerate(nombres_grupo):
+                for n in filter(None, map(normalizar, varios)):
+                    destinos = self._exacto.setdefault(n, [])
+                    if i not in destinos: destinos.append(i)
+        for n, destinos in self._exacto.items():
+            propios = [i for i in destinos if normalizar(self.nombres[i]) == n]
+            resto = [i for i in destinos if i not in propios]
+            self._exacto[n] = sorted(propios, key=lambda i: -self.poblacion[i]) + sorted(resto, key=lambda i: -self.poblacion[i])
+        self._arbol = ArbolKD(a_vectores(self.lat, self.lon))
+
+    @classmethod
+    def desde_tsv(cls, ruta=RUTA_DATOS):
+        """Lee el fichero incluido (con cabecera) o un volcado de GeoNames (sin cabecera, 19 columnas)."""
+        with open(ruta, encoding="utf-8", newline="") as f:
+            filas = list(csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE))
+        if filas and filas[0][:2] == ["nombre", "alternativos"]:
+            filas = [(r[0], r[1], r[2], r[3], r[4], r[5]) for r in filas[1:]]
+        else:
+            filas = [(r[1], r[3], r[4], r[5], r[8], r[14] or 0) for r in filas if len(r) >= 15]
+        nombres, alias, lat, lon, paises, poblacion = zip(*filas) if filas else [()] * 6
+        return cls(nombres, paises, [float(x) for x in lat], [float(x) for x in lon], [int(x) for x in poblacion],
+                   [a.split(",") for a in alias])
+
+    def lugar(self, i):
+        return Lugar(self.nombres[i], str(self.paises[i]), float(self.lat[i]), float(self.lon[i]), int(self.poblacion[i]))
+
+    def buscar(self, texto):
+        """Lugar más poblado que se llama `texto` ('Ronda', 'Donostia', 'Mérida, México'...) o None."""
+        n = normalizar(texto)
+        if not n: return None
+        if n in self._exacto: return self.lugar(self._exacto[n][0])
+        partes = re.match(r"^(.*?)\s*[,(]\s*([^)]*)\)?\s*$", texto or "")
+        if partes:
+            candidatos = self._exacto.get(normalizar(partes.group(1)), [])
+            calificador = normalizar(partes.group(2))
+            if len(calificador) == 2: # Código de país: 'Valencia, VE'
+                candidatos = [i for i in candidatos if self.paises[i].lower() == calificador] or candidatos
+            elif candidatos:
+                # El índice de aeropuertos sí sabe de países: vale el homónimo que quede cerca del suyo
+                a = obtener_indice().buscar(texto)
+                if a:
+                    i, km = self.cercanos(a.lat, a.lon, 1, entre=candidatos)[0]
+                    candidatos = [i] if km < 300 else []
+            if candidatos: return self.lugar(candidatos[0])
+        for parte in re.split(r"\s*[-/]\s*", texto): # 'Donostia-San Sebastián', 'Bruselas / Brujas'
+            if normalizar(parte) in self._exacto: return self.lugar(self._exacto[normalizar(parte)][0])
+        return None
+
+    def cercanos(self, lat, lon, k=1, entre=None):
+        """[(índice, km)] de los k lugares más próximos al punto (o de los de `entre`, si se da)."""
+        punto = a_vectores(lat, lon)
+        if entre is not None:
+            distancias = np.linalg.norm(a_vectores(self.lat[entre], self.lon[entre]) - punto, axis=1)
+            return [(entre[j], cuerda_a_km(distancias[j])) for j in np.argsort(distancias)[:k]]
+        return [(int(i), cuerda_a_km(d)) for d, i in self._arbol.cercanos(punto, k)]
+
+
+_nomenclator = None
+_arbol_aeropuertos = None
+_cerrojo = threading.Lock()
+
+def obtener_nomenclator():
+    global _nomenclator
+    with _cerrojo:
+        if _nomenclator is None: _nomenclator = Nomenclator.desde_tsv()
+        return _nomenclator
+
+def geocodificar(lugares):
+    """Todas las paradas de una pasada: {lugar: (lat, lon) o None}. Lo que no esté en el
+    nomenclátor se intenta con el índice de aeropuertos, que perdona erratas."""
+    nomenclator, aeropuertos = obtener_nomenclator(), obtener_indice()
+    resultado = {}
+    for l in lugares:
+        sitio = nomenclator.buscar(l) or aeropuertos.buscar(l)
+        resultado[l] = (sitio.lat, sitio.lon) if sitio else None
+    return resultado
+
+def aeropuerto_cercano(lat, lon, max_km=250):
+    """Aeropuerto de datos/aeropuertos.csv más cercano al punto, o None si está más lejos de max_km."""
+    global _arbol_aeropuertos
+    indice = obtener_indice()
+    with _cerrojo:
+        if _arbol_aeropuertos is None:
+            _arbol_aeropuertos = ArbolKD(a_vectores([a.lat for a in indice.aeropuertos], [a.lon for a in indice.aeropuertos]))
+    d, i = _arbol_aeropuertos.cercanos(a_vectores(lat, lon))[0]
+    return indice.aeropuertos[i] if cuerda_a_km(d) <= max_km else None
@@ -0,0 +1,140 @@
+"""Histórico local de precios de vuelo para el semáforo.
+
+Cada búsqueda que hace el usuario (no las del anticipo, el calendario o los tramos) deja su
+precio por pasajero más barato, sin filtros de horario ni escalas, en un boceto de cuantiles
+por ruta, mes y tipo (ida y vuelta o solo ida). Se anota después de juzgarla, así que una
+búsqueda nunca cuenta en su propia comparación. El boceto es un
+histograma de cubetas logarítmicas (al estilo de DDSketch): cada cubeta cubre un ±1% de
+precio, así que el error relativo de cualquier percentil está acotado y el tamaño no
+depende de cuántos precios se hayan visto (unas decenas de cubetas por ruta). Vive en una
+tabla del mismo SQLite que la caché, compartida por todos los procesos.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+
+from cache_disco import RUTA_CACHE
+
+ERROR_RELATIVO = 0.01
+MAX_CUBETAS = 512
+# Búsquedas de la misma ruta y mes que hacen falta para fiarse del percentil
+MIN_BUSQUEDAS = max(1, int(os.getenv("TRAVELGENIUS_HISTORIAL_MIN", "5")))
+CHOLLO, CARO = 0.25, 0.75 # Percentiles que separan 🟢 / 🟡 / 🔴
+
+
+class Boceto:
+    """Histograma de cubetas logarítmicas: la cubeta i cubre (gamma^(i-1), gamma^i]."""
+    GAMMA = (1 + ERROR_RELATIVO) / (1 - ERROR_RELATIVO)
+
+    def __init__(self, cubetas=None, busquedas=0, ultima=None):
+        self.cubetas = {int(i): n for i, n in (cubetas or {}).items()}
+        self.busquedas = busquedas
+        self.ultima = ultima # Huella de la última búsqueda anotada, para no contar dos veces la misma
+
+    def indice(self, valor):
+        return math.ceil(math.log(max(valor, 1e-9), self.GAMMA))
+
+    def añadir(self, valor, n=1):
+        i = self.indice(valor)
+        self.cubetas[i] = self.cubetas.get(i, 0) + n
+        while len(self.cubetas) > MAX_CUBETAS: # Se pierde resolución por abajo, nunca memoria
+            a, b = sorted(self.cubetas)[:2]
+            self.cubetas[b] += self.cubetas.pop(a)
+
+    @property
+    def total(self):
+        return sum(self.cubetas.values())
+
+    def rango(self, valor):
+        """Fracción de lo visto que es más barato que `valor` (0 = el más barato de todos)."""
+        i, total = self.indice(valor), self.total
+        if not total: return None
+        debajo = sum(n for j, n in self.cubetas.items() if j < i)
+        return (debajo + self.cubetas.get(i, 0) / 2) / total
+
+    def cuantil(self, q):
+        """Valor aproximado del percentil q (centro de su cubeta)."""
+        objetivo, acumulado = q * self.total, 0
+        for i in sorted(self.cubetas):
+            acumulado += self.cubetas[i]
+            if acumulado >= objetivo: return 2 * self.GAMMA ** i / (self.GAMMA + 1)
+        return None
+
+    def serial(self):
+        return json.dumps({"c": self.cubetas, "b": self.busquedas, "u": self.ultima}, separators=(",", ":"))
+
+    @classmethod
+    def desde_serial(cls, texto):
+        datos = json.loads(texto)
+        return cls(datos["c"], datos["b"], datos.get("u"))
+
+
+class HistorialPrecios:
+    def __init__(self, ruta=RUTA_CACHE):
+        if ruta != ":memory:": os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self.pid = os.getpid() # Una conexión SQLite no sirve tras un fork
+        self._cerrojo = threading.Lock()
+        self._con = sqlite3.connect(ruta, timeout=30, check_same_thread=False, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("""CREATE TABLE IF NOT EXISTS precios (
+            origen TEXT NOT NULL, destino TEXT NOT NULL, mes INTEGER NOT NULL, tipo TEXT NOT NULL, boceto TEXT NOT NULL,
+            PRIMARY KEY (origen, destino, mes, tipo))""")
+
+    def registrar(self, origen, destino, mes, tipo, precio_pax, huella=None):
+        """Suma una búsqueda (su precio por pasajero más barato) al boceto de la ruta. Si `huella`
+        es la de la última anotada (el mismo usuario pulsando otra vez), no se cuenta de nuevo."""
+        with self._cerrojo:
+            self._con.execute("BEGIN IMMEDIATE") # Leer y reescribir sin pisar a otro proceso
+            try:
+                boceto = self._boceto(origen, destino, mes, tipo) or Boceto()
+                if huella is not None and huella == boceto.ultima:
+                    self._con.execute("COMMIT")
+                    return
+                boceto.añadir(precio_pax)
+                boceto.busquedas += 1
+                boceto.ultima = huella
+                self._con.execute("INSERT OR REPLACE INTO precios VALUES (?, ?, ?, ?, ?)", (origen, destino, mes, tipo, boceto.serial()))
+                self._con.execute("COMMIT")
+            except BaseException:
+                self._con.execute("ROLLBACK")
+                raise
+
+    def _boceto(self, origen, destino, mes, tipo):
+        fila = self._con.execute("SELECT boceto FROM precios WHERE origen=? AND destino=? AND mes=? AND tipo=?", (origen, destino, mes, tipo)).fetchone()
+        return Boceto.desde_serial(fila[0]) if fila else None
+
+    def boceto(self, origen, destino, mes, tipo="ida_vuelta"):
+        with self._cerrojo: return self._boceto(origen, destino, mes, tipo)
+
+    def suficiente(self, origen, destino, mes, tipo="ida_vuelta"):
+        b = self.boceto(origen, destino, mes, tipo)
+        return bool(b and b.busquedas >= MIN_BUSQUEDAS)
+
+
+_historial = None
+_cerrojo = threading.Lock()
+
+def obtener_historial():
+    """Histórico único por proceso (se reabre tras un fork, como la caché)."""
+    global _historial
+    with _cerrojo:
+        if _historial is None or _historial.pid != os.getpid():
+            _historial = HistorialPrecios()
+        return _historial
+
+def registrar_busqueda(origen, destino, f_ida, f_vta, pasajeros, precio_pax):
+    """Anota la búsqueda del usuario: `precio_pax` es lo más barato por pasajero, sin filtrar."""
+    huella = f"{f_ida}|{f_vta}|{','.join(map(str, pasajeros))}|{precio_pax:.2f}"
+    obtener_historial().registrar(origen, destino, f_ida.month, "ida_vuelta" if f_vta else "ida", precio_pax, huella)
+
+def semaforo_historico(origen, destino, mes, precio_pax, tipo="ida_vuelta"):
+    """(emoji y texto, percentil) comparando con lo visto para la ruta y el mes, o None si hay poco histórico."""
+    b = obtener_historial().boceto(origen, destino, mes, tipo)
+    if not b or b.busquedas < MIN_BUSQUEDAS: return None
+    rango = b.rango(precio_pax)
+    contexto = f"de {b.busquedas} búsquedas de {origen} a {destino} en este mes (mediana {b.cuantil(0.5):.0f}€/pax)"
+    if rango <= CHOLLO: return f"🟢 Chollo: {precio_pax:.0f}€/pax, más barato que el {100 - rango * 100:.0f}% {contexto}.", rango
+    if rango >= CARO: return f"🔴 Caro: {precio_pax:.0f}€/pax, más caro que el {rango * 100:.0f}% {contexto}.", rango
+    return f"🟡 Normal: {precio_pax:.0f}€/pax, percentil {rango * 100:.0f} {contexto}.", rango
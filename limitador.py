@@ -0,0 +1,109 @@
+"""Limitador de cuota compartido por todo el proceso para las llamadas a Gemini.
+
+Streamlit vuelve a ejecutar viaje.py en cada interacción, pero los módulos importados
+viven mientras viva el proceso: el cubo de tokens de aquí lo comparten todas las sesiones.
+"""
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+# Prioridades de la cola (menor = antes)
+INTERACTIVA, FONDO = 0, 1
+
+
+class LimitadorTokens:
+    """Doble cubo de tokens (peticiones/min y tokens/min) con cola de espera por prioridades.
+
+    Los turnos se conceden por orden de (prioridad, llegada), así que una llamada interactiva
+    adelanta a cualquier trabajo de fondo que esté esperando, pero nunca a otra interactiva.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm, self.tpm = max(1, rpm), max(1, tpm)
+        self._peticiones, self._tokens = float(self.rpm), float(self.tpm)
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._cola = []
+        self._orden = itertools.count()
+        self._cond = threading.Condition()
+
+    def _rellenar(self, ahora):
+        transcurrido, self._ultimo = ahora - self._ultimo, ahora
+        self._peticiones = min(self.rpm, self._peticiones + transcurrido * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + transcurrido * self.tpm / 60)
+
+    def adquirir(self, tokens=1, prioridad=INTERACTIVA, timeout=None):
+        """Bloquea hasta que haya cupo para una petición de `tokens` tokens. Devuelve False si vence el timeout."""
+        tokens = min(max(1, tokens), self.tpm)
+        turno = (prioridad, next(self._orden))
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            heapq.heappush(self._cola, turno)
+            try:
+                while True:
+                    ahora = time.monotonic()
+                    self._rellenar(ahora)
+                    espera = None
+                    if self._cola[0] == turno:
+                        espera = max(self._pausa_hasta - ahora,
+                                     (1 - self._peticiones) * 60 / self.rpm,
+                                     (tokens - self._tokens) * 60 / self.tpm)
+                        if espera <= 0:
+                            self._peticiones -= 1
+                            self._tokens -= tokens
+                            return True
+                    if limite is not None:
+                        if limite <= ahora: return False
+                        espera = min(espera or limite - ahora, limite - ahora)
+                    self._cond.wait(espera)
+            finally:
+                self._cola.remove(turno)
+                heapq.heapify(self._cola)
+                self._cond.notify_all()
+
+    def pausar(self, segundos):
+        """Congela el cubo para todos (p. ej. tras un 429) en vez de que cada sesión reintente por su cuenta."""
+        with self._cond:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+            self._cond.notify_all()
+
+
+_limitador = None
+_cerrojo = threading.Lock()
+
+def obtener_limitador():
+    """Limitador único del proceso, dimensionado con GEMINI_RPM / GEMINI_TPM (capa gratuita por defecto)."""
+    global _limitador
+    with _cerrojo:
+        if _limitador is None:
+            _limitador = LimitadorTokens(int(os.getenv("GEMINI_RPM", "15")), int(os.getenv("GEMINI_TPM", "1000000")))
+        return _limitador
+
+def estimar_tokens(texto):
+    return len(texto) // 4 + 1 # ~4 caracteres por token, suficiente para repartir cupo
+
+def es_error_cuota(error):
+    texto = f"{type(error).__name__} {error}".lower()
+    return "429" in texto or "quota" in texto or "resourceexhausted" in texto or "resource exhausted" in texto
+
+_PISTAS = [re.compile(p, re.IGNORECASE) for p in (r'retry_delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)',
+                                                  r'retry in\s*(\d+(?:\.\d+)?)\s*s',
+                                                  r'retry-after:?\s*(\d+(?:\.\d+)?)')]
+
+def pista_reintento(error):
+    """Segundos de espera que sugiere la propia API en el error, si los trae."""
+    if error is None: return None
+    for patron in _PISTAS:
+        m = patron.search(str(error))
+        if m: return float(m.group(1))
+    return None
+
+def espera_reintento(intento, error=None, base=2.0, maximo=60.0):
+    """Backoff exponencial con jitter completo; si la API indica cuánto esperar, se respeta esa pista."""
+    pista = pista_reintento(error)
+    if pista is not None: return min(maximo, pista) + random.uniform(0, 1)
+    return random.uniform(base / 2, min(maximo, base * 2 ** intento))
@@ -0,0 +1,77 @@
+"""Planifica viajes por lotes, sin navegador.
+
+    python lote.py peticiones.jsonl [-o planes.jsonl] [-p 4] [--secciones vuelos,guia]
+
+Cada línea de entrada es un JSON con la petición (ver motor.Peticion.desde_dict), por ejemplo
+{"id": "bio-roma", "origen": "Bilbao", "destino": "Roma", "mes": 11, "dias": 4, "modo": "puente"}.
+Cada plan sale como una línea JSON en cuanto está listo (no en el orden de entrada) con el
+mismo "id". Los procesos comparten la caché en disco, y la cuota de Gemini (GEMINI_RPM y
+GEMINI_TPM) se reparte entre ellos para no pasarse entre todos (por eso nunca hay más
+procesos que peticiones por minuto). Con --metricas, los contadores y tiempos de todos los
+procesos se suman en un fichero de texto de Prometheus.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import metricas
+
+
+def _iniciar_trabajador(rpm, tpm):
+    # Antes de que el limitador del proceso exista: cada trabajador se queda con su parte
+    os.environ["GEMINI_RPM"], os.environ["GEMINI_TPM"] = str(rpm), str(tpm)
+
+def _planificar(linea, secciones):
+    """(plan, lo que ha medido el trabajador desde la última petición)."""
+    import motor
+    ident = None
+    try: # Una línea mal escrita sale como error suyo, sin tumbar el lote
+        datos = json.loads(linea)
+        if not isinstance(datos, dict): raise ValueError("Cada línea tiene que ser un objeto JSON")
+        ident = datos.pop("id", None)
+        plan = {"id": ident, **motor.planificar(motor.Peticion.desde_dict(datos), secciones)}
+    except Exception as e:
+        plan = {"id": ident, "error": f"{type(e).__name__}: {e}"}
+    return plan, metricas.registro.instantanea(reiniciar=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Planifica viajes por lotes a partir de un JSONL.")
+    parser.add_argument("entrada", help="JSONL con una petición por línea ('-' para la entrada estándar)")
+    parser.add_argument("-o", "--salida", help="JSONL de salida (por defecto, la salida estándar)")
+    parser.add_argument("-p", "--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--secciones", default="vuelos,guia", help="Qué calcular además del diagnóstico: vuelos, guia")
+    parser.add_argument("--metricas", help="Fichero donde dejar las métricas de Prometheus al terminar")
+    args = parser.parse_args(argv)
+    load_dotenv()
+
+    entrada = sys.stdin if args.entrada == "-" else open(args.entrada, encoding="utf-8")
+    with entrada:
+        lineas = [l for l in entrada if l.strip()]
+    rpm_total, tpm_total = int(os.getenv("GEMINI_RPM", "15")), int(os.getenv("GEMINI_TPM", "1000000"))
+    # Nunca más procesos que peticiones por minuto: cada uno necesita al menos 1 y la suma no puede pasarse
+    procesos = max(1, min(args.procesos, len(lineas) or 1, rpm_total, tpm_total))
+    rpm, tpm = max(1, rpm_total // procesos), max(1, tpm_total // procesos)
+    secciones = tuple(s.strip() for s in args.secciones.split(",") if s.strip())
+
+    salida = open(args.salida, "w", encoding="utf-8") if args.salida else sys.stdout
+    errores = 0
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador, initargs=(rpm, tpm)) as pool:
+        futuros = [pool.submit(_planificar, l, secciones) for l in lineas]
+        for futuro in as_completed(futuros):
+            plan, medidas = futuro.result()
+            metricas.registro.sumar(medidas)
+            errores += "error" in plan
+            salida.write(json.dumps(plan, ensure_ascii=False, default=str) + "\n")
+            salida.flush()
+    if salida is not sys.stdout: salida.close()
+    if args.metricas: metricas.volcar(args.metricas)
+
+    print(f"{len(lineas)} peticiones, {errores} con error", file=sys.stderr)
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
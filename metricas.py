@@ -0,0 +1,203 @@
+"""Tiempos por etapa, contadores y exportación para saber en qué se va un "Planificar".
+
+    with medir("semaforo"): ...            # histograma travelgenius_duracion_segundos{etapa="semaforo"}
+    contar("reintentos", servicio="gemini") # contador travelgenius_reintentos_total{servicio="gemini"}
+
+Todo vive en un registro único por proceso. Se exporta en formato de texto de Prometheus
+por HTTP (TRAVELGENIUS_METRICAS_PUERTO, solo en 127.0.0.1 salvo que TRAVELGENIUS_METRICAS_HOST
+diga otra interfaz) o a un fichero con volcar(), y cada etapa puede además salir como una
+línea JSON por el logger "travelgenius.metricas".
+
+Lo que se puede encender y apagar en caliente, sin tocar código:
+- "log": una línea JSON por etapa terminada (de inicio, TRAVELGENIUS_METRICAS_LOG=1).
+- "perfil": cProfile en las etapas marcadas con perfilar=True, con las funciones más caras
+  al log (de inicio, TRAVELGENIUS_PERFIL=1).
+Se cambian con configurar(), con POST /config?log=1&perfil=0 en el puerto de métricas (GET
+/config solo las consulta) o, el perfil, con la señal SIGUSR1.
+"""
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PREFIJO = "travelgenius"
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+log = logging.getLogger("travelgenius.metricas")
+config = {"log": os.getenv("TRAVELGENIUS_METRICAS_LOG") == "1", "perfil": os.getenv("TRAVELGENIUS_PERFIL") == "1"}
+
+
+def escapar_etiqueta(valor):
+    """Valor de etiqueta en el formato de texto de Prometheus: \\, " y saltos de línea escapados."""
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registro:
+    """Contadores e histogramas indexados por (nombre, etiquetas ordenadas)."""
+
+    def __init__(self):
+        self.contadores, self.histogramas = {}, {}
+        self._cerrojo = threading.Lock()
+
+    def contar(self, nombre, n=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._cerrojo: self.contadores[clave] = self.contadores.get(clave, 0) + n
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._cerrojo:
+            h = self.histogramas.setdefault(clave, [0, 0.0, [0] * len(CUBETAS)])
+            h[0] += 1
+            h[1] += valor
+            for i, limite in enumerate(CUBETAS):
+                if valor <= limite: h[2][i] += 1
+
+    def instantanea(self, reiniciar=False):
+        """Copia serializable (para mandarla entre procesos y sumarla con sumar())."""
+        with self._cerrojo:
+            copia = {"contadores": dict(self.contadores),
+                     "histogramas": {k: [h[0], h[1], list(h[2])] for k, h in self.histogramas.items()}}
+            if reiniciar: self.contadores, self.histogramas = {}, {}
+        return copia
+
+    def sumar(self, instantanea):
+        with self._cerrojo:
+            for clave, n in instantanea["contadores"].items(): self.contadores[clave] = self.contadores.get(clave, 0) + n
+            for clave, (cuenta, suma, cubetas) in instantanea["histogramas"].items():
+                h = self.histogramas.setdefault(clave, [0, 0.0, [0] * len(CUBETAS)])
+                h[0], h[1], h[2] = h[0] + cuenta, h[1] + suma, [a + b for a, b in zip(h[2], cubetas)]
+
+    def prometheus(self):
+        """Formato de texto de Prometheus (versión 0.0.4)."""
+        datos = self.instantanea()
+        lineas = []
+        etiquetas = lambda pares, extra=(): "{" + ",".join(f'{k}="{escapar_etiqueta(v)}"' for k, v in (*pares, *extra)) + "}" if pares or extra else ""
+        for nombre in sorted({n for n, _ in datos["contadores"]}):
+            lineas.append(f"# TYPE {PREFIJO}_{nombre}_total counter")
+            lineas += [f"{PREFIJO}_{nombre}_total{etiquetas(e)} {v:g}" for (n, e), v in sorted(datos["contadores"].items()) if n == nombre]
+        for nombre in sorted({n for n, _ in datos["histogramas"]}):
+            lineas.append(f"# TYPE {PREFIJO}_{nombre} histogram")
+            for (n, e), (cuenta, suma, cubetas) in sorted(datos["histogramas"].items()):
+                if n != nombre: continue
+                lineas += [f"{PREFIJO}_{nombre}_bucket{etiquetas(e, [('le', f'{l:g}')])} {c}" for l, c in zip(CUBETAS, cubetas)]
+                lineas += [f"{PREFIJO}_{nombre}_bucket{etiquetas(e, [('le', '+Inf')])} {cuenta}",
+                           f"{PREFIJO}_{nombre}_sum{etiquetas(e)} {suma:.6f}", f"{PREFIJO}_{nombre}_count{etiquetas(e)} {cuenta}"]
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+contar, observar = registro.contar, registro.observar
+_perfilando = threading.Lock() # cProfile admite un solo perfil activo a la vez
+
+@contextlib.contextmanager
+def medir(etapa, perfilar=False, **etiquetas):
+    """Mide el bloque en travelgenius_duracion_segundos{etapa=...}. Si sale por excepción se
+    anota con error="NombreExcepción" y la excepción sigue su camino."""
+    perfil = cProfile.Profile() if perfilar and config["perfil"] and _perfilando.acquire(blocking=False) else None
+    error = None
+    if perfil: perfil.enable()
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        segundos = time.perf_counter() - t0
+        if perfil:
+            perfil.disable()
+            _perfilando.release()
+            _volcar_perfil(etapa, perfil)
+        observar("duracion_segundos", segundos, etapa=etapa, **etiquetas, **({"error": error} if error else {}))
+        if config["log"]:
+            log.info(json.dumps({"ts": round(time.time(), 3), "etapa": etapa, "ms": round(segundos * 1000, 1), **etiquetas,
+                                 **({"error": error} if error else {})}, ensure_ascii=False, default=str))
+
+def medido(etapa, **etiquetas):
+    """medir() como decorador."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(etapa, **etiquetas): return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+def _volcar_perfil(etapa, perfil):
+    salida = io.StringIO()
+    pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(15)
+    log.warning("Perfil de '%s' (solo el hilo que la abre):\n%s", etapa, salida.getvalue())
+
+def configurar(**cambios):
+    """Enciende o apaga 'log' y 'perfil' en caliente."""
+    for clave, valor in cambios.items():
+        if clave not in config: raise KeyError(clave)
+        config[clave] = bool(valor)
+    if config["log"]:
+        log.setLevel(logging.INFO)
+        if not log.handlers and not logging.getLogger().handlers: log.addHandler(logging.StreamHandler())
+    return dict(config)
+
+def volcar(ruta):
+    """Escribe el texto de Prometheus de forma atómica (para el textfile collector de node_exporter)."""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f: f.write(registro.prometheus())
+    os.replace(temporal, ruta)
+
+
+configurar() # Aplica lo que venga del entorno
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/config": return self._responder(json.dumps(config), "application/json")
+        if url.path == "/metrics": return self._responder(registro.prometheus(), "text/plain; version=0.0.4")
+        self.send_error(404)
+
+    def do_POST(self):
+        """Cambia la configuración: las opciones en la query o en un cuerpo application/x-www-form-urlencoded."""
+        url = urlsplit(self.path)
+        if url.path != "/config": return self.send_error(404)
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        opciones = {**parse_qs(url.query), **parse_qs(cuerpo)}
+        try: estado = configurar(**{k: v[-1] in ("1", "true", "si") for k, v in opciones.items()})
+        except KeyError as e: return self.send_error(400, f"Opción desconocida: {e}")
+        self._responder(json.dumps(estado), "application/json")
+
+    def _responder(self, cuerpo, tipo):
+        datos = cuerpo.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args): pass # Sin una línea por cada scrape
+
+
+_servidor = None
+_cerrojo = threading.Lock()
+
+def servir(puerto=None, host=None):
+    """Arranca (una vez por proceso) /metrics y /config en TRAVELGENIUS_METRICAS_PUERTO. Sin puerto, no hace nada.
+    Escucha en TRAVELGENIUS_METRICAS_HOST, por defecto solo en local: /config cambia el proceso y no pide credenciales.
+    En el hilo principal también deja SIGUSR1 para alternar el perfil."""
+    global _servidor
+    puerto = puerto or os.getenv("TRAVELGENIUS_METRICAS_PUERTO")
+    host = host or os.getenv("TRAVELGENIUS_METRICAS_HOST", "127.0.0.1")
+    with _cerrojo:
+        if _servidor is not None or not puerto: return _servidor
+        _servidor = ThreadingHTTPServer((host, int(puerto)), _Manejador)
+        threading.Thread(target=_servidor.serve_forever, name="metricas", daemon=True).start()
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda *_: configurar(perfil=not config["perfil"]))
+        return _servidor
@@ -0,0 +1,713 @@
+"""Motor de planificación sin Streamlit.
+
+Todo lo que decide el viaje (fechas, aeropuertos, diagnóstico de transporte, vuelos y
+prompts de la guía) vive aquí para que lo usen igual la interfaz (viaje.py) y el modo por
+lotes (lote.py). Los clientes de Amadeus y Gemini se crean la primera vez que hacen falta.
+"""
+import calendar
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from aeropuertos import MAX_KM_DIFUSO, obtener_indice, resolver_iatas
+from cache_disco import Abandonada, cacheado, en_curso, obtener_cache
+from conexiones import abrir_con_pool
+from geo import aeropuerto_cercano, distancia_km, geocodificar, obtener_nomenclator, tramos_ruta
+from historial import obtener_historial, registrar_busqueda, semaforo_historico
+from limitador import FONDO, INTERACTIVA, es_error_cuota, espera_reintento, estimar_tokens, obtener_limitador
+from metricas import contar, medido, medir
+from vuelos import TablaOfertas, filtrar_ofertas
+
+BLOQUES_HORARIOS = {
+    "Cualquier hora": (0, 24), "Mañana (06:00 - 12:00)": (6, 12),
+    "Mediodía (12:00 - 15:00)": (12, 15), "Tarde (15:00 - 21:00)": (15, 21),
+    "Noche (21:00 - 06:00)": (21, 6)
+}
+MESES_FULL = [(1,"Enero"), (2,"Febrero"), (3,"Marzo"), (4,"Abril"), (5,"Mayo"), (6,"Junio"),
+              (7,"Julio"), (8,"Agosto"), (9,"Septiembre"), (10,"Octubre"), (11,"Noviembre"), (12,"Diciembre")]
+CIUDAD, ROADTRIP = "🏙️ Ciudad Única", "🚗 Roadtrip / Ruta"
+COCHE = "🚗 Coche Propio / Alquiler"
+
+# Peticiones simultáneas a Gemini como máximo (1 = modo serie de siempre)
+IA_CONCURRENCIA = max(1, int(os.getenv("GEMINI_CONCURRENCIA", "3")))
+# Búsquedas simultáneas a Amadeus en el calendario de precios
+AMADEUS_CONCURRENCIA = max(1, int(os.getenv("AMADEUS_CONCURRENCIA", "4")))
+# Ofertas por fecha del calendario: solo hace falta la más barata, y cada respuesta completa ocupa ~1 MB en disco
+OFERTAS_CALENDARIO = 10
+# Un solo prompt JSON para todo lo que la IA tenga que completar antes de los vuelos (0 = un prompt por dato, como antes)
+ARRANQUE = os.getenv("TRAVELGENIUS_ARRANQUE", "1") == "1"
+
+# Quién se entera de las esperas por cuota: la interfaz lo cambia por st.warning
+avisar = logging.getLogger(__name__).warning
+
+# --- SERVICIOS ---
+MODELO_RESERVA = "gemini-1.5-flash"
+REINTENTO_MODELO = 300 # Segundos que se usa el de reserva antes de volver a buscar uno
+_amadeus = _modelo = None
+_modelo_caduca = 0.0
+_cerrojo = threading.Lock()
+
+def obtener_amadeus():
+    """Cliente único del proceso. Si falla se lanza la excepción y la siguiente llamada reintenta."""
+    global _amadeus
+    with _cerrojo:
+        if _amadeus is None:
+            from amadeus import Client
+            _amadeus = Client(client_id=os.getenv("AMADEUS_KEY"), client_secret=os.getenv("AMADEUS_SECRET"), http=abrir_con_pool)
+        return _amadeus
+
+def obtener_modelo():
+    """Modelo único del proceso. Si no se pudo descubrir ninguno, el de reserva solo vale REINTENTO_MODELO segundos.
+    El descubrimiento (list_models, por red) va fuera del cerrojo para no bloquear a Amadeus mientras tanto;
+    si varios hilos llegan a la vez, descubrir_modelo los agrupa en una sola llamada."""
+    global _modelo, _modelo_caduca
+    with _cerrojo:
+        if _modelo is not None and time.monotonic() <= _modelo_caduca: return _modelo
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_KEY"))
+    nombre = os.getenv("GEMINI_MODEL") or descubrir_modelo()
+    modelo = genai.GenerativeModel(nombre or MODELO_RESERVA)
+    with _cerrojo:
+        if _modelo is None or time.monotonic() > _modelo_caduca: # Otro hilo puede haberlo publicado mientras tanto
+            _modelo, _modelo_caduca = modelo, float("inf") if nombre else time.monotonic() + REINTENTO_MODELO
+        return _modelo
+
+@cacheado("modelos")
+def descubrir_modelo():
+    """Primer modelo con generateContent, guardado en disco un día. GEMINI_MODEL se lo salta."""
+    import google.generativeai as genai
+    try: return next((m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods), None)
+    except Exception: return None # Sin guardar: se vuelve a preguntar en el próximo arranque
+
+# --- IA ---
+def respuesta_valida(texto):
+    return isinstance(texto, str) and not texto.startswith(("❌", "⚠️")) # Los errores no se guardan en disco
+
+def anotar_fallo_ia(e, intento):
+    """Cuenta el error y, si es de cuota, devuelve los segundos que hay que frenar (None si no se reintenta)."""
+    if not es_error_cuota(e):
+        contar("errores", servicio="gemini")
+        return None
+    contar("errores_cuota", servicio="gemini")
+    if intento < 2: contar("reintentos", servicio="gemini")
+    return espera_reintento(intento, e)
+
+def anotar_tokens(prompt_texto, texto, uso=None):
+    """Tamaños de prompt y respuesta: los de la API si los trae, si no la estimación del limitador."""
+    contar("tokens", getattr(uso, "prompt_token_count", None) or estimar_tokens(prompt_texto), servicio="gemini", tipo="prompt")
+    contar("tokens", getattr(uso, "candidates_token_count", None) or estimar_tokens(texto), servicio="gemini", tipo="respuesta")
+
+@cacheado("gemini", guardar_si=respuesta_valida, si_no_llega=lambda e: f"❌ Error: {str(e)}")
+def preguntar_ia_seguro(prompt_texto, _prioridad=INTERACTIVA):
+    try: model = obtener_modelo()
+    except Exception: return "⚠️ IA no disponible."
+    cuota = obtener_limitador() # Cubo de tokens compartido por todas las sesiones del proceso
+    for i in range(3):
+        with medir("espera_cuota", servicio="gemini"): cuota.adquirir(estimar_tokens(prompt_texto), _prioridad)
+        contar("llamadas", servicio="gemini")
+        try:
+            with medir("llamada", servicio="gemini"): respuesta = model.generate_content(prompt_texto)
+            anotar_tokens(prompt_texto, respuesta.text, getattr(respuesta, "usage_metadata", None))
+            return respuesta.text
+        except Exception as e:
+            espera = anotar_fallo_ia(e, i)
+            if espera is not None:
+                cuota.pausar(espera) # Frena a todo el proceso, no solo a esta sesión
+                avisar(f"⏳ Google respirando para no saturarse. Reintentando en {espera:.0f}s... ({i+1}/3)")
+                continue
+            return f"❌ Error: {str(e)}"
+    return "❌ Límite alcanzado. Cuota de IA agotada."
+
+def preguntar_ia_stream(prompt_texto, _prioridad=INTERACTIVA):
+    """Como preguntar_ia_seguro, pero va soltando los trozos según los genera Gemini. El texto completo acaba en la misma entrada de caché.
+    Si el mismo prompt ya está en curso (en streaming o no) se espera a esa respuesta y llega de una vez."""
+    cache, clave = obtener_cache(), preguntar_ia_seguro.clave(prompt_texto)
+    hay, texto = cache.obtener(preguntar_ia_seguro.espacio, clave)
+    if hay:
+        yield texto
+        return
+    while True:
+        futuro, primero = en_curso.reclamar((preguntar_ia_seguro.espacio, clave))
+        if primero: break
+        contar("agrupadas", espacio=preguntar_ia_seguro.espacio)
+        try:
+            yield en_curso.esperar(futuro)
+            return
+        except Abandonada: continue
+        except TimeoutError as e:
+            yield f"❌ Error: {str(e)}"
+            return
+    partes = []
+    try:
+        hay, texto = cache.obtener(preguntar_ia_seguro.espacio, clave, anotar=False) # La anterior puede haber terminado justo ahora
+        for trozo in [texto] if hay else _stream_gemini(prompt_texto, _prioridad, cache, clave):
+            partes.append(trozo)
+            yield trozo
+    except BaseException as e:
+        # Quien esperaba este texto lo pide por su cuenta: no hay respuesta completa que darle
+        en_curso.resolver((preguntar_ia_seguro.espacio, clave), futuro, error=Abandonada(repr(e)))
+        raise
+    en_curso.resolver((preguntar_ia_seguro.espacio, clave), futuro, "".join(partes)) # Los errores también se comparten
+
+def _stream_gemini(prompt_texto, _prioridad, cache, clave):
+    try: model = obtener_modelo()
+    except Exception:
+        yield "⚠️ IA no disponible."
+        return
+    cuota = obtener_limitador()
+    for i in range(3):
+        with medir("espera_cuota", servicio="gemini"): cuota.adquirir(estimar_tokens(prompt_texto), _prioridad)
+        contar("llamadas", servicio="gemini")
+        partes = []
+        try:
+            with medir("llamada", servicio="gemini", stream=True):
+                for trozo in model.generate_content(prompt_texto, stream=True):
+                    partes.append(trozo.text)
+                    yield trozo.text
+            anotar_tokens(prompt_texto, "".join(partes))
+            cache.guardar(preguntar_ia_seguro.espacio, clave, "".join(partes))
+            return
+        except Exception as e:
+            espera = anotar_fallo_ia(e, i)
+            if not partes and espera is not None: # A mitad de respuesta ya no se puede reintentar sin repetir texto
+                cuota.pausar(espera)
+                avisar(f"⏳ Google respirando para no saturarse. Reintentando en {espera:.0f}s... ({i+1}/3)")
+                continue
+            prefijo = "\n\n" if partes else ""
+            yield f"{prefijo}❌ Error: {str(e)}"
+            return
+    yield "❌ Límite alcanzado. Cuota de IA agotada."
+
+def preguntar_ia_paralelo(prompts, en_vivo=(), inicializar_hilo=None):
+    """Lanza varios prompts independientes a la vez y va devolviendo (clave, texto acumulado, terminado).
+    Los de `en_vivo` llegan en streaming trozo a trozo; el resto, de una vez al terminar.
+    `inicializar_hilo` se ejecuta en cada hilo antes de empezar (la interfaz le pasa su sesión)."""
+    cola = queue.Queue()
+
+    def trabajar(clave, prompt):
+        try:
+            for trozo in (preguntar_ia_stream(prompt) if clave in en_vivo else [preguntar_ia_seguro(prompt)]): cola.put((clave, trozo))
+        except Exception as e: cola.put((clave, f"❌ Error: {str(e)}"))
+        finally: cola.put((clave, None))
+
+    # Sin `with`: si un rerun cierra el generador, no se espera a que acaben las llamadas que siguen en marcha
+    pool = ThreadPoolExecutor(max_workers=min(IA_CONCURRENCIA, len(prompts)), initializer=inicializar_hilo)
+    try:
+        for clave, p in prompts.items(): pool.submit(trabajar, clave, p)
+        textos, pendientes = dict.fromkeys(prompts, ""), len(prompts)
+        while pendientes:
+            clave, trozo = cola.get()
+            if trozo is None: pendientes -= 1
+            else: textos[clave] += trozo
+            yield clave, textos[clave], trozo is None
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def parsear_maleta(res_maleta):
+    try: return json.loads(re.search(r'\[.*\]', res_maleta, re.DOTALL).group())
+    except: return ["Documentación", "Cargador", "Botiquín", "Gafas de sol"]
+
+# --- LUGARES ---
+@medido("iatas")
+def obtener_iatas(ciudades, ia=True):
+    """Resuelve todas las paradas de una pasada, de lo más fiable a lo menos: código IATA o nombre
+    de aeropuerto exactos, el aeropuerto más cercano a un lugar que el nomenclátor conozca tal
+    cual (también si el aeropuerto homónimo queda lejos: Mérida es la de Badajoz, no la de
+    Yucatán), la búsqueda difusa para lo que no conozca ninguno de los dos y la IA al final
+    (con ia=False, esos se quedan en None salvo que la IA ya los haya resuelto antes o los esté
+    resolviendo ahora mismo para otra sesión: entonces se espera a esa llamada)."""
+    indice, nomenclator = obtener_indice(), obtener_nomenclator()
+    iatas, difusas = {}, []
+    for c in ciudades:
+        a, sitio = indice.buscar(c, difuso=False), nomenclator.buscar(c)
+        if sitio and (a is None or distancia_km((sitio.lat, sitio.lon), (a.lat, a.lon)) > MAX_KM_DIFUSO):
+            a = aeropuerto_cercano(sitio.lat, sitio.lon)
+        elif not (a or sitio): difusas.append(c)
+        iatas[c] = a.iata if a else None
+    iatas.update(resolver_iatas(difusas))
+    pendientes = tuple(c for c, iata in iatas.items() if not iata and c.strip())
+    if pendientes and ia: iatas.update(preguntar_iatas_ia(pendientes))
+    elif pendientes:
+        hay, guardado = preguntar_iatas_ia.guardado(pendientes)
+        if hay: iatas.update(guardado)
+    return iatas
+
+def alguno_resuelto(resultado):
+    """Solo se guarda en disco lo que la IA haya resuelto de verdad: si no dio nada válido se vuelve a preguntar."""
+    return isinstance(resultado, dict) and any(v is not None for v in resultado.values())
+
+def obtener_iata_dinamico(ciudad):
+    if not ciudad or not ciudad.strip(): return None
+    return obtener_iatas([ciudad])[ciudad]
+
+@cacheado("iata", guardar_si=alguno_resuelto)
+def preguntar_iatas_ia(ciudades, _prioridad=INTERACTIVA):
+    """Último recurso: un solo prompt para todos los lugares que no están en datos/aeropuertos.csv."""
+    lista = ", ".join(f"'{c}'" for c in ciudades)
+    prompt = f"Para cada lugar de esta lista dime el código IATA de 3 letras del aeropuerto comercial más cercano: {lista}. SOLO devuelve un objeto JSON con el lugar tal cual como clave y el código como valor."
+    respuesta = preguntar_ia_seguro(prompt, _prioridad=_prioridad)
+    try: codigos = json.loads(re.search(r'\{.*\}', respuesta, re.DOTALL).group())
+    except: codigos = {}
+    resultado = {}
+    for c in ciudades: # Nada de inventarse 'MAD': lo que no sea un código válido queda sin resolver
+        codigo = str(codigos.get(c, "")).strip().upper()
+        resultado[c] = codigo if re.fullmatch(r'[A-Z]{3}', codigo) else None
+    return resultado
+
+@medido("coordenadas")
+def puntos_ruta(paradas, ia=True):
+    """{parada: (lat, lon) o None}: nomenclátor local y la IA solo para las paradas que no conozca."""
+    puntos = geocodificar(paradas)
+    pendientes = tuple(p for p, punto in puntos.items() if not punto)
+    if pendientes and ia: puntos.update(preguntar_coordenadas_ia(pendientes))
+    return puntos
+
+@cacheado("geo", guardar_si=alguno_resuelto)
+def preguntar_coordenadas_ia(lugares):
+    lista = ", ".join(f"'{l}'" for l in lugares)
+    prompt = f"Dame las coordenadas de estos lugares: {lista}. SOLO devuelve un objeto JSON con el lugar tal cual como clave y [lat, lon] como valor."
+    respuesta = preguntar_ia_seguro(prompt)
+    try: coords = json.loads(re.search(r'\{.*\}', respuesta, re.DOTALL).group())
+    except: coords = {}
+    resultado = {}
+    for l in lugares:
+        try:
+            lat, lon = (float(x) for x in coords.get(l))
+            resultado[l] = [lat, lon] if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+        except (TypeError, ValueError): resultado[l] = None
+    return resultado
+
+def texto_diagnostico(tramos):
+    """Una línea por salto de la ruta con la distancia y el medio recomendado."""
+    lineas = []
+    for t in tramos:
+        if t.km is None:
+            lineas.append(f"❔ **{t.origen} ➔ {t.destino}**: no tengo coordenadas de alguno de los dos.")
+        elif t.volar:
+            km = f"{t.km:,.0f}".replace(",", ".")
+            lineas.append(f"✈️ **{t.origen} ➔ {t.destino}**: {km} km en línea recta. Mejor volar.")
+        else:
+            minutos = int(t.km_carretera / 90 * 60) # ~90 km/h de media
+            lineas.append(f"🚗 **{t.origen} ➔ {t.destino}**: {t.km:.0f} km en línea recta, unos {t.km_carretera:.0f} por carretera (~{minutos // 60}h{minutos % 60:02d}). Cómodo en coche o tren.")
+    return "  \n".join(lineas)
+
+# --- VUELOS Y FECHAS ---
+@cacheado("amadeus", si_no_llega=lambda e: None)
+def buscar_vuelos_amadeus_cache(iata_o, iata_d, f_ida, f_vta, api_adults, api_children, api_infants, maximo=250):
+    """Ida y vuelta; con f_vta=None, solo ida (los tramos de un roadtrip). Con otro `maximo`, la entrada de caché es otra."""
+    try:
+        search_params = {
+            'originLocationCode': iata_o, 'destinationLocationCode': iata_d,
+            'departureDate': str(f_ida),
+            'adults': api_adults, 'max': maximo
+        }
+        if f_vta: search_params['returnDate'] = str(f_vta)
+        if api_children > 0: search_params['children'] = api_children
+        if api_infants > 0: search_params['infants'] = api_infants
+        contar("llamadas", servicio="amadeus")
+        with medir("llamada", servicio="amadeus"):
+            resultado = obtener_amadeus().shopping.flight_offers_search.get(**search_params).result # El JSON crudo es lo que va a disco
+    except Exception as e:
+        contar("errores_cuota" if es_error_cuota(e) else "errores", servicio="amadeus")
+        return None
+    return resultado
+
+def calcular_fecha(mes, dias, tipo, semana=1, inicio=10):
+    hoy = datetime.now()
+    año = hoy.year if mes >= hoy.month else hoy.year + 1
+    u = calendar.monthrange(año, mes)[1]
+    p = datetime(año, mes, 1)
+    if tipo == "puente":
+        j = (3 - p.weekday() + 7) % 7
+        ida = p + timedelta(days=j) + timedelta(weeks=(semana - 1))
+        if dias == 3: ida += timedelta(days=1)
+    else: ida = datetime(año, mes, min(inicio, u))
+    return ida.date(), (ida + timedelta(days=dias)).date()
+
+def pares_fechas_mes(mes, dias, tipo):
+    """Todas las (ida, vuelta) válidas del mes: cada día en 'flexible', cada semana de puente en 'puente'."""
+    hoy = datetime.now()
+    año = hoy.year if mes >= hoy.month else hoy.year + 1
+    if tipo == "puente":
+        salidas = [calcular_fecha(mes, dias, "puente", semana=s)[0] for s in range(1, 6)]
+    else:
+        salidas = [datetime(año, mes, d).date() for d in range(1, calendar.monthrange(año, mes)[1] + 1)]
+    return [(ida, ida + timedelta(days=dias)) for ida in salidas if ida.month == mes and ida > hoy.date()]
+
+@medido("calendario")
+def buscar_calendario_precios(iata_o, iata_d, pares, api_adults, api_children, api_infants):
+    """Lanza en paralelo una búsqueda corta por par de fechas (cada una pasa por la caché) y devuelve {(ida, vuelta): precio mínimo}."""
+    def mas_barato(par):
+        res = buscar_vuelos_amadeus_cache(iata_o, iata_d, par[0], par[1], api_adults, api_children, api_infants, maximo=OFERTAS_CALENDARIO)
+        precios = [float(v['price']['total']) for v in (res or {}).get('data') or []]
+        return min(precios) if precios else None
+    with ThreadPoolExecutor(max_workers=AMADEUS_CONCURRENCIA) as pool:
+        return dict(zip(pares, pool.map(mas_barato, pares)))
+
+def tabla_calendario(precios):
+    """Calendario en Markdown (semanas x días) con el precio más barato de cada salida."""
+    con_precio = {par: p for par, p in precios.items() if p is not None}
+    mejor = min(con_precio, key=con_precio.get) if con_precio else None
+    semanas = {}
+    for (ida, vta), p in sorted(precios.items()):
+        celda = f"{ida.day} · {p:.0f}€" if p is not None else f"{ida.day} · —"
+        semanas.setdefault(tuple(ida.isocalendar())[:2], [""] * 7)[ida.weekday()] = f"**{celda}** 🏆" if (ida, vta) == mejor else celda
+    filas = ["| L | M | X | J | V | S | D |", "|---|---|---|---|---|---|---|"]
+    filas += ["| " + " | ".join(dias) + " |" for _, dias in sorted(semanas.items())]
+    return "\n".join(filas), mejor
+
+# --- PETICIÓN DE VIAJE ---
+_CAMPOS = ("origen destinos tipo f_ida f_vta adultos edades_ninos mascota estilo transporte vehiculo modelo_coche "
+           "estilo_conduccion pref_ida pref_vta solo_directos")
+
+class Peticion(namedtuple("Peticion", _CAMPOS, defaults=(CIUDAD, None, None, 2, (), False, "Solo/Mochilero", "Cualquiera",
+                                                        "N/A", "N/A", "N/A", "Cualquier hora", "Cualquier hora", True))):
+    """Lo que el usuario rellena en la barra lateral, con los mismos textos que las opciones de la interfaz."""
+    __slots__ = ()
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Para el modo por lotes: fechas en ISO ('ida'/'vuelta') o mes + días como en la barra lateral
+        ('modo': 'puente' con 'semana', o 'flexible' con 'inicio')."""
+        datos = dict(datos)
+        destinos = datos.pop("destinos", None) or datos.pop("destino", None)
+        if not datos.get("origen") or not destinos: raise ValueError("La petición necesita 'origen' y 'destino' o 'destinos'")
+
+        if isinstance(destinos, str): destinos = [destinos]
+
+        tipo = datos.pop("tipo", "ciudad" if len(destinos) == 1 else "roadtrip")
+        tipo = {"ciudad": CIUDAD, "roadtrip": ROADTRIP}.get(tipo, tipo)
+
+        if "ida" in datos:
+            if not datos.get("vuelta"): raise ValueError("La petición con 'ida' necesita también 'vuelta'")
+            f_ida, f_vta = date.fromisoformat(datos.pop("ida")), date.fromisoformat(datos.pop("vuelta"))
+        else:
+            if not datos.get("mes"): raise ValueError("La petición necesita 'ida' y 'vuelta' o un 'mes'")
+            modo = datos.pop("modo", "flexible")
+            f_ida, f_vta = calcular_fecha(int(datos.pop("mes")), int(datos.pop("dias", 7)), modo, semana=int(datos.pop("semana", 1)), inicio=int(datos.pop("inicio", 10)))
+        campos = {k: v for k, v in datos.items() if k in cls._fields}
+        campos["edades_ninos"] = tuple(campos.get("edades_ninos", ()))
+        return cls(destinos=tuple(destinos), tipo=tipo, f_ida=f_ida, f_vta=f_vta, **campos)
+
+    @property
+    def c_dest(self):
+        return ", ".join(self.destinos)
+
+    @property
+    def num_dias(self):
+        return (self.f_vta - self.f_ida).days
+
+    @property
+    def num_viajeros(self):
+        return self.adultos + len(self.edades_ninos)
+
+    @property
+    def grupo_texto(self):
+        texto = f"{self.adultos} adultos" + (f" y {len(self.edades_ninos)} niños" if self.edades_ninos else "")
+        return texto + (" y 1 mascota" if self.mascota else "")
+
+    @property
+    def pasajeros_api(self):
+        """(adults, children, infants) como los cuenta Amadeus."""
+        e = self.edades_ninos
+        return self.adultos + sum(1 for x in e if x >= 12), sum(1 for x in e if 2 <= x < 12), sum(1 for x in e if x < 2)
+
+    @property
+    def ciudad_1(self):
+        # 🛡️ Bloqueo Bucle Origen (Ignora origen si es el primer destino)
+        if self.tipo == ROADTRIP and len(self.destinos) > 1 and self.destinos[0].lower() == self.origen.lower(): return self.destinos[1]
+        return self.destinos[0]
+
+    @property
+    def paradas(self):
+        paradas = [self.origen] + [d for d in self.destinos if d]
+        if len(paradas) > 2 and paradas[1].lower() == self.origen.lower(): paradas.pop(1)
+        return paradas
+
+# --- PROMPTS ---
+def prompt_transporte(p):
+    """El de siempre, para cuando el primer salto no se puede medir en local."""
+    return f"""Actúa como experto en logística. Origen: '{p.origen}'. Primera parada: '{p.ciudad_1}'.
+            Analiza SOLO la viabilidad de llegar de '{p.origen}' a '{p.ciudad_1}'.
+            - Si es corto (<600km) o cómodo en coche/tren de una tirada, responde 'VUELOS_NO' y explica.
+            - Si está lejos (>600km) o país lejano, responde 'VUELOS_SI' y explica que es mejor volar.
+            Responde empezando con la palabra clave."""
+
+def prompt_explicacion(p, tramos):
+    saltos = "; ".join(f"{t.origen} ➔ {t.destino} ({t.km_carretera:.0f} km por carretera)" if t.km is not None else f"{t.origen} ➔ {t.destino}" for t in tramos)
+    return f"Actúa como experto en logística. Ruta: {saltos}. Transporte preferido: {p.transporte}. Explica en pocas líneas cómo conviene hacer cada salto (coche, tren o avión) y por qué."
+
+def prompt_semaforo(iata_o, iata_d, mes, precio_pax):
+    return f"Vuelo de {iata_o} a {iata_d} en {mes} por {precio_pax:.2f}€/pax. Responde: 🟢 Chollo, 🟡 Normal o 🔴 Caro."
+
+def prompt_arranque(p, iatas=(), lugares=(), transporte=False, precios=False):
+    """Todo lo que la IA tiene que completar antes de enseñar vuelos, en un único objeto JSON."""
+    lista = lambda xs: ", ".join(f"'{x}'" for x in xs)
+    claves = []
+    if iatas: claves.append(f'"iatas": objeto con cada uno de estos lugares tal cual como clave y el código IATA de 3 letras de su aeropuerto comercial más cercano como valor: {lista(iatas)}')
+    if lugares: claves.append(f'"coordenadas": objeto con cada uno de estos lugares tal cual como clave y [lat, lon] como valor: {lista(lugares)}')
+    if transporte: claves.append(f'"transporte": {{"vuelos": true si para ir de \'{p.origen}\' a \'{p.ciudad_1}\' conviene volar (más de 600 km o país lejano) y false si es cómodo en coche o tren de una tirada, "explicacion": una o dos frases}}')
+    if precios: claves.append(f'"precios": {{"chollo": precio en euros por persona, ida y vuelta, por debajo del cual volar de \'{p.origen}\' a \'{p.ciudad_1}\' en {MESES_FULL[p.f_ida.month-1][1]} es un chollo, "caro": precio por encima del cual es caro}}')
+    return "Actúa como experto en logística de viajes. Responde SOLO con un objeto JSON con estas claves:\n- " + "\n- ".join(claves)
+
+def validar_arranque(texto, iatas=(), lugares=(), transporte=False, precios=False):
+    """Lo que cumple el esquema de prompt_arranque, campo a campo (y lugar a lugar): lo que falte o
+    no valga se queda fuera para pedirlo por el camino de siempre."""
+    try: datos = json.loads(re.search(r'\{.*\}', texto, re.DOTALL).group())
+    except Exception: datos = {}
+    if not isinstance(datos, dict): datos = {}
+    seccion = lambda campo: datos.get(campo) if isinstance(datos.get(campo), dict) else {}
+    valido = {}
+    codigos = {l: str(seccion("iatas").get(l, "")).strip().upper() for l in iatas}
+    valido["iatas"] = {l: c for l, c in codigos.items() if re.fullmatch(r'[A-Z]{3}', c)}
+    valido["coordenadas"] = {}
+    for l in lugares:
+        try: lat, lon = (float(x) for x in seccion("coordenadas").get(l))
+        except (TypeError, ValueError): continue
+        if -90 <= lat <= 90 and -180 <= lon <= 180: valido["coordenadas"][l] = (lat, lon)
+    t = seccion("transporte")
+    if transporte and isinstance(t.get("vuelos"), bool):
+        valido["transporte"] = {"vuelos": t["vuelos"], "explicacion": str(t.get("explicacion") or "").strip()}
+    pr = seccion("precios")
+    try:
+        chollo, caro = float(pr["chollo"]), float(pr["caro"])
+        if precios and 0 < chollo < caro: valido["precios"] = {"chollo": chollo, "caro": caro}
+    except (KeyError, TypeError, ValueError): pass
+    return valido
+
+def semaforo_local(p, precio_pax, umbrales):
+    """El semáforo de siempre, pero comparando con los umbrales en vez de preguntar por cada precio."""
+    ruta = f"de {p.origen} a {p.ciudad_1} en {MESES_FULL[p.f_ida.month-1][1]}"
+    if precio_pax <= umbrales["chollo"]: return f"🟢 Chollo: {precio_pax:.0f}€/pax, por debajo de los {umbrales['chollo']:.0f}€ habituales {ruta}."
+    if precio_pax >= umbrales["caro"]: return f"🔴 Caro: {precio_pax:.0f}€/pax, por encima de los {umbrales['caro']:.0f}€ {ruta}."
+    return f"🟡 Normal: {precio_pax:.0f}€/pax, entre {umbrales['chollo']:.0f}€ y {umbrales['caro']:.0f}€ {ruta}."
+
+def pet_text(p):
+    return " MUY IMPORTANTE: Busca opciones 'Pet Friendly' que admitan mascotas." if p.mascota else ""
+
+def prompt_barrios(p, ubicacion):
+    if p.tipo == CIUDAD: return f"3 barrios en {p.c_dest} para {p.grupo_texto}. Zonas tipo '{ubicacion}'. {pet_text(p)}"
+    return f"Para la ruta '{p.c_dest}', dime 1 zona ideal (tipo '{ubicacion}') en CADA parada para {p.grupo_texto}. {pet_text(p)}"
+
+def prompt_hoteles(p, tipo, zona_texto, presupuesto):
+    if p.tipo == CIUDAD: return f"Conserje para {p.c_dest}. Busco {tipo} {zona_texto} para {p.grupo_texto}. Plan {p.estilo}. Max {presupuesto}€. {pet_text(p)}"
+    return f"Recomienda 1 {tipo} {zona_texto} para CADA parada de la ruta {p.c_dest}. Grupo: {p.grupo_texto}. Max {presupuesto}€. {pet_text(p)}"
+
+def prompt_mapa(p):
+    return f"Identifica 15 puntos imperdibles de {p.c_dest}. Clasifica en 'monumento', 'naturaleza' o 'cultura'. SOLO devuelve JSON: [{{'nombre':'...','lat':0.0,'lon':0.0,'tipo':'monumento'}}]"
+
+def prompts_guia(p):
+    """{'guia_p1': itinerario, 'guia_p2': logística, 'guia_p3': maleta}"""
+    mes_n = MESES_FULL[p.f_ida.month-1][1]
+    niños_str = "con áreas verdes o parques infantiles para los niños" if p.edades_ninos else "para descansar y tomar algo"
+    pet_str = "Menciona parques donde soltar al perro en las ciudades." if p.mascota else ""
+
+    # --- PROMPT 1: ITINERARIO ---
+    if p.tipo == CIUDAD:
+        p1_c = f"Actúa como guía de {p.c_dest}. Itinerario de {p.num_dias} días para {p.grupo_texto}. Plan: {p.estilo}. {pet_str}"
+    else:
+        detalles_motor = f"Vehículo: {p.vehiculo} (Modelo: {p.modelo_coche}). Ruta: {p.estilo_conduccion}." if p.transporte == COCHE else ""
+        p1_c = f"Experto en Roadtrips. Ruta: {p.origen}, {p.c_dest}. Días: {p.num_dias}. Grupo: {p.grupo_texto}. {detalles_motor}. {pet_str}"
+
+    p1 = p1_c + """
+            Usa Markdown.
+            ### 🔗 El Enlace Maestro
+            Al principio del itinerario, genera un ÚNICO enlace de Google Maps que contenga todas las paradas de la ruta.
+
+            ### 🌟 Desvíos Genius y Paradas Tácticas
+            - Si hay alguna joya oculta cerca de la ruta, recomiéndalo como 'Desvío Genius'.
+            """
+    if p.tipo == ROADTRIP:
+        p1 += f"- Para los tramos largos de conducción (>3 horas), recomienda una 'Parada Táctica' exacta a mitad de camino {niños_str}.\n"
+
+    if p.transporte == COCHE and p.tipo != CIUDAD:
+        p1 += """
+            ### 🅿️ Estrategia de Aparcamiento
+            Recomienda en cada ciudad:
+            1. Parking P+R (Aparca y Viaja) a las afueras.
+            2. Parking VIP/Céntrico para ahorrar tiempo.
+            """
+        if "Furgoneta" in p.vehiculo or "Autocaravana" in p.vehiculo:
+            p1 += "3. 🚐 'Spots' legales o campings para dormir con camper.\n"
+
+    p1 += """
+            ### 🎧 Entretenimiento
+            3 canciones y 1 temática de podcast histórica de la zona.
+            ### 🍽️ Restaurantes
+            5 Económicos, 5 Calidad-Precio, 5 Premium.
+            """
+
+    # --- PROMPT 2: LOGÍSTICA ---
+    p2 = f"Experto logístico para {p.grupo_texto} a {p.c_dest} en {mes_n}.\n"
+    if p.transporte == COCHE and p.tipo != CIUDAD:
+        p2 += f"""
+            ### ⛽ Matemáticas y Tiempos de Carretera
+            Crea una tabla en Markdown con las distancias y tiempos de conducción de CADA tramo del viaje (Ej: Tramo 1: Bilbao -> Burdeos | 330km | 3h 15m).
+            Haz un cálculo del Gasto de Combustible (Modelo: {p.modelo_coche}) y Coste de PEAJES totales.
+            Si es EV, evalúa la red de recarga.
+
+            ### 👮 Leyes y Fronteras
+            Menciona ZTLs, viñetas de peaje o normativas de los países.
+
+            ### 🧰 Chuleta de Emergencia
+            Tabla con 5 frases traducidas al idioma local: Pinchazo, Grúa, Gasolina/Carga, Baño, Accidente.
+            """
+
+    if p.mascota:
+        p2 += "### 🐶 Pasaporte Perruno\nNormativas legales para cruzar a estos países con mascota (pasaporte, vacunas).\n"
+
+    p2 += """
+            ### 🚇 Movilidad y Presupuesto
+            Abonos de transporte recomendados y Presupuesto total estimado.
+            ### 🧻 Supervivencia Urbana
+            Enchufe, Baños Públicos, Supermercados, Farmacias.
+            """
+    p3 = f"Viajan {p.grupo_texto} a {p.c_dest} en {mes_n}. 10-12 objetos para maleta. SOLO array JSON de strings."
+    return {'guia_p1': p1, 'guia_p2': p2, 'guia_p3': p3}
+
+_fondo = ThreadPoolExecutor(max_workers=2, thread_name_prefix="arranque")
+
+def umbrales_precio(p, _prioridad=INTERACTIVA):
+    """{'chollo', 'caro'} en €/pax para la ruta y el mes, o None si la IA no da algo válido."""
+    return validar_arranque(preguntar_ia_seguro(prompt_arranque(p, precios=True), _prioridad=_prioridad), precios=True).get("precios")
+
+def hay_historial(p, iata_o, iata_d):
+    """Si el semáforo de esta ruta y mes puede salir del histórico de precios sin preguntar a la IA."""
+    return bool(iata_o and iata_d) and obtener_historial().suficiente(iata_o, iata_d, p.f_ida.month, "ida_vuelta" if p.f_vta else "ida")
+
+def pedir_semaforo(p, diag, precio_pax):
+    """`precio_pax` es lo más barato por pasajero de la búsqueda sin filtrar, que es lo que guarda el histórico.
+    Con histórico suficiente de la ruta y el mes, el percentil del precio entre lo ya visto. Si no,
+    los umbrales del arranque (o pedidos aparte, normalmente ya en caché o en curso) y, si tampoco
+    llegan, se pregunta por el precio concreto como siempre. Después, la búsqueda pasa al histórico."""
+    with medir("semaforo"):
+        ruta = diag["iata_origen"], diag["iata_destino"]
+        historico = semaforo_historico(*ruta, p.f_ida.month, precio_pax, "ida_vuelta" if p.f_vta else "ida") if all(ruta) else None
+        if historico:
+            contar("semaforo", fuente="historial")
+            texto = historico[0]
+        else:
+            umbrales = diag.get("umbrales") or (umbrales_precio(p) if ARRANQUE else None)
+            contar("semaforo", fuente="umbrales" if umbrales else "ia")
+            texto = semaforo_local(p, precio_pax, umbrales) if umbrales else preguntar_ia_seguro(prompt_semaforo(*ruta, p.f_ida.month, precio_pax))
+    if all(ruta):
+        try: registrar_busqueda(*ruta, p.f_ida, p.f_vta, p.pasajeros_api, precio_pax)
+        except Exception as e: avisar(f"No se pudo guardar el precio en el histórico: {e}") # avisar puede ser st.warning: solo el texto
+    return texto
+
+# --- PLAN COMPLETO ---
+@medido("diagnostico")
+def diagnosticar(p):
+    """Aeropuertos, coordenadas y tramos del viaje. `vuelos` dice si el primer salto va en avión
+    (la IA solo decide si ese salto no se puede medir) y `analisis` trae su respuesta en ese caso.
+
+    Con ARRANQUE, lo que no se resuelve en local (aeropuertos, coordenadas, el primer salto y los
+    umbrales de precio del semáforo) va en un único prompt JSON, y solo los campos que falten o no
+    validen se piden después por su cuenta. Si no falta nada, los umbrales se piden en segundo
+    plano mientras se buscan los vuelos. Los umbrales no se piden si la ruta ya tiene histórico."""
+    iatas, puntos = obtener_iatas([p.origen, p.ciudad_1], ia=not ARRANQUE), puntos_ruta(p.paradas, ia=not ARRANQUE)
+    tramos = tramos_ruta(p.paradas, puntos)
+    analisis = vuelos = umbrales = None
+    faltan_iatas = tuple(c for c, iata in iatas.items() if not iata and c.strip())
+    faltan_puntos = tuple(l for l, punto in puntos.items() if not punto)
+    if ARRANQUE and (faltan_iatas or faltan_puntos or tramos[0].volar is None):
+        pedir = dict(iatas=faltan_iatas, lugares=faltan_puntos, transporte=tramos[0].volar is None,
+                     precios=tramos[0].volar is not False and not hay_historial(p, iatas[p.origen], iatas[p.ciudad_1]))
+        with medir("arranque"): datos = validar_arranque(preguntar_ia_seguro(prompt_arranque(p, **pedir)), **pedir)
+        iatas.update(datos["iatas"])
+        puntos.update(datos["coordenadas"])
+        umbrales = datos.get("precios")
+        sin_iata = tuple(c for c in faltan_iatas if c not in datos["iatas"])
+        sin_punto = tuple(l for l in faltan_puntos if l not in datos["coordenadas"])
+        if sin_iata: iatas.update(preguntar_iatas_ia(sin_iata))
+        if sin_punto: puntos.update(preguntar_coordenadas_ia(sin_punto))
+        tramos = tramos_ruta(p.paradas, puntos)
+        if tramos[0].volar is None and "transporte" in datos:
+            vuelos = datos["transporte"]["vuelos"]
+            analisis = f"{'VUELOS_SI' if vuelos else 'VUELOS_NO'}. {datos['transporte']['explicacion']}"
+    elif ARRANQUE and tramos[0].volar and not hay_historial(p, iatas[p.origen], iatas[p.ciudad_1]):
+        _fondo.submit(umbrales_precio, p, _prioridad=FONDO) # pedir_semaforo lo recoge de la caché o esperando a esta misma llamada
+    if tramos[0].volar is None and analisis is None:
+        with medir("analisis_transporte"): analisis = preguntar_ia_seguro(prompt_transporte(p))
+        vuelos = "VUELOS_SI" in analisis
+    return {"iata_origen": iatas[p.origen], "iata_destino": iatas[p.ciudad_1], "puntos": puntos, "tramos": tramos, "umbrales": umbrales,
+            "vuelos": tramos[0].volar if tramos[0].volar is not None else vuelos, "analisis": analisis}
+
+@medido("vuelos")
+def ofertas_vuelo(p, iata_o, iata_d):
+    """(ofertas filtradas y ordenadas por precio, hay_directos, precio más barato sin filtrar o None) para las fechas de la petición."""
+    tabla = TablaOfertas.desde_respuesta(buscar_vuelos_amadeus_cache(iata_o, iata_d, p.f_ida, p.f_vta, *p.pasajeros_api))
+    finales, hay_directos = filtrar_ofertas(tabla, p.solo_directos, BLOQUES_HORARIOS[p.pref_ida], BLOQUES_HORARIOS[p.pref_vta])
+    return finales, hay_directos, float(tabla.precio.min()) if len(tabla) else None
+
+def fechas_tramos(p, saltos):
+    """Día de salida de cada uno de los `saltos` (vuelta a casa incluida): los días del viaje se reparten
+    por igual entre las paradas donde se duerme, una menos que saltos, y el último sale el día de la vuelta."""
+    estancias = max(1, saltos - 1)
+    return [p.f_ida + timedelta(days=i * p.num_dias // estancias) for i in range(saltos - 1)] + [p.f_vta]
+
+def tramos_viaje(p, puntos):
+    """Los saltos del roadtrip completo, vuelta a casa incluida, sin buscar nada todavía."""
+    paradas = p.paradas + ([p.origen] if p.paradas[-1].lower() != p.origen.lower() else [])
+    return tramos_ruta(paradas, puntos)
+
+@medido("vuelos_tramos")
+def vuelos_por_tramos(p, puntos, opciones=3):
+    """Roadtrip completo, vuelta a casa incluida: cada salto que en línea recta pide avión se busca
+    solo ida, todos a la vez (hasta AMADEUS_CONCURRENCIA) y por la caché compartida.
+    Devuelve {'tramos': [...], 'total': suma de lo más barato de cada salto en avión, 'completo'}."""
+    tramos = tramos_viaje(p, puntos)
+    fechas = fechas_tramos(p, len(tramos))
+    iatas = obtener_iatas(list(dict.fromkeys(x for t in tramos if t.volar for x in (t.origen, t.destino))))
+    bloques = [p.pref_ida] + ["Cualquier hora"] * (len(tramos) - 2) + [p.pref_vta] if len(tramos) > 1 else [p.pref_ida]
+
+    def buscar(i):
+        t = tramos[i]
+        if not (t.volar and iatas[t.origen] and iatas[t.destino]): return []
+        res = buscar_vuelos_amadeus_cache(iatas[t.origen], iatas[t.destino], fechas[i], None, *p.pasajeros_api)
+        if res is None: return None # Amadeus no contestó, que no es lo mismo que no haya vuelos
+        tabla = TablaOfertas.desde_respuesta(res)
+        finales, _ = filtrar_ofertas(tabla, p.solo_directos, BLOQUES_HORARIOS[bloques[i]], BLOQUES_HORARIOS["Cualquier hora"])
+        return list(finales.pagina(1, opciones).filas())
+
+    with ThreadPoolExecutor(max_workers=AMADEUS_CONCURRENCIA) as pool:
+        ofertas = list(pool.map(buscar, range(len(tramos))))
+    resultado = [{"origen": t.origen, "destino": t.destino, "fecha": str(f), "km": t.km, "volar": t.volar,
+                  "iata_origen": iatas.get(t.origen) if t.volar else None, "iata_destino": iatas.get(t.destino) if t.volar else None,
+                  "ofertas": o or [], "sin_respuesta": o is None} for t, f, o in zip(tramos, fechas, ofertas)]
+    en_avion = [r for r in resultado if r["volar"]]
+    return {"tramos": resultado, "total": sum(r["ofertas"][0]["precio"] for r in en_avion if r["ofertas"]),
+            "completo": all(r["ofertas"] for r in en_avion)}
+
+def planificar(p, secciones=("vuelos", "guia"), max_vuelos=10):
+    """Plan completo en un dict serializable a JSON, sin pasar por la interfaz."""
+    with medir("plan", perfilar=True, tipo="ciudad" if p.tipo == CIUDAD else "roadtrip"): return _planificar(p, secciones, max_vuelos)
+
+def _planificar(p, secciones, max_vuelos):
+    d = diagnosticar(p)
+    plan = {"origen": p.origen, "paradas": p.paradas, "ida": str(p.f_ida), "vuelta": str(p.f_vta),
+            "iata_origen": d["iata_origen"], "iata_destino": d["iata_destino"],
+            "tramos": [t._asdict() for t in d["tramos"]], "diagnostico": texto_diagnostico(d["tramos"]), "analisis": d["analisis"]}
+    if "vuelos" in secciones and d["vuelos"] and d["iata_origen"] and d["iata_destino"]:
+        v_finales, hay_directos, mas_barato = ofertas_vuelo(p, d["iata_origen"], d["iata_destino"])
+        plan["vuelos"] = list(v_finales.pagina(1, max_vuelos).filas())
+        plan["hay_directos"] = hay_directos
+        if mas_barato is not None:
+            plan["semaforo"] = pedir_semaforo(p, d, mas_barato / p.num_viajeros)
+    if "vuelos" in secciones and p.tipo == ROADTRIP:
+        plan["vuelos_tramos"] = vuelos_por_tramos(p, d["puntos"])
+    if "guia" in secciones:
+        textos = {}
+        with medir("guia"):
+            for clave, texto, terminado in preguntar_ia_paralelo(prompts_guia(p)):
+                if terminado: textos[clave] = texto
+
+        plan["guia"] = {"itinerario": textos["guia_p1"], "logistica": textos["guia_p2"], "maleta": parsear_maleta(textos["guia_p3"])}
+    return plan
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Antes de importar nada del proyecto: ninguna prueba escribe en la caché de verdad
+os.environ["TRAVELGENIUS_CACHE"] = os.path.join(tempfile.mkdtemp(prefix="travelgenius-pruebas-"), "cache.sqlite3")
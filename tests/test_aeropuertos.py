@@ -0,0 +1,21 @@
+import pytest
+
+from aeropuertos import obtener_indice, resolver_iatas
+
+MAL_EMPAREJADOS = {"Ronda": "KGL", "Soria": "SOF", "Braga": "PRG", "Siena": "VIE", "Parma": "PMI", "Ávila": "OVD",
+                   "Huelva": "HSK", "Palencia": "VLC", "Amiens": "ATH", "Trento": "YTO"}
+
+
+@pytest.mark.parametrize("ciudad, prohibido", MAL_EMPAREJADOS.items())
+def test_la_busqueda_difusa_no_manda_ciudades_a_aeropuertos_ajenos(ciudad, prohibido):
+    assert resolver_iatas([ciudad])[ciudad] != prohibido
+
+
+def test_la_busqueda_difusa_sigue_perdonando_erratas():
+    assert resolver_iatas(["Bilbo", "Barcelna", "Malaga", "Rwanda"]) == {"Bilbo": "BIO", "Barcelna": "BCN", "Malaga": "AGP", "Rwanda": "KGL"}
+
+
+def test_los_alias_de_pais_solo_valen_escritos_tal_cual():
+    indice = obtener_indice()
+    assert indice.buscar("Ruanda").iata == "KGL"
+    assert indice.buscar("Ronda") is None
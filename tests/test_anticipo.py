@@ -0,0 +1,14 @@
+import anticipo
+import cache_disco
+import motor
+
+
+def test_calentar_no_pregunta_a_la_ia_ni_busca_sin_codigo(monkeypatch, tmp_path):
+    """Lo que aún se está escribiendo ("Bil") no gasta cuota de Gemini ni de Amadeus."""
+    monkeypatch.setattr(cache_disco, "_cache", cache_disco.CacheDisco(str(tmp_path / "cache.sqlite3")))
+    def prohibido(*args, **kwargs): raise AssertionError("no debería llamarse")
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", prohibido)
+    monkeypatch.setattr(anticipo, "buscar_vuelos_amadeus_cache", prohibido)
+
+    p = motor.Peticion.desde_dict({"origen": "Xqzwy", "destino": "Roma", "ida": "2026-12-10", "vuelta": "2026-12-14"})
+    assert anticipo.calentar(p) is True
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+import cache_disco
+
+
+class Rerun(BaseException):
+    """Como el RerunException de Streamlit: no es Exception."""
+
+
+def con_otra_esperando(funcion_primera, funcion_segunda):
+    """Ejecuta funcion_primera y, mientras está en curso, otra llamada con la misma clave. Devuelve (primera, segunda)."""
+    en_curso, clave = cache_disco.EnCurso(), ("prueba", "clave")
+    empezada, soltar, resultados = threading.Event(), threading.Event(), {}
+
+    def primera():
+        empezada.set()
+        soltar.wait(5)
+        return funcion_primera()
+
+    def correr(nombre, funcion):
+        try: resultados[nombre] = en_curso.ejecutar(clave, funcion)
+        except BaseException as e: resultados[nombre] = e
+
+    hilos = [threading.Thread(target=correr, args=("primera", primera)), threading.Thread(target=correr, args=("segunda", funcion_segunda))]
+    hilos[0].start()
+    empezada.wait(5)
+    hilos[1].start()
+    time.sleep(0.1) # La segunda ya espera el Future de la primera
+    soltar.set()
+    for h in hilos: h.join(5)
+    return resultados["primera"], resultados["segunda"]
+
+
+def test_las_llamadas_agrupadas_reciben_la_excepcion_de_la_primera():
+    llamadas = []
+    def falla():
+        llamadas.append(1)
+        raise ValueError("cuota")
+    primera, segunda = con_otra_esperando(falla, lambda: pytest.fail("no debería ejecutarse"))
+    assert isinstance(primera, ValueError) and segunda is primera and len(llamadas) == 1
+
+
+def test_un_rerun_de_la_primera_no_llega_a_las_demas():
+    def rerun(): raise Rerun()
+    primera, segunda = con_otra_esperando(rerun, lambda: "propia")
+    assert isinstance(primera, Rerun) and segunda == "propia"
+
+
+def test_cansarse_de_esperar_devuelve_si_no_llega(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_disco, "_cache", cache_disco.CacheDisco(str(tmp_path / "cache.sqlite3")))
+    def agotada(clave, funcion): raise TimeoutError("Sin respuesta de la llamada idéntica en curso tras 300s")
+    monkeypatch.setattr(cache_disco.en_curso, "ejecutar", agotada)
+
+    import motor
+    assert motor.preguntar_ia_seguro("hola").startswith("❌ Error: Sin respuesta")
+    assert motor.buscar_vuelos_amadeus_cache("BIO", "FCO", "2026-12-10", "2026-12-14", 2, 0, 0) is None
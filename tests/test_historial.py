@@ -0,0 +1,36 @@
+import random
+
+import historial
+from historial import Boceto
+
+
+def test_rango_y_cuantiles_dentro_del_error_relativo():
+    azar = random.Random(7)
+    precios = [azar.lognormvariate(5, 0.5) for _ in range(5000)]
+    boceto = Boceto()
+    for p in precios: boceto.añadir(p)
+    ordenados = sorted(precios)
+    for q in (0.1, 0.25, 0.5, 0.75, 0.9):
+        exacto = ordenados[int(q * len(ordenados))]
+        assert abs(boceto.cuantil(q) - exacto) / exacto <= 2 * historial.ERROR_RELATIVO
+        # Lo que se cuela en la cubeta del precio es como mucho lo que cabe en un ±1% alrededor de él
+        cerca = sum(1 for p in precios if abs(p - exacto) / exacto <= 2 * historial.ERROR_RELATIVO) / len(precios)
+        assert abs(boceto.rango(exacto) - q) <= cerca
+    assert boceto.rango(ordenados[0] / 2) == 0 and boceto.rango(ordenados[-1] * 2) == 1
+
+
+def test_al_juntar_cubetas_se_pierde_resolucion_solo_por_abajo(monkeypatch):
+    monkeypatch.setattr(historial, "MAX_CUBETAS", 20)
+    boceto = Boceto()
+    precios = [10 * 1.05 ** i for i in range(60)] # Cada precio en su cubeta: hay que juntar 40
+    for p in precios: boceto.añadir(p)
+    assert len(boceto.cubetas) == 20 and boceto.total == len(precios)
+    assert abs(boceto.cuantil(0.9) - precios[53]) / precios[53] <= historial.ERROR_RELATIVO * 2
+    assert boceto.rango(precios[-1] * 2) == 1
+
+
+def test_serial_ida_y_vuelta():
+    boceto = Boceto(busquedas=3, ultima="2026-12-10|None|2,0,0|99.00")
+    for p in (99, 120, 87.5): boceto.añadir(p)
+    copia = Boceto.desde_serial(boceto.serial())
+    assert (copia.cubetas, copia.busquedas, copia.ultima) == (boceto.cubetas, 3, boceto.ultima)
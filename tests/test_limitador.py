@@ -0,0 +1,41 @@
+import threading
+import time
+
+from limitador import FONDO, INTERACTIVA, LimitadorTokens
+
+
+def test_peticiones_por_minuto():
+    cuota = LimitadorTokens(rpm=600, tpm=10 ** 9) # Una petición cada 0.1 s una vez vacío el cubo
+    inicio = time.monotonic()
+    for _ in range(600): assert cuota.adquirir(timeout=0)
+    assert time.monotonic() - inicio < 0.5
+    assert cuota.adquirir(timeout=0.5)
+    assert 0.05 < time.monotonic() - inicio < 1
+
+
+def test_tokens_por_minuto():
+    cuota = LimitadorTokens(rpm=10 ** 6, tpm=6000) # 100 tokens por segundo
+    assert cuota.adquirir(6000, timeout=0)
+    assert not cuota.adquirir(50, timeout=0.2) # Aún no se han rellenado 50
+    assert cuota.adquirir(50, timeout=1)
+
+
+def test_timeout_sin_cupo():
+    cuota = LimitadorTokens(rpm=1, tpm=10 ** 6)
+    assert cuota.adquirir(timeout=0)
+    inicio = time.monotonic()
+    assert cuota.adquirir(timeout=0.1) is False
+    assert 0.09 < time.monotonic() - inicio < 1
+
+
+def test_el_fondo_cede_el_turno_a_lo_interactivo():
+    cuota = LimitadorTokens(rpm=120, tpm=10 ** 6) # Un hueco cada 0.5 s
+    for _ in range(120): cuota.adquirir()
+    orden = []
+    fondo = threading.Thread(target=lambda: cuota.adquirir(prioridad=FONDO) and orden.append("fondo"))
+    fondo.start()
+    time.sleep(0.05) # El de fondo ya está en la cola cuando llega el interactivo
+    interactiva = threading.Thread(target=lambda: cuota.adquirir(prioridad=INTERACTIVA) and orden.append("interactiva"))
+    interactiva.start()
+    for h in (fondo, interactiva): h.join(5)
+    assert orden == ["interactiva", "fondo"]
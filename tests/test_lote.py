@@ -0,0 +1,9 @@
+import lote
+
+
+def test_lineas_mal_formadas_salen_como_error():
+    for linea in ('{"id": "roto", ', '["Bilbao", "Roma"]', '"Bilbao"'):
+        plan, _ = lote._planificar(linea, ())
+        assert plan["id"] is None and "error" in plan
+    plan, _ = lote._planificar('{"id": "sin-destino", "origen": "Bilbao"}', ())
+    assert plan["id"] == "sin-destino" and plan["error"].startswith("ValueError")
@@ -0,0 +1,7 @@
+import metricas
+
+
+def test_prometheus_escapa_las_etiquetas():
+    registro = metricas.Registro()
+    registro.contar("errores", servicio='gemini', tipo='Fallo "raro"\nen C:\\ruta')
+    assert 'tipo="Fallo \\"raro\\"\\nen C:\\\\ruta"' in registro.prometheus()
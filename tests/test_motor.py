@@ -0,0 +1,181 @@
+import sqlite3
+import threading
+import time
+import types
+
+import pytest
+import streamlit as st
+
+import cache_disco
+import historial
+import motor
+
+
+@pytest.fixture
+def cache_temporal(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_disco, "_cache", cache_disco.CacheDisco(str(tmp_path / "cache.sqlite3")))
+
+
+@pytest.fixture
+def historial_temporal(monkeypatch, tmp_path):
+    monkeypatch.setattr(historial, "_historial", historial.HistorialPrecios(str(tmp_path / "historial.sqlite3")))
+    monkeypatch.setattr(motor, "ARRANQUE", False)
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", lambda prompt, _prioridad=None: "🟡 Normal")
+    return historial._historial
+
+
+def test_fallo_del_historico_no_rompe_el_semaforo(monkeypatch, historial_temporal):
+    """En la interfaz avisar es st.warning, que no acepta argumentos al estilo de logging."""
+    def registrar_busqueda(*args): raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(motor, "registrar_busqueda", registrar_busqueda)
+    avisos = []
+    def avisar(*args, **kwargs):
+        avisos.append(args)
+        return st.warning(*args, **kwargs)
+    monkeypatch.setattr(motor, "avisar", avisar)
+
+    peticion = motor.Peticion.desde_dict({"origen": "Bilbao", "destino": "Roma", "ida": "2026-12-10", "vuelta": "2026-12-14"})
+    assert motor.pedir_semaforo(peticion, {"iata_origen": "BIO", "iata_destino": "FCO"}, 60.0) == "🟡 Normal"
+    assert len(avisos) == 1 and "database is locked" in avisos[0][0]
+
+
+def test_historico_solo_con_busquedas_del_usuario(monkeypatch, cache_temporal, historial_temporal):
+    """Lo que trae Amadeus (anticipo, calendario) no cuenta; cada semáforo se juzga sin su propia búsqueda
+    y pulsar otra vez lo mismo no añade una muestra."""
+    resultado = {"data": [{"price": {"total": "120.00"}}]}
+    busqueda = types.SimpleNamespace(get=lambda **params: types.SimpleNamespace(result=resultado))
+    monkeypatch.setattr(motor, "obtener_amadeus", lambda: types.SimpleNamespace(shopping=types.SimpleNamespace(flight_offers_search=busqueda)))
+    assert motor.buscar_vuelos_amadeus_cache("BIO", "FCO", "2026-12-10", "2026-12-14", 2, 0, 0) == resultado
+    assert historial_temporal.boceto("BIO", "FCO", 12) is None
+
+    diag = {"iata_origen": "BIO", "iata_destino": "FCO"}
+    for dia in range(1, historial.MIN_BUSQUEDAS + 1):
+        peticion = motor.Peticion.desde_dict({"origen": "Bilbao", "destino": "Roma", "ida": f"2026-12-{dia:02d}", "vuelta": "2026-12-20"})
+        assert motor.pedir_semaforo(peticion, diag, 100.0 + dia) == "🟡 Normal" # Hasta la última no hay histórico suficiente
+        motor.pedir_semaforo(peticion, diag, 100.0 + dia)
+    assert historial_temporal.boceto("BIO", "FCO", 12).busquedas == historial.MIN_BUSQUEDAS
+    assert motor.pedir_semaforo(peticion, diag, 50.0).startswith("🟢")
+
+
+def test_iatas_sin_ia_esperan_a_la_llamada_en_curso(monkeypatch, cache_temporal):
+    """Al pulsar Planificar con otra sesión aún preguntando por un lugar, se espera a esa respuesta en vez de repetirla."""
+    llamadas, soltar = [], threading.Event()
+    def preguntar_ia_seguro(prompt, _prioridad=None):
+        llamadas.append(prompt)
+        soltar.wait(5)
+        return '{"Pueblo Inventado": "XYZ"}'
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", preguntar_ia_seguro)
+
+    otra = threading.Thread(target=motor.preguntar_iatas_ia, args=(("Pueblo Inventado",),))
+    otra.start()
+    while not llamadas: time.sleep(0.01)
+    threading.Timer(0.1, soltar.set).start()
+    assert motor.obtener_iatas(["Pueblo Inventado"], ia=False) == {"Pueblo Inventado": "XYZ"}
+    otra.join()
+    assert len(llamadas) == 1
+
+
+def test_iatas_sin_respuesta_valida_no_se_guardan(monkeypatch, cache_temporal):
+    """Sin cuota o con un JSON roto, el lugar se vuelve a preguntar en vez de quedarse en None un mes."""
+    respuestas = iter(["⚠️ IA no disponible.", '{"Pueblo Inventado": "XYZ"}'])
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", lambda prompt, _prioridad=None: next(respuestas))
+
+    assert motor.preguntar_iatas_ia(("Pueblo Inventado",)) == {"Pueblo Inventado": None}
+    assert motor.preguntar_iatas_ia.guardado(("Pueblo Inventado",)) == (False, None)
+    assert motor.preguntar_iatas_ia(("Pueblo Inventado",)) == {"Pueblo Inventado": "XYZ"}
+
+
+def test_coordenadas_sin_respuesta_valida_no_se_guardan(monkeypatch, cache_temporal):
+    respuestas = iter(["❌ Error: 500", '{"Pueblo Inventado": [43.1, -2.9]}'])
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", lambda prompt, _prioridad=None: next(respuestas))
+
+    assert motor.preguntar_coordenadas_ia(("Pueblo Inventado",)) == {"Pueblo Inventado": None}
+    assert motor.preguntar_coordenadas_ia(("Pueblo Inventado",)) == {"Pueblo Inventado": [43.1, -2.9]}
+
+
+def test_diagnostico_y_umbral_usan_la_misma_distancia():
+    """Madrid-Barcelona (~505 km en línea recta) queda por debajo de los 600 km: en tren o coche."""
+    from geo import tramos_ruta
+    tramo, = tramos_ruta(["Madrid", "Barcelona"], {"Madrid": (40.4168, -3.7038), "Barcelona": (41.3874, 2.1686)})
+    assert 480 < tramo.km < 600 and tramo.volar is False
+    assert motor.texto_diagnostico([tramo]).startswith("🚗") and "505 km en línea recta" in motor.texto_diagnostico([tramo])
+
+
+def test_calendario_pide_pocas_ofertas_con_su_propia_clave(monkeypatch, cache_temporal):
+    pedidos = []
+    def get(**params):
+        pedidos.append(params["max"])
+        return types.SimpleNamespace(result={"data": [{"price": {"total": "99.00"}}]})
+    busqueda = types.SimpleNamespace(get=get)
+    monkeypatch.setattr(motor, "obtener_amadeus", lambda: types.SimpleNamespace(shopping=types.SimpleNamespace(flight_offers_search=busqueda)))
+
+    par = ("2026-12-10", "2026-12-14")
+    assert motor.buscar_calendario_precios("BIO", "FCO", [par], 2, 0, 0) == {par: 99.0}
+    motor.buscar_vuelos_amadeus_cache("BIO", "FCO", *par, 2, 0, 0) # La búsqueda normal no se queda con la corta
+    assert pedidos == [motor.OFERTAS_CALENDARIO, 250]
+
+
+def test_pueblos_del_nomenclator_van_a_su_aeropuerto_cercano():
+    """Lo que el nomenclátor conoce tal cual gana a la búsqueda difusa y a los aeropuertos homónimos lejanos."""
+    iatas = motor.obtener_iatas(["Ronda", "Soria", "Mérida", "Guadalajara", "Madrid"], ia=False)
+    assert iatas["Ronda"] in ("AGP", "SVQ", "XRY")
+    assert iatas["Soria"] != "SOF" and iatas["Mérida"] != "MID" and iatas["Guadalajara"] != "GDL"
+    assert iatas["Madrid"] == "MAD"
+
+
+def test_diagnostico_no_toca_las_comas_de_los_nombres():
+    from geo import Tramo
+    texto = motor.texto_diagnostico([Tramo("Paris, Texas", "Madrid", 7800.0, 9750.0, True)])
+    assert texto == "✈️ **Paris, Texas ➔ Madrid**: 7.800 km en línea recta. Mejor volar."
+
+
+def test_cerrar_la_guia_no_espera_a_las_llamadas_pendientes(monkeypatch):
+    """Un rerun cierra el generador: no puede quedarse esperando a que Gemini acabe."""
+    soltar = threading.Event()
+    def preguntar_ia_seguro(prompt, _prioridad=None):
+        if prompt != "rápido": soltar.wait(5)
+        return prompt
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", preguntar_ia_seguro)
+
+    guia = motor.preguntar_ia_paralelo({"a": "rápido", "b": "lento", "c": "lento 2"})
+    assert next(guia) == ("a", "rápido", False)
+    inicio = time.monotonic()
+    guia.close()
+    assert time.monotonic() - inicio < 1
+    soltar.set()
+
+
+def test_fechas_de_los_tramos():
+    from datetime import date
+    ida, vuelta = date(2026, 12, 1), date(2026, 12, 7)
+    abierta = motor.Peticion("Bilbao", ("Roma", "Florencia"), motor.ROADTRIP, ida, vuelta)
+    cerrada = motor.Peticion("Bilbao", ("Roma", "Florencia", "Bilbao"), motor.ROADTRIP, ida, vuelta)
+    esperado = [ida, date(2026, 12, 4), vuelta] # Bilbao ➔ Roma ➔ Florencia ➔ Bilbao: 3 noches en cada parada
+    for p in (abierta, cerrada):
+        assert len(motor.tramos_viaje(p, {})) == 3
+        assert motor.fechas_tramos(p, 3) == esperado
+
+
+def test_arranque_malformado_o_incompleto_no_lanza():
+    pedir = dict(iatas=("Pueblo",), lugares=("Pueblo",), transporte=True, precios=True)
+    for texto in ("", "❌ Error: 500", "[1, 2]", '{"iatas": "BIO", "coordenadas": [1, 2]', '{"iatas": "BIO", "transporte": null}',
+                  '{"iatas": {"Pueblo": "bilbao"}, "coordenadas": {"Pueblo": [100, 0]}, "transporte": {"vuelos": "si"}, "precios": {"chollo": 300, "caro": 100}}'):
+        assert motor.validar_arranque(texto, **pedir) == {"iatas": {}, "coordenadas": {}}
+    parcial = motor.validar_arranque('{"iatas": {"Pueblo": "xyz"}, "precios": {"chollo": "80", "caro": 200}}', **pedir)
+    assert parcial == {"iatas": {"Pueblo": "XYZ"}, "coordenadas": {}, "precios": {"chollo": 80.0, "caro": 200.0}}
+
+
+def test_lo_que_falta_en_el_arranque_se_pide_por_separado(monkeypatch, cache_temporal):
+    prompts = []
+    def preguntar_ia_seguro(prompt, _prioridad=None):
+        prompts.append(prompt)
+        if "Responde SOLO con un objeto JSON con estas claves" in prompt: return '{"iatas": {"Pueblo Inventado": "XYZ"}, "coordenadas": "no sé"}'
+        if "coordenadas" in prompt: return '{"Pueblo Inventado": [41.9, 12.5]}'
+        raise AssertionError(prompt)
+    monkeypatch.setattr(motor, "preguntar_ia_seguro", preguntar_ia_seguro)
+    monkeypatch.setattr(motor, "ARRANQUE", True)
+
+    diag = motor.diagnosticar(motor.Peticion.desde_dict({"origen": "Bilbao", "destino": "Pueblo Inventado", "ida": "2026-12-10", "vuelta": "2026-12-14"}))
+    assert (diag["iata_origen"], diag["iata_destino"]) == ("BIO", "XYZ")
+    assert diag["puntos"]["Pueblo Inventado"] == [41.9, 12.5] and diag["vuelos"] is True
+    assert len(prompts) == 2
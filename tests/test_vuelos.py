@@ -0,0 +1,70 @@
+import itertools
+
+from vuelos import TablaOfertas, filtrar_ofertas
+
+TODO_EL_DIA, MAÑANA, TARDE, NOCHE = (0, 24), (6, 12), (15, 21), (21, 6)
+
+
+def tramo(salida, escalas, origen="BIO", destino="FCO"):
+    paradas = [origen] + [f"X{i}" for i in range(escalas)] + [destino]
+    return {"segments": [{"departure": {"at": salida if i == 0 else f"{salida[:11]}23:00:00", "iataCode": a}, "arrival": {"iataCode": b}, "carrierCode": "IB"}
+                         for i, (a, b) in enumerate(zip(paradas, paradas[1:]))]}
+
+
+def oferta(precio, hora_ida, hora_vta, escalas_ida=0, escalas_vta=0):
+    return {"price": {"total": f"{precio:.2f}"}, "validatingAirlineCodes": ["IB"],
+            "itineraries": [tramo(f"2026-12-10T{hora_ida:02d}:15:00", escalas_ida), tramo(f"2026-12-14T{hora_vta:02d}:40:00", escalas_vta, "FCO", "BIO")]}
+
+
+def filtrar_como_antes(ofertas, solo_directos, bloque_ida, bloque_vta):
+    """El recorrido por dicts que había en viaje.py antes de la tabla en columnas (más el orden por precio)."""
+    vistos, unicos = set(), []
+    for v in ofertas:
+        huella = (v["itineraries"][0]["segments"][0]["departure"]["at"], v["price"]["total"])
+        if huella not in vistos:
+            vistos.add(huella)
+            unicos.append(v)
+    directos = [v for v in unicos if all(len(it["segments"]) == 1 for it in v["itineraries"])]
+    base = directos if solo_directos and directos else unicos
+    en = lambda h, b: (b[0] <= h < b[1]) if b[0] < b[1] else (h >= b[0] or h < b[1])
+    hora = lambda v, i: int(v["itineraries"][i]["segments"][0]["departure"]["at"][11:13])
+    filtrados = [v for v in base if en(hora(v, 0), bloque_ida) and en(hora(v, 1), bloque_vta)]
+    finales = sorted(filtrados or base, key=lambda v: float(v["price"]["total"]))
+    return [(v["itineraries"][0]["segments"][0]["departure"]["at"][11:16], float(v["price"]["total"])) for v in finales], bool(directos)
+
+
+def filtrar(ofertas, *args):
+    finales, hay_directos = filtrar_ofertas(TablaOfertas.desde_respuesta({"data": ofertas}), *args)
+    return [(f["salida_ida"], f["precio"]) for f in finales.filas()], hay_directos
+
+
+OFERTAS = [oferta(180, 7, 18), oferta(95, 22, 9, escalas_ida=1), oferta(180, 7, 18), oferta(120, 13, 16),
+           oferta(140, 8, 22, escalas_vta=2), oferta(95, 22, 9, escalas_ida=1), oferta(210, 23, 2)]
+
+
+def test_solo_directos_si_los_hay():
+    finales, hay_directos = filtrar(OFERTAS, True, TODO_EL_DIA, TODO_EL_DIA)
+    assert hay_directos and finales == [("13:15", 120.0), ("07:15", 180.0), ("23:15", 210.0)]
+    sin_directos = [oferta(95, 22, 9, escalas_ida=1), oferta(80, 6, 9, escalas_vta=1)]
+    assert filtrar(sin_directos, True, TODO_EL_DIA, TODO_EL_DIA) == ([("06:15", 80.0), ("22:15", 95.0)], False)
+
+
+def test_franjas_horarias_incluida_la_que_cruza_medianoche():
+    assert filtrar(OFERTAS, False, MAÑANA, TARDE)[0] == [("07:15", 180.0)]
+    assert filtrar(OFERTAS, False, NOCHE, TODO_EL_DIA)[0] == [("22:15", 95.0), ("23:15", 210.0)]
+
+
+def test_sin_nada_en_la_franja_se_ensenan_todas():
+    assert filtrar(OFERTAS, True, (3, 5), TODO_EL_DIA)[0] == [("13:15", 120.0), ("07:15", 180.0), ("23:15", 210.0)]
+
+
+def test_igual_que_el_recorrido_por_dicts():
+    bloques = [TODO_EL_DIA, MAÑANA, TARDE, NOCHE, (3, 5)]
+    for solo_directos, ida, vta in itertools.product((True, False), bloques, bloques):
+        assert filtrar(OFERTAS, solo_directos, ida, vta) == filtrar_como_antes(OFERTAS, solo_directos, ida, vta)
+
+
+def test_respuesta_vacia_o_fallida():
+    for res in (None, {}, {"data": []}):
+        tabla = TablaOfertas.desde_respuesta(res)
+        assert len(tabla) == 0 and len(filtrar_ofertas(tabla, True, TODO_EL_DIA, TODO_EL_DIA)[0]) == 0
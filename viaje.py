@@ -1,97 +1,48 @@
 import streamlit as st
-from amadeus import Client
-import google.generativeai as genai
-import os
 import urllib.parse
-from datetime import datetime, timedelta
-import calendar
-import time
-import pydeck as pdk
 import json
 import re
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
+from vuelos import LOW_COST, TablaOfertas, filtrar_ofertas
+import metricas
+import motor
+from anticipo import anticipar
+from motor import (BLOQUES_HORARIOS, MESES_FULL, CIUDAD, ROADTRIP, COCHE, Peticion, preguntar_ia_seguro, preguntar_ia_stream,
+                   preguntar_ia_paralelo, parsear_maleta, buscar_vuelos_amadeus_cache, calcular_fecha, pares_fechas_mes,
+                   buscar_calendario_precios, tabla_calendario, texto_diagnostico, diagnosticar, pedir_semaforo)
 
 # --- CONFIGURACIÓN E INICIALIZACIÓN ---
 load_dotenv()
 st.set_page_config(page_title="Travel Genius Pro 6.0 - Diamond Edition", layout="wide", page_icon="🌍")
-
-BLOQUES_HORARIOS = {
-    "Cualquier hora": (0, 24), "Mañana (06:00 - 12:00)": (6, 12),
-    "Mediodía (12:00 - 15:00)": (12, 15), "Tarde (15:00 - 21:00)": (15, 21),
-    "Noche (21:00 - 06:00)": (21, 6)
-}
-
-CIUDADES_TRADUCCION = {
-    'londres': 'LON', 'nueva york': 'NYC', 'roma': 'ROM', 
-    'paris': 'PAR', 'ginebra': 'GVA', 'berlin': 'BER', 
-    'tokio': 'TYO', 'milan': 'MIL', 'estambul': 'IST',
-    'madrid': 'MAD', 'barcelona': 'BCN', 'bilbao': 'BIO',
-    'lisboa': 'LIS', 'oporto': 'OPO', 'burdeos': 'BOD', 'tours': 'TUF'
-}
-
-@st.cache_resource
-def iniciar_servicios():
-    try:
-        am_client = Client(client_id=os.getenv("AMADEUS_KEY"), client_secret=os.getenv("AMADEUS_SECRET"))
-        genai.configure(api_key=os.getenv("GEMINI_KEY"))
-        modelo_disponible = next((m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods), "gemini-1.5-flash")
-        return am_client, genai.GenerativeModel(modelo_disponible)
-    except: return None, None
-
-amadeus, model = iniciar_servicios()
-
-# --- FUNCIONES NÚCLEO Y BUSCADOR IATA DINÁMICO ---
-@st.cache_data(show_spinner=False, ttl=3600)
-def preguntar_ia_seguro(prompt_texto):
-    if not model: return "⚠️ IA no disponible."
-    for i in range(3):
-        try:
-            time.sleep(3) # Respiración vital para no saturar la API gratuita
-            return model.generate_content(prompt_texto).text
-        except Exception as e:
-            if "429" in str(e).lower() or "quota" in str(e).lower():
-                st.warning(f"⏳ Google respirando para no saturarse. Reintentando en 20s... ({i+1}/3)")
-                time.sleep(20)
-                continue
-            return f"❌ Error: {str(e)}"
-    return "❌ Límite alcanzado. Cuota de IA agotada."
-
-@st.cache_data(show_spinner=False, ttl=86400)
-def obtener_iata_dinamico(ciudad):
-    if not ciudad: return "MAD"
-    ciudad_limpia = ciudad.strip().lower()
-    if ciudad_limpia in CIUDADES_TRADUCCION:
-        return CIUDADES_TRADUCCION[ciudad_limpia]
-        
-    prompt = f"Dime SOLO el código IATA de 3 letras del aeropuerto comercial más cercano a '{ciudad}'. Solo las 3 letras mayúsculas."
-    respuesta = preguntar_ia_seguro(prompt).strip().upper()
-    match = re.search(r'\b[A-Z]{3}\b', respuesta)
-    return match.group(0) if match else "MAD"
-
-@st.cache_data(show_spinner=False, ttl=3600)
-def buscar_vuelos_amadeus_cache(iata_o, iata_d, f_ida, f_vta, api_adults, api_children, api_infants):
-    try:
-        search_params = {
-            'originLocationCode': iata_o, 'destinationLocationCode': iata_d,
-            'departureDate': str(f_ida), 'returnDate': str(f_vta),
-            'adults': api_adults, 'max': 50
-        }
-        if api_children > 0: search_params['children'] = api_children
-        if api_infants > 0: search_params['infants'] = api_infants
-        return amadeus.shopping.flight_offers_search.get(**search_params)
-    except: return None
-
-def calcular_fecha(mes, dias, tipo, semana=1, inicio=10):
-    hoy = datetime.now()
-    año = hoy.year if mes >= hoy.month else hoy.year + 1
-    u = calendar.monthrange(año, mes)[1]
-    p = datetime(año, mes, 1)
-    if tipo == "puente":
-        j = (3 - p.weekday() + 7) % 7
-        ida = p + timedelta(days=j) + timedelta(weeks=(semana - 1))
-        if dias == 3: ida += timedelta(days=1)
-    else: ida = datetime(año, mes, min(inicio, u))
-    return ida.date(), (ida + timedelta(days=dias)).date()
+motor.avisar = st.warning # Los avisos de cuota salen en la sesión del hilo que espera
+metricas.servir() # /metrics y /config si hay TRAVELGENIUS_METRICAS_PUERTO (una vez por proceso)
+
+# --- FUNCIONES DE LA INTERFAZ ---
+def pintar_en_vivo(hueco, trozos, pintar=lambda hueco, texto: hueco.markdown(texto)):
+    """Va pintando en `hueco` el texto acumulado con un cursor y devuelve el texto final."""
+    texto = ""
+    for trozo in trozos:
+        texto += trozo
+        pintar(hueco, texto + " ▌")
+    pintar(hueco, texto)
+    return texto
+
+class SinRespuesta(Exception):
+    """Amadeus no contestó. Se lanza dentro de las funciones con st.cache_data para que no memoricen el fallo."""
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=64)
+@metricas.medido("vuelos")
+def tabla_vuelos(iata_o, iata_d, f_ida, f_vta, api_adults, api_children, api_infants):
+    """Ofertas ya parseadas en columnas: al cambiar un filtro no se vuelve a recorrer el JSON."""
+    res = buscar_vuelos_amadeus_cache(iata_o, iata_d, f_ida, f_vta, api_adults, api_children, api_infants)
+    if res is None: raise SinRespuesta(f"{iata_o} ➔ {iata_d}")
+    return TablaOfertas.desde_respuesta(res)
+
+def en_hilos_de_la_sesion():
+    """Inicializador para los hilos del motor: heredan la sesión para que la caché y los avisos funcionen."""
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(None, ctx)
 # --- BARRA LATERAL ---
 if 'busqueda_iniciada' not in st.session_state:
     st.session_state.busqueda_iniciada = False
@@ -109,12 +60,9 @@ def remove_parada():
 
 st.title("🌍 Travel Genius Pro: Roadtrip & Flights")
 
-MESES_FULL = [(1,"Enero"), (2,"Febrero"), (3,"Marzo"), (4,"Abril"), (5,"Mayo"), (6,"Junio"),
-              (7,"Julio"), (8,"Agosto"), (9,"Septiembre"), (10,"Octubre"), (11,"Noviembre"), (12,"Diciembre")]
-
 with st.sidebar:
     st.header("1. Perfil del Viaje")
-    tipo_viaje = st.radio("Modo de Inteligencia:", ["🏙️ Ciudad Única", "🚗 Roadtrip / Ruta"])
+    tipo_viaje = st.radio("Modo de Inteligencia:", [CIUDAD, ROADTRIP])
     
     c_orig = st.text_input("Origen:", "Bilbao")
     
@@ -122,7 +70,7 @@ with st.sidebar:
     modelo_coche = "N/A"
     estilo_conduccion = "N/A"
     
-    if tipo_viaje == "🏙️ Ciudad Única":
+    if tipo_viaje == CIUDAD:
         c_dest = st.text_input("Destino:", "")
         pref_trans = "Cualquiera"
         ritmo_ruta = "N/A"
@@ -145,10 +93,10 @@ with st.sidebar:
         c_btn2.button("➖ Quitar parada", on_click=remove_parada, use_container_width=True)
 
         st.markdown("---")
-        pref_trans = st.selectbox("Preferencia de Transporte:", ["🚗 Coche Propio / Alquiler", "🚆 Transporte Público"])
+        pref_trans = st.selectbox("Preferencia de Transporte:", [COCHE, "🚆 Transporte Público"])
         ritmo_ruta = st.select_slider("Ritmo:", options=["Relajado", "Equilibrado", "Intenso"], value="Equilibrado")
         
-        if pref_trans == "🚗 Coche Propio / Alquiler":
+        if pref_trans == COCHE:
             st.markdown("---")
             st.markdown("**⚙️ Detalles del Vehículo**")
             tipo_vehiculo = st.selectbox("Tipo:", ["🚗 Coche (Combustión/Híbrido)", "⚡ Coche Eléctrico (EV)", "🚐 Furgoneta Camper / Autocaravana"])
@@ -167,14 +115,6 @@ with st.sidebar:
         for i in range(num_ninos):
             with cols_edades[i]: edades_ninos.append(st.number_input(f"Edad {i+1}", 0, 17, 5, key=f"e_{i}"))
 
-    num_viajeros = num_adultos + len(edades_ninos)
-    grupo_texto = f"{num_adultos} adultos" + (f" y {len(edades_ninos)} niños" if edades_ninos else "")
-    if viaja_mascota: grupo_texto += " y 1 mascota"
-    
-    api_adults = num_adultos + sum(1 for e in edades_ninos if e >= 12)
-    api_children = sum(1 for e in edades_ninos if 2 <= e < 12)
-    api_infants = sum(1 for e in edades_ninos if e < 2)
-
     estilo_viaje = st.selectbox("🎒 Plan:", ["Solo/Mochilero", "Escapada Romántica", "Familia con Niños", "Grupo de Amigos/Fiesta"])
     
     st.header("2. Fechas")
@@ -204,156 +144,207 @@ with st.sidebar:
     if st.button("🚀 Planificar", type="primary"):
         if c_orig and c_dest:
             st.session_state.busqueda_iniciada = True
-            for k in ['mapa_gen', 'hoteles_gen', 'semaforo_vuelo', 'analisis_transporte', 'guia_p1', 'guia_p2', 'guia_p3', 'iata_origen', 'iata_destino', 'barrios_gen', 'coches_gen']:
+            for k in ['mapa_gen', 'hoteles_gen', 'semaforo_vuelo', 'analisis_transporte', 'diagnostico', 'guia_p1', 'guia_p2', 'guia_p3', 'barrios_gen', 'coches_gen']:
                 if k in st.session_state: del st.session_state[k]
         else:
             st.warning("⚠️ Por favor, rellena el Origen y al menos una Parada para comenzar.")
-# --- LÓGICA DE RESULTADOS ---
-if st.session_state.busqueda_iniciada and f_ida and c_orig and c_dest:
-    
-    # 🛡️ Bloqueo Bucle Origen (Ignora origen si es el primer destino)
-    destinos_lista = [c.strip() for c in c_dest.split(',')]
-    if tipo_viaje == "🚗 Roadtrip / Ruta" and len(destinos_lista) > 1 and destinos_lista[0].lower() == c_orig.lower():
-        ciudad_1 = destinos_lista[1]
+# --- PANELES DE RESULTADOS ---
+# Cada panel es un fragmento: un widget de dentro (página de vuelos, presupuesto, casillas de la maleta...)
+# solo vuelve a ejecutar su panel, no la barra lateral ni los demás paneles.
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=256)
+def vuelos_filtrados(iata_o, iata_d, f_ida, f_vta, pasajeros, solo_directos, pref_ida, pref_vta):
+    """(ofertas totales, precio más barato sin filtrar, tabla filtrada y ordenada, hay_directos): al volver al panel no se repite el filtrado."""
+    ofertas = tabla_vuelos(iata_o, iata_d, f_ida, f_vta, *pasajeros)
+    v_finales, hay_directos = filtrar_ofertas(ofertas, solo_directos, BLOQUES_HORARIOS[pref_ida], BLOQUES_HORARIOS[pref_vta])
+    return len(ofertas), float(ofertas.precio.min()) if len(ofertas) else None, v_finales, hay_directos
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def mapa_deck(pts_json, roadtrip):
+    """Deck de pydeck ya montado para unos puntos: reabrir el panel no reconstruye las capas."""
+    import pydeck as pdk # Solo se carga si de verdad hay mapa que pintar
+    pts = json.loads(pts_json)
+
+    lat_c = sum(p['lat'] for p in pts)/len(pts)
+    lon_c = sum(p['lon'] for p in pts)/len(pts)
+
+    capas = []
+    if roadtrip:
+        ruta_coords = [[p['lon'], p['lat']] for p in pts]
+        capas.append(pdk.Layer("PathLayer", data=[{"path": ruta_coords}], get_path="path", get_color=[255, 50, 50, 255], width_scale=20, width_min_pixels=5, pickable=True))
+        capas.append(pdk.Layer("ScatterplotLayer", data=pts, get_position=["lon", "lat"], get_fill_color=[255, 200, 0, 255], get_radius=5000, pickable=True))
+        leyenda = "🔴 *Trazado de tu Roadtrip*"
+        zoom_inicial = 5
     else:
-        ciudad_1 = destinos_lista[0]
-        
-    st.write("---")
-    
-    # 🧠 PASO 0: OBTENER IATAS DINÁMICOS Y DIAGNÓSTICO
-    if 'iata_origen' not in st.session_state:
-        with st.spinner("Mapeando aeropuertos más cercanos con IA..."):
-            st.session_state.iata_origen = obtener_iata_dinamico(c_orig)
-            st.session_state.iata_destino = obtener_iata_dinamico(ciudad_1)
-
-    if 'analisis_transporte' not in st.session_state:
-        with st.spinner("Analizando logística del primer salto..."):
-            prompt_dist = f"""Actúa como experto en logística. Origen: '{c_orig}'. Primera parada: '{ciudad_1}'.
-            Analiza SOLO la viabilidad de llegar de '{c_orig}' a '{ciudad_1}'.
-            - Si es corto (<600km) o cómodo en coche/tren de una tirada, responde 'VUELOS_NO' y explica.
-            - Si está lejos (>600km) o país lejano, responde 'VUELOS_SI' y explica que es mejor volar.
-            Responde empezando con la palabra clave."""
-            st.session_state.analisis_transporte = preguntar_ia_seguro(prompt_dist)
-
+        for p in pts:
+            t = p.get('tipo', '')
+            if t == 'naturaleza': p['color'] = [50, 200, 50, 200]
+            elif t == 'cultura': p['color'] = [50, 100, 255, 200]
+            else: p['color'] = [255, 75, 75, 200]
+        capas.append(pdk.Layer("ScatterplotLayer", data=pts, get_position=["lon", "lat"], get_fill_color="color", get_radius=180, pickable=True))
+        leyenda = "🔴 *Monumentos* | 🟢 *Naturaleza* | 🔵 *Cultura*"
+        zoom_inicial = 12
+
+    deck = pdk.Deck(map_style="mapbox://styles/mapbox/light-v9", initial_view_state=pdk.ViewState(latitude=lat_c, longitude=lon_c, zoom=zoom_inicial, pitch=45), layers=capas, tooltip={"text": "{nombre}"})
+    return deck, leyenda
+
+@st.fragment
+def panel_diagnostico(peticion, diag):
     st.subheader("🏁 Diagnóstico de Salida")
-    st.info(st.session_state.analisis_transporte)
+    st.info(texto_diagnostico(diag["tramos"]))
+    hueco_analisis = st.empty()
+    if diag["analisis"] or 'analisis_transporte' in st.session_state:
+        hueco_analisis.markdown(diag["analisis"] or st.session_state.analisis_transporte)
+    elif st.button("🧠 Explicación del experto"):
+        st.session_state.analisis_transporte = pintar_en_vivo(hueco_analisis, preguntar_ia_stream(motor.prompt_explicacion(peticion, diag["tramos"])))
+
+@st.fragment
+def panel_vuelos(peticion, diag, mes_calendario):
+    """`mes_calendario` es (mes, 'puente' o 'flexible') en los modos de mes y None con fechas exactas."""
+    hay_vuelo, iata_origen, iata_destino = diag["vuelos"], diag["iata_origen"], diag["iata_destino"]
+    num_viajeros = peticion.num_viajeros
+    if hay_vuelo and not (iata_origen and iata_destino):
+        sin_iata = peticion.origen if not iata_origen else peticion.ciudad_1
+        st.error(f"❌ No encuentro un aeropuerto para '{sin_iata}'. Prueba con el nombre de una ciudad cercana.")
+    elif hay_vuelo:
+        st.subheader(f"🛫 Vuelos: {iata_origen} ➔ {iata_destino}")
+
+        if mes_calendario and st.toggle("📅 Calendario de precios del mes"):
+            mes_cal, tipo_cal = mes_calendario
+            clave_cal = (iata_origen, iata_destino, mes_cal, peticion.num_dias, tipo_cal, *peticion.pasajeros_api)
+            if st.session_state.get('calendario_clave') != clave_cal:
+                pares = pares_fechas_mes(mes_cal, peticion.num_dias, tipo_cal)
+                with st.spinner(f"Comparando {len(pares)} combinaciones de fechas..."):
+                    st.session_state.calendario_precios = buscar_calendario_precios(iata_origen, iata_destino, pares, *peticion.pasajeros_api)
+                    st.session_state.calendario_tabla = tabla_calendario(st.session_state.calendario_precios)
+                    st.session_state.calendario_clave = clave_cal
+            tabla_cal, mejor_par = st.session_state.calendario_tabla
+            st.markdown(tabla_cal)
+            if mejor_par:
+                p_mejor = st.session_state.calendario_precios[mejor_par]
+                st.success(f"🏆 Salida más barata: {mejor_par[0]:%d/%m} ➔ {mejor_par[1]:%d/%m} por {p_mejor:.2f}€ ({p_mejor/num_viajeros:.2f}€/pax)")
+            else: st.warning("⚠️ Amadeus no devuelve vuelos para ninguna fecha de este mes.")
 
-    col_v, col_h = st.columns([1.1, 0.9])
-    
-    with col_v:
-        if "VUELOS_SI" in st.session_state.analisis_transporte:
-            st.subheader(f"🛫 Vuelos: {st.session_state.iata_origen} ➔ {st.session_state.iata_destino}")
-            res = buscar_vuelos_amadeus_cache(st.session_state.iata_origen, st.session_state.iata_destino, f_ida, f_vta, api_adults, api_children, api_infants)
-            
-            if res and res.data:
-                carriers = res.result.get('dictionaries', {}).get('carriers', {})
-                v_vistos, v_unicos = set(), []
-                for v in res.data:
-                    huella = (v['itineraries'][0]['segments'][0]['departure']['at'], v['price']['total'])
-                    if huella not in v_vistos:
-                        v_vistos.add(huella)
-                        v_unicos.append(v)
-                
-                v_directos = [v for v in v_unicos if all(len(it['segments'])==1 for it in v['itineraries'])]
-                
-                if solo_d:
-                    if v_directos:
-                        st.success("✅ Vuelos directos encontrados.")
-                        v_base = v_directos
-                    else:
-                        st.warning("⚠️ No hay vuelos directos disponibles para estas fechas. Mostrando opciones con escala:")
-                        v_base = v_unicos
-                else:
-                    v_base = v_unicos
-
-                v_filtrados = []
-                for v in v_base:
-                    h_ida = int(v['itineraries'][0]['segments'][0]['departure']['at'][11:13])
-                    h_vta = int(v['itineraries'][1]['segments'][0]['departure']['at'][11:13])
-                    s_ida, e_ida = BLOQUES_HORARIOS[pref_ida]
-                    ida_ok = (s_ida <= h_ida < e_ida) if s_ida < e_ida else (h_ida >= s_ida or h_ida < e_ida)
-                    s_vta, e_vta = BLOQUES_HORARIOS[pref_vta]
-                    vta_ok = (s_vta <= h_vta < e_vta) if s_vta < e_vta else (h_vta >= s_vta or h_vta < e_vta)
-                    if ida_ok and vta_ok: v_filtrados.append(v)
-
-                v_finales = v_filtrados if v_filtrados else v_base
-
-                if v_finales and 'semaforo_vuelo' not in st.session_state:
-                    mejor_p = float(v_finales[0]['price']['total']) / num_viajeros
-                    st.session_state.semaforo_vuelo = preguntar_ia_seguro(f"Vuelo de {st.session_state.iata_origen} a {st.session_state.iata_destino} en {f_ida.month} por {mejor_p:.2f}€/pax. Responde: 🟢 Chollo, 🟡 Normal o 🔴 Caro.")
-                if 'semaforo_vuelo' in st.session_state: st.info(f"**Semáforo IA:** {st.session_state.semaforo_vuelo}")
-
-                for v in v_finales[:10]:
-                    precio_t = float(v['price']['total'])
-                    carrier = v['validatingAirlineCodes'][0]
-                    nombre_a = carriers.get(carrier, carrier)
-                    it_i, it_v = v['itineraries'][0]['segments'], v['itineraries'][1]['segments']
-                    o_iata, d_iata = it_i[0]['departure']['iataCode'], it_i[-1]['arrival']['iataCode']
-                    try: bags = v['travelerPricings'][0]['fareDetailsBySegment'][0].get('includedCheckedBags', {}).get('quantity', 0)
-                    except: bags = 0
-
-                    with st.expander(f"💰 {precio_t:.2f}€ Total ({precio_t/num_viajeros:.2f}€/pax) | {nombre_a}"):
-                        c1, c2, c3 = st.columns(3)
-                        with c1:
-                            st.write(f"🛫 **Ida:** {it_i[0]['departure']['at'][11:16]} ({o_iata})")
-                            st.write(f"🛬 **Vta:** {it_v[0]['departure']['at'][11:16]} ({it_v[0]['departure']['iataCode']})")
-                        with c2:
-                            st.write(f"🎒 Mano: {'✅' if bags > 0 or carrier not in ['FR', 'VY', 'U2', 'W6'] else '❌'}")
-                            st.write(f"🧳 Facturada: {'✅' if bags > 0 else '❌'} ({bags})")
-                        with c3:
-                            st.markdown(f"[🛒 Google Flights](https://www.google.es/travel/flights?q=Flights%20from%20{st.session_state.iata_origen}%20to%20{st.session_state.iata_destino})")
-            else: 
-                st.error("❌ No hay vuelos en Amadeus para estas fechas exactas.")
+        try:
+            n_ofertas, mas_barato, v_finales, hay_directos = vuelos_filtrados(iata_origen, iata_destino, peticion.f_ida, peticion.f_vta, peticion.pasajeros_api,
+                                                                              peticion.solo_directos, peticion.pref_ida, peticion.pref_vta)
+        except SinRespuesta:
+            st.error("❌ Amadeus no responde ahora mismo. Vuelve a pulsar Planificar en un rato.")
+            return
+
+        if n_ofertas:
+            if peticion.solo_directos:
+                if hay_directos: st.success("✅ Vuelos directos encontrados.")
+                else: st.warning("⚠️ No hay vuelos directos disponibles para estas fechas. Mostrando opciones con escala:")
+
+            if 'semaforo_vuelo' not in st.session_state: # Con lo más barato sin filtrar, como el histórico
+                st.session_state.semaforo_vuelo = pedir_semaforo(peticion, diag, mas_barato / num_viajeros)
+            if 'semaforo_vuelo' in st.session_state: st.info(f"**Semáforo:** {st.session_state.semaforo_vuelo}")
+
+            n_paginas = -(-len(v_finales) // 10)
+            pagina = st.number_input(f"Página (de {n_paginas}, {len(v_finales)} vuelos):", 1, n_paginas, 1, key=f"pagina_{len(v_finales)}_{v_finales.huella[0]}") if n_paginas > 1 else 1
+            for v in v_finales.pagina(pagina).filas():
+                precio_t, carrier, bags = v['precio'], v['aerolinea'], v['maletas']
+                with st.expander(f"💰 {precio_t:.2f}€ Total ({precio_t/num_viajeros:.2f}€/pax) | {v['nombre_aerolinea']}"):
+                    c1, c2, c3 = st.columns(3)
+                    with c1:
+                        st.write(f"🛫 **Ida:** {v['salida_ida']} ({v['origen']})")
+                        st.write(f"🛬 **Vta:** {v['salida_vta']} ({v['origen_vta']})")
+                    with c2:
+                        st.write(f"🎒 Mano: {'✅' if bags > 0 or carrier not in LOW_COST else '❌'}")
+                        st.write(f"🧳 Facturada: {'✅' if bags > 0 else '❌'} ({bags})")
+                    with c3:
+                        st.markdown(f"[🛒 Google Flights](https://www.google.es/travel/flights?q=Flights%20from%20{iata_origen}%20to%20{iata_destino})")
+        else:
+            st.error("❌ No hay vuelos en Amadeus para estas fechas exactas.")
+    else:
+        st.success(f"🚙 Es más inteligente ir de {peticion.origen} a {peticion.ciudad_1} por tierra. Vuelos ocultos.")
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=64)
+def vuelos_tramos(peticion, puntos):
+    res = motor.vuelos_por_tramos(peticion, puntos)
+    if any(t["sin_respuesta"] for t in res["tramos"]): raise SinRespuesta(res) # Se enseña, pero sin memorizar
+    return res
+
+@st.fragment
+def panel_tramos(peticion, diag):
+    """Roadtrip: el vuelo más barato de cada salto que pide avión, con el total."""
+    if not any(t.volar for t in motor.tramos_viaje(peticion, diag["puntos"])[1:]): return # El primer salto ya tiene su panel de ida y vuelta
+    with st.spinner("Buscando vuelos de todos los tramos a la vez..."):
+        try: res = vuelos_tramos(peticion, diag["puntos"])
+        except SinRespuesta as e: res = e.args[0]
+    en_avion = [t for t in res["tramos"] if t["volar"]]
+
+    st.subheader("🧭 Vuelos por tramos")
+    filas = ["| Tramo | Salida | Distancia | Mejor vuelo | Precio |", "|---|---|---|---|---|"]
+    for t in res["tramos"]:
+        tramo = f"{t['origen']} ➔ {t['destino']}"
+        distancia = f"{t['km']:,.0f} km".replace(",", ".") if t["km"] is not None else "—"
+        if not t["volar"]: filas.append(f"| {tramo} | {t['fecha']} | {distancia} | 🚗 Por tierra | — |")
+        elif not (t["iata_origen"] and t["iata_destino"]): filas.append(f"| {tramo} | {t['fecha']} | {distancia} | ❌ Sin aeropuerto | — |")
+        elif t["sin_respuesta"]: filas.append(f"| {tramo} | {t['fecha']} | {distancia} | ⚠️ Amadeus no responde ({t['iata_origen']} ➔ {t['iata_destino']}) | — |")
+        elif not t["ofertas"]: filas.append(f"| {tramo} | {t['fecha']} | {distancia} | ❌ Sin vuelos ({t['iata_origen']} ➔ {t['iata_destino']}) | — |")
+        else:
+            v = t["ofertas"][0]
+            escalas = "directo" if v["escalas_ida"] == 0 else f"{v['escalas_ida']} escala(s)"
+            filas.append(f"| {tramo} | {t['fecha']} {v['salida_ida']} | {distancia} | {v['nombre_aerolinea']} {t['iata_origen']} ➔ {t['iata_destino']}, {escalas} | {v['precio']:.2f}€ |")
+    st.markdown("\n".join(filas))
+    st.success(f"💶 Total en vuelos: {res['total']:.2f}€ ({res['total']/peticion.num_viajeros:.2f}€/pax)")
+    if not res["completo"]: st.warning("⚠️ Algún tramo en avión no tiene vuelos: el total está incompleto.")
+    for t in en_avion:
+        if len(t["ofertas"]) < 2: continue
+        with st.expander(f"🛫 Alternativas {t['origen']} ➔ {t['destino']}"):
+            for v in t["ofertas"]:
+                st.write(f"💰 {v['precio']:.2f}€ | {v['nombre_aerolinea']} | {v['salida_ida']} ({v['origen']} ➔ {v['destino']})")
+
+@st.fragment
+def panel_alojamiento(peticion):
+    st.subheader("🏨 Conserje de Alojamiento")
+    h_ubicacion = st.radio("Ubicación Preferida:", ["📍 Centro", "🚶 Zona Intermedia", "🚇 Periferia"], horizontal=True)
+
+    pedir_barrios = st.button("🗺️ Recomendar Barrios")
+    hueco_barrios = st.empty()
+    if pedir_barrios:
+        st.session_state.barrios_gen = pintar_en_vivo(hueco_barrios, preguntar_ia_stream(motor.prompt_barrios(peticion, h_ubicacion)), lambda hueco, texto: hueco.info(texto))
+    elif 'barrios_gen' in st.session_state: hueco_barrios.info(st.session_state.barrios_gen)
+
+    st.markdown("---")
+    c_h1, c_h2 = st.columns(2)
+    with c_h1: h_tipo = st.selectbox("Tipo:", ["Hotel", "Apartamento", "Hostal"])
+    with c_h2: h_presupuesto = st.slider("Presupuesto Max/noche (€):", 50, 1000, 150)
+    h_barrio_manual = st.text_input("Barrio específico (Opcional):")
+
+    pedir_hoteles = st.button("🪄 Buscar Alojamientos Ideales")
+    hueco_hoteles = st.empty()
+    if pedir_hoteles:
+        zona_texto = f"en el barrio de {h_barrio_manual}" if h_barrio_manual else f"en la zona {h_ubicacion}"
+        st.session_state.hoteles_gen = pintar_en_vivo(hueco_hoteles, preguntar_ia_stream(motor.prompt_hoteles(peticion, h_tipo, zona_texto, h_presupuesto)))
+
+    if 'hoteles_gen' in st.session_state:
+        if not pedir_hoteles: hueco_hoteles.markdown(st.session_state.hoteles_gen)
+        ciudades_rutas = list(peticion.destinos)
+        for ciud in ciudades_rutas:
+            termino_busqueda = f"{h_barrio_manual} {ciud} {'pet friendly' if peticion.mascota else ''}" if h_barrio_manual else f"{h_ubicacion.replace('📍', '').replace('🚶', '').replace('🚇', '').strip()} {ciud} {'pet friendly' if peticion.mascota else ''}"
+            dest_url = urllib.parse.quote(termino_busqueda)
+            with st.expander(f"🛒 Ver opciones en {ciud}"):
+                c_b1, c_b2, c_b3 = st.columns(3)
+                c_b1.markdown(f'<a href="https://www.booking.com/searchresults.html?ss={dest_url}" target="_blank"><button style="width:100%; background-color:#003580; color:white; border:none; padding:8px; border-radius:5px;">Booking</button></a>', unsafe_allow_html=True)
+                c_b2.markdown(f'<a href="https://www.airbnb.es/s/{dest_url}/homes" target="_blank"><button style="width:100%; background-color:#FF5A5F; color:white; border:none; padding:8px; border-radius:5px;">Airbnb</button></a>', unsafe_allow_html=True)
+                c_b3.markdown(f'<a href="https://es.hotels.com/Hotel-Search?destination={dest_url}" target="_blank"><button style="width:100%; background-color:#D32F2F; color:white; border:none; padding:8px; border-radius:5px;">Hotels</button></a>', unsafe_allow_html=True)
+
+@st.fragment
+def panel_mapa(peticion, diag):
+    st.subheader(f"📍 Mapa Interactivo")
+    if st.button("🌍 Generar Mapa / Ruta"):
+        if peticion.tipo == ROADTRIP:
+            puntos = diag["puntos"]
+            pts = [{"nombre": p, "lat": puntos[p][0], "lon": puntos[p][1]} for p in peticion.paradas if puntos.get(p)]
+            sin_coords = [p for p in peticion.paradas if not puntos.get(p)]
+            if sin_coords: st.warning(f"⚠️ No he encontrado en el mapa: {', '.join(sin_coords)}")
+            st.session_state.mapa_gen = pts
         else:
-            st.success(f"🚙 Es más inteligente ir de {c_orig} a {ciudad_1} por tierra. Vuelos ocultos.")
-
-    with col_h:
-        st.subheader("🏨 Conserje de Alojamiento")
-        h_ubicacion = st.radio("Ubicación Preferida:", ["📍 Centro", "🚶 Zona Intermedia", "🚇 Periferia"], horizontal=True)
-        
-        pet_text = " MUY IMPORTANTE: Busca opciones 'Pet Friendly' que admitan mascotas." if viaja_mascota else ""
-
-        if st.button("🗺️ Recomendar Barrios"):
-            prompt_b = f"3 barrios en {c_dest} para {grupo_texto}. Zonas tipo '{h_ubicacion}'. {pet_text}" if tipo_viaje == "🏙️ Ciudad Única" else f"Para la ruta '{c_dest}', dime 1 zona ideal (tipo '{h_ubicacion}') en CADA parada para {grupo_texto}. {pet_text}"
-            st.session_state.barrios_gen = preguntar_ia_seguro(prompt_b)
-            
-        if 'barrios_gen' in st.session_state: st.info(st.session_state.barrios_gen)
-
-        st.markdown("---")
-        c_h1, c_h2 = st.columns(2)
-        with c_h1: h_tipo = st.selectbox("Tipo:", ["Hotel", "Apartamento", "Hostal"])
-        with c_h2: h_presupuesto = st.slider("Presupuesto Max/noche (€):", 50, 1000, 150)
-        h_barrio_manual = st.text_input("Barrio específico (Opcional):")
-
-        if st.button("🪄 Buscar Alojamientos Ideales"):
-            zona_texto = f"en el barrio de {h_barrio_manual}" if h_barrio_manual else f"en la zona {h_ubicacion}"
-            prompt_hoteles = f"Conserje para {c_dest}. Busco {h_tipo} {zona_texto} para {grupo_texto}. Plan {estilo_viaje}. Max {h_presupuesto}€. {pet_text}" if tipo_viaje == "🏙️ Ciudad Única" else f"Recomienda 1 {h_tipo} {zona_texto} para CADA parada de la ruta {c_dest}. Grupo: {grupo_texto}. Max {h_presupuesto}€. {pet_text}"
-            st.session_state.hoteles_gen = preguntar_ia_seguro(prompt_hoteles)
-        
-        if 'hoteles_gen' in st.session_state:
-            st.markdown(st.session_state.hoteles_gen)
-            ciudades_rutas = [c_dest] if tipo_viaje == "🏙️ Ciudad Única" else [c.strip() for c in c_dest.split(',')]
-            for ciud in ciudades_rutas:
-                termino_busqueda = f"{h_barrio_manual} {ciud} {'pet friendly' if viaja_mascota else ''}" if h_barrio_manual else f"{h_ubicacion.replace('📍', '').replace('🚶', '').replace('🚇', '').strip()} {ciud} {'pet friendly' if viaja_mascota else ''}"
-                dest_url = urllib.parse.quote(termino_busqueda)
-                with st.expander(f"🛒 Ver opciones en {ciud}"):
-                    c_b1, c_b2, c_b3 = st.columns(3)
-                    c_b1.markdown(f'<a href="https://www.booking.com/searchresults.html?ss={dest_url}" target="_blank"><button style="width:100%; background-color:#003580; color:white; border:none; padding:8px; border-radius:5px;">Booking</button></a>', unsafe_allow_html=True)
-                    c_b2.markdown(f'<a href="https://www.airbnb.es/s/{dest_url}/homes" target="_blank"><button style="width:100%; background-color:#FF5A5F; color:white; border:none; padding:8px; border-radius:5px;">Airbnb</button></a>', unsafe_allow_html=True)
-                    c_b3.markdown(f'<a href="https://es.hotels.com/Hotel-Search?destination={dest_url}" target="_blank"><button style="width:100%; background-color:#D32F2F; color:white; border:none; padding:8px; border-radius:5px;">Hotels</button></a>', unsafe_allow_html=True)
-# --- MAPA Y GUÍA ---
-    st.divider()
-    cm, cg = st.columns([0.4, 0.6])
-    with cm:
-        st.subheader(f"📍 Mapa Interactivo")
-        if st.button("🌍 Generar Mapa / Ruta"):
             with st.spinner("Trazando coordenadas..."):
-                if tipo_viaje == "🚗 Roadtrip / Ruta":
-                    prompt_mapa = f"Dame las coordenadas exactas de esta ruta en orden: {c_orig}, {c_dest}. SOLO devuelve un array JSON estricto con keys: nombre, lat, lon. Ejemplo: [{{\"nombre\":\"Bilbao\", \"lat\":43.26, \"lon\":-2.93}}]"
-                else:
-                    prompt_mapa = f"Identifica 15 puntos imperdibles de {c_dest}. Clasifica en 'monumento', 'naturaleza' o 'cultura'. SOLO devuelve JSON: [{{'nombre':'...','lat':0.0,'lon':0.0,'tipo':'monumento'}}]"
-                
-                res_m = preguntar_ia_seguro(prompt_mapa)
+                res_m = preguntar_ia_seguro(motor.prompt_mapa(peticion))
+
                 try:
                     match = re.search(r'\[.*\]', res_m, re.DOTALL)
                     if match:
@@ -364,115 +355,71 @@ if st.session_state.busqueda_iniciada and f_ida and c_orig and c_dest:
                 except Exception as e:
                     st.error("❌ Error procesando el mapa.")
 
-        if 'mapa_gen' in st.session_state and isinstance(st.session_state.mapa_gen, list) and st.session_state.mapa_gen:
-            pts = st.session_state.mapa_gen
-            lat_c = sum(p['lat'] for p in pts)/len(pts)
-            lon_c = sum(p['lon'] for p in pts)/len(pts)
-            
-            capas = []
-            if tipo_viaje == "🚗 Roadtrip / Ruta":
-                ruta_coords = [[p['lon'], p['lat']] for p in pts]
-                capas.append(pdk.Layer("PathLayer", data=[{"path": ruta_coords}], get_path="path", get_color=[255, 50, 50, 255], width_scale=20, width_min_pixels=5, pickable=True))
-                capas.append(pdk.Layer("ScatterplotLayer", data=pts, get_position=["lon", "lat"], get_fill_color=[255, 200, 0, 255], get_radius=5000, pickable=True))
-                st.markdown("🔴 *Trazado de tu Roadtrip*")
-                zoom_inicial = 5 
-            else:
-                for p in pts:
-                    t = p.get('tipo', '')
-                    if t == 'naturaleza': p['color'] = [50, 200, 50, 200]
-                    elif t == 'cultura': p['color'] = [50, 100, 255, 200]
-                    else: p['color'] = [255, 75, 75, 200]
-                capas.append(pdk.Layer("ScatterplotLayer", data=pts, get_position=["lon", "lat"], get_fill_color="color", get_radius=180, pickable=True))
-                st.markdown("🔴 *Monumentos* | 🟢 *Naturaleza* | 🔵 *Cultura*")
-                zoom_inicial = 12
-
-            st.pydeck_chart(pdk.Deck(map_style="mapbox://styles/mapbox/light-v9", initial_view_state=pdk.ViewState(latitude=lat_c, longitude=lon_c, zoom=zoom_inicial, pitch=45), layers=capas, tooltip={"text": "{nombre}"}))
-
-    with cg:
-        st.subheader("👑 Guía Maestra de Viaje")
-        if st.button("📝 Generar Itinerario y Logística"):
-            with st.spinner("Construyendo el cerebro del viaje..."):
-                mes_n = MESES_FULL[f_ida.month-1][1]
-                niños_str = "con áreas verdes o parques infantiles para los niños" if viajan_ninos else "para descansar y tomar algo"
-                pet_str = "Menciona parques donde soltar al perro en las ciudades." if viaja_mascota else ""
-                
-                # --- PROMPT 1: ITINERARIO ---
-                if tipo_viaje == "🏙️ Ciudad Única":
-                    p1_c = f"Actúa como guía de {c_dest}. Itinerario de {num_dias} días para {grupo_texto}. Plan: {estilo_viaje}. {pet_str}"
-                else:
-                    detalles_motor = f"Vehículo: {tipo_vehiculo} (Modelo: {modelo_coche}). Ruta: {estilo_conduccion}." if pref_trans == "🚗 Coche Propio / Alquiler" else ""
-                    p1_c = f"Experto en Roadtrips. Ruta: {c_orig}, {c_dest}. Días: {num_dias}. Grupo: {grupo_texto}. {detalles_motor}. {pet_str}"
-
-                p1 = p1_c + """
-                Usa Markdown.
-                ### 🔗 El Enlace Maestro
-                Al principio del itinerario, genera un ÚNICO enlace de Google Maps que contenga todas las paradas de la ruta.
-                
-                ### 🌟 Desvíos Genius y Paradas Tácticas
-                - Si hay alguna joya oculta cerca de la ruta, recomiéndalo como 'Desvío Genius'.
-                """
-                if tipo_viaje == "🚗 Roadtrip / Ruta":
-                    p1 += f"- Para los tramos largos de conducción (>3 horas), recomienda una 'Parada Táctica' exacta a mitad de camino {niños_str}.\n"
-                
-                if pref_trans == "🚗 Coche Propio / Alquiler" and tipo_viaje != "🏙️ Ciudad Única":
-                    p1 += """
-                ### 🅿️ Estrategia de Aparcamiento
-                Recomienda en cada ciudad:
-                1. Parking P+R (Aparca y Viaja) a las afueras.
-                2. Parking VIP/Céntrico para ahorrar tiempo.
-                """
-                    if "Furgoneta" in tipo_vehiculo or "Autocaravana" in tipo_vehiculo:
-                        p1 += "3. 🚐 'Spots' legales o campings para dormir con camper.\n"
-                
-                p1 += """
-                ### 🎧 Entretenimiento
-                3 canciones y 1 temática de podcast histórica de la zona.
-                ### 🍽️ Restaurantes
-                5 Económicos, 5 Calidad-Precio, 5 Premium.
-                """
-                st.session_state.guia_p1 = preguntar_ia_seguro(p1)
-                
-                # --- PROMPT 2: LOGÍSTICA ---
-                p2 = f"Experto logístico para {grupo_texto} a {c_dest} en {mes_n}.\n"
-                if pref_trans == "🚗 Coche Propio / Alquiler" and tipo_viaje != "🏙️ Ciudad Única":
-                    p2 += f"""
-                ### ⛽ Matemáticas y Tiempos de Carretera
-                Crea una tabla en Markdown con las distancias y tiempos de conducción de CADA tramo del viaje (Ej: Tramo 1: Bilbao -> Burdeos | 330km | 3h 15m).
-                Haz un cálculo del Gasto de Combustible (Modelo: {modelo_coche}) y Coste de PEAJES totales.
-                Si es EV, evalúa la red de recarga.
-                
-                ### 👮 Leyes y Fronteras
-                Menciona ZTLs, viñetas de peaje o normativas de los países.
-                
-                ### 🧰 Chuleta de Emergencia
-                Tabla con 5 frases traducidas al idioma local: Pinchazo, Grúa, Gasolina/Carga, Baño, Accidente.
-                """
-                
-                if viaja_mascota:
-                    p2 += "### 🐶 Pasaporte Perruno\nNormativas legales para cruzar a estos países con mascota (pasaporte, vacunas).\n"
-                
-                p2 += """
-                ### 🚇 Movilidad y Presupuesto
-                Abonos de transporte recomendados y Presupuesto total estimado.
-                ### 🧻 Supervivencia Urbana
-                Enchufe, Baños Públicos, Supermercados, Farmacias.
-                """
-                st.session_state.guia_p2 = preguntar_ia_seguro(p2)
-                
-                p3 = f"Viajan {grupo_texto} a {c_dest} en {mes_n}. 10-12 objetos para maleta. SOLO array JSON de strings."
-                res_maleta = preguntar_ia_seguro(p3)
-                try: st.session_state.guia_p3 = json.loads(re.search(r'\[.*\]', res_maleta, re.DOTALL).group())
-                except: st.session_state.guia_p3 = ["Documentación", "Cargador", "Botiquín", "Gafas de sol"]
-
-        if 'guia_p1' in st.session_state and 'guia_p2' in st.session_state:
-            tab1, tab2, tab3 = st.tabs(["🗺️ Itinerario & Secretos", "🚇 Logística & Motor", "🎒 Equipaje"])
-            with tab1: st.markdown(st.session_state.guia_p1)
-            with tab2: st.markdown(st.session_state.guia_p2)
-            with tab3:
-                for item in st.session_state.guia_p3: st.checkbox(item, key=item)
-            
-            st.divider()
-            texto_descarga = st.session_state.guia_p1 + "\n\n---\n\n" + st.session_state.guia_p2
-            st.download_button("⬇️ Descargar Guía del Viaje", texto_descarga, "Guia_Roadtrip.md", type="primary")                                
+    if 'mapa_gen' in st.session_state and isinstance(st.session_state.mapa_gen, list) and st.session_state.mapa_gen:
+        deck, leyenda = mapa_deck(json.dumps(st.session_state.mapa_gen, sort_keys=True), peticion.tipo == ROADTRIP)
+        st.markdown(leyenda)
+        st.pydeck_chart(deck)
+
+@st.fragment
+def panel_guia(peticion):
+    st.subheader("👑 Guía Maestra de Viaje")
+    generar_guia = st.button("📝 Generar Itinerario y Logística")
+    if generar_guia or ('guia_p1' in st.session_state and 'guia_p2' in st.session_state):
+        tab1, tab2, tab3 = st.tabs(["🗺️ Itinerario & Secretos", "🚇 Logística & Motor", "🎒 Equipaje"])
+        huecos = {'guia_p1': tab1.empty(), 'guia_p2': tab2.empty(), 'guia_p3': tab3.empty()}
+
+        def pintar_guia(clave):
+            if clave == 'guia_p3':
+                with huecos[clave].container():
+                    for item in st.session_state.guia_p3: st.checkbox(item, key=item)
+            else: huecos[clave].markdown(st.session_state[clave])
+
+        if generar_guia:
+            # ⚡ Los tres prompts son independientes: se piden a la vez y las guías largas se van escribiendo en vivo
+            for hueco in huecos.values(): hueco.info("⏳ Construyendo el cerebro del viaje...")
+            with metricas.medir("guia"):
+                for clave, texto, terminado in preguntar_ia_paralelo(motor.prompts_guia(peticion), en_vivo=('guia_p1', 'guia_p2'), inicializar_hilo=en_hilos_de_la_sesion()):
+                    if not terminado:
+                        huecos[clave].markdown(texto + " ▌")
+                        continue
+                    st.session_state[clave] = parsear_maleta(texto) if clave == 'guia_p3' else texto
+                    pintar_guia(clave)
+        else:
+            for clave in huecos: pintar_guia(clave)
 
+        st.divider()
+        texto_descarga = st.session_state.guia_p1 + "\n\n---\n\n" + st.session_state.guia_p2
+        st.download_button("⬇️ Descargar Guía del Viaje", texto_descarga, "Guia_Roadtrip.md", type="primary")
 
+# --- LÓGICA DE RESULTADOS ---
+if f_ida and c_orig and c_dest:
+    peticion = Peticion(c_orig, tuple([c_dest] if tipo_viaje == CIUDAD else paradas_lista), tipo_viaje, f_ida, f_vta,
+                        num_adultos, tuple(edades_ninos), viaja_mascota, estilo_viaje, pref_trans, tipo_vehiculo, modelo_coche,
+                        estilo_conduccion, pref_ida, pref_vta, solo_d)
+    anticipar(get_script_run_ctx().session_id, peticion) # Aeropuertos y vuelos a la caché antes de pulsar Planificar
+
+if st.session_state.busqueda_iniciada and f_ida and c_orig and c_dest:
+    # Toda la ejecución de la página, con perfil si está encendido (los fragmentos que se repiten solos no pasan por aquí)
+    with metricas.medir("pagina", perfilar=True, tipo="ciudad" if tipo_viaje == CIUDAD else "roadtrip"):
+        st.write("---")
+
+        # 🧠 PASO 0: AEROPUERTOS Y DISTANCIAS (en local; la IA solo si el primer salto no se puede medir)
+        if 'diagnostico' not in st.session_state:
+            with st.spinner("Mapeando aeropuertos más cercanos..."):
+                st.session_state.diagnostico = diagnosticar(peticion)
+        diag = st.session_state.diagnostico
+
+        panel_diagnostico(peticion, diag)
+
+        col_v, col_h = st.columns([1.1, 0.9])
+        with col_v:
+            panel_vuelos(peticion, diag, None if modo == "Exactas" else (m_sel[0], "puente" if modo.startswith("Puente") else "flexible"))
+            if tipo_viaje == ROADTRIP: panel_tramos(peticion, diag)
+
+        with col_h: panel_alojamiento(peticion)
+
+        # --- MAPA Y GUÍA ---
+        st.divider()
+        cm, cg = st.columns([0.4, 0.6])
+        with cm: panel_mapa(peticion, diag)
+        with cg: panel_guia(peticion)
@@ -0,0 +1,90 @@
+"""Ofertas de Amadeus en columnas.
+
+El JSON de flight_offers_search se recorre una sola vez y se guarda como arrays de NumPy
+(precio, hora de salida de cada tramo, escalas, aerolínea, maletas...). Deduplicar, quedarse
+con los directos, filtrar por franja horaria, ordenar y paginar son después operaciones
+vectorizadas, así que un cambio de filtro no vuelve a tocar el JSON.
+"""
+import numpy as np
+
+# Aerolíneas que cobran aparte la maleta de mano grande
+LOW_COST = ("FR", "VY", "U2", "W6")
+
+COLUMNAS = ("precio", "hora_ida", "hora_vta", "escalas_ida", "escalas_vta", "maletas",
+            "aerolinea", "nombre_aerolinea", "salida_ida", "salida_vta", "origen", "destino", "origen_vta", "huella")
+
+
+class TablaOfertas:
+    __slots__ = COLUMNAS
+
+    def __init__(self, **columnas):
+        for c in COLUMNAS: setattr(self, c, columnas[c])
+
+    @classmethod
+    def desde_respuesta(cls, res):
+        """Parsea el resultado crudo de Amadeus (dict con 'data' y 'dictionaries'). Los vuelos solo de ida llevan hora_vta = -1."""
+        ofertas = (res or {}).get("data") or []
+        carriers = (res or {}).get("dictionaries", {}).get("carriers", {})
+        filas = []
+        for v in ofertas:
+            it_i = v["itineraries"][0]["segments"]
+            it_v = v["itineraries"][1]["segments"] if len(v["itineraries"]) > 1 else None
+            aerolinea = (v.get("validatingAirlineCodes") or [it_i[0].get("carrierCode", "")])[0]
+            try: maletas = v["travelerPricings"][0]["fareDetailsBySegment"][0].get("includedCheckedBags", {}).get("quantity", 0)
+            except (KeyError, IndexError): maletas = 0
+            salida_i = it_i[0]["departure"]["at"]
+            salida_v = it_v[0]["departure"]["at"] if it_v else ""
+            filas.append((float(v["price"]["total"]), int(salida_i[11:13]), int(salida_v[11:13]) if it_v else -1,
+                          len(it_i) - 1, len(it_v) - 1 if it_v else 0, maletas,
+                          aerolinea, carriers.get(aerolinea, aerolinea), salida_i[11:16], salida_v[11:16],
+                          it_i[0]["departure"]["iataCode"], it_i[-1]["arrival"]["iataCode"],
+                          it_v[0]["departure"]["iataCode"] if it_v else "",
+                          f"{salida_i}|{v['price']['total']}"))
+        columnas = list(zip(*filas)) if filas else [()] * len(COLUMNAS)
+        tipos = (np.float64, np.int8, np.int8, np.int8, np.int8, np.int16, "U3", str, "U5", "U5", "U3", "U3", "U3", str)
+        return cls(**{c: np.array(valores, dtype=t) for c, valores, t in zip(COLUMNAS, columnas, tipos)})
+
+    def __len__(self):
+        return len(self.precio)
+
+    def seleccionar(self, indices):
+        """Nueva tabla con las filas indicadas (máscara booleana o índices)."""
+        return TablaOfertas(**{c: getattr(self, c)[indices] for c in COLUMNAS})
+
+    def sin_duplicados(self):
+        """Máscara de la primera aparición de cada (salida de ida, precio)."""
+        mascara = np.zeros(len(self), dtype=bool)
+        if len(self): mascara[np.unique(self.huella, return_index=True)[1]] = True
+        return mascara
+
+    def directos(self):
+        return (self.escalas_ida == 0) & (self.escalas_vta == 0)
+
+    def por_precio(self):
+        return self.seleccionar(np.argsort(self.precio, kind="stable"))
+
+    def pagina(self, numero, tamaño=10):
+        return self.seleccionar(slice((numero - 1) * tamaño, numero * tamaño))
+
+    def filas(self):
+        """Recorre las filas como dicts, solo para pintar la página visible."""
+        for i in range(len(self)):
+            yield {c: getattr(self, c)[i].item() for c in COLUMNAS}
+
+
+def en_franja(horas, bloque):
+    """Máscara de horas dentro de un bloque de BLOQUES_HORARIOS (los que cruzan medianoche incluidos).
+    Las horas negativas (tramo inexistente) siempre pasan."""
+    inicio, fin = bloque
+    dentro = (horas >= inicio) & (horas < fin) if inicio < fin else (horas >= inicio) | (horas < fin)
+    return dentro | (horas < 0)
+
+def filtrar_ofertas(tabla, solo_directos, bloque_ida, bloque_vta):
+    """Reglas de siempre: sin duplicados, directos si se piden y existen, y franjas horarias
+    salvo que no quede nada. Devuelve (tabla ordenada por precio, hay_directos)."""
+    unicos = tabla.seleccionar(tabla.sin_duplicados())
+    directos = unicos.directos()
+    base = unicos.seleccionar(directos) if solo_directos and directos.any() else unicos
+    franja = en_franja(base.hora_ida, bloque_ida) & en_franja(base.hora_vta, bloque_vta)
+    finales = base.seleccionar(franja) if franja.any() else base
+    return finales.por_precio(), bool(directos.any())